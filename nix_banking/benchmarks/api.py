@@ -0,0 +1,151 @@
+import argparse
+import json
+import random
+import resource
+import sys
+import time
+
+from benchmarks.common import benchmark_database, git_revision, percentile, seed_database, write_results
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from nix_app.cache import lookup_cache
+from nix_app.models import User, Transfer
+
+HEAVY_REQUEST_SHARE = 20
+
+
+class Scenario(object):
+    def __init__(self, name, make_request, heavy=False):
+        self.name = name
+        self.make_request = make_request
+        self.heavy = heavy
+
+
+def build_scenarios(generator):
+    user_ids = list(User.objects.values_list("id", flat=True))
+    transfer_ids = list(Transfer.non_deleted_objects().values_list("id", flat=True))
+    payers = list(Transfer.objects.values_list("payers_name", flat=True).distinct()[:1000])
+    months = ["2019-{:02d}".format(month) for month in range(1, 13)]
+
+    def create_transfer(client):
+        return client.post("/api/v1/transfer/new", content_type="application/json", data=json.dumps({
+            "user_id": generator.choice(user_ids), "payers_name": generator.choice(payers),
+            "payers_bank": "Itaú", "receivers_bank": "Caixa", "transfer_value": generator.randrange(1, 10000),
+            "creation_date": "2019-06-{:02d}T{:02d}:00:00".format(generator.randrange(1, 29),
+                                                                  generator.randrange(24))}))
+
+    return [
+        Scenario("create_transfer", create_transfer),
+        Scenario("list_transfers_page", lambda client: client.get(
+            "/api/v1/transfer/all", {"limit": 100, "cursor": generator.choice(transfer_ids)})),
+        Scenario("list_transfers_stream", lambda client: client.get(
+            "/api/v1/transfer/all", {"stream": "ndjson"}), heavy=True),
+        Scenario("list_transfers_full", lambda client: client.get("/api/v1/transfer/all"), heavy=True),
+        Scenario("list_users_page", lambda client: client.get("/api/v1/user/all", {"limit": 100})),
+        Scenario("filter_payer", lambda client: client.get(
+            "/api/v1/transfer/filter/payer/{}/".format(generator.choice(payers)))),
+        Scenario("filter_month", lambda client: client.get(
+            "/api/v1/transfer/filter/date/{}/".format(generator.choice(months))), heavy=True),
+        Scenario("query_combined", lambda client: client.get("/api/v1/transfer/filter", {
+            "payers_name": generator.choice(payers), "transfer_type": "TED", "date": generator.choice(months),
+            "fields": "id,transfer_value"})),
+        Scenario("transfer_total", lambda client: client.get("/api/v1/transfer/total")),
+        Scenario("transfer_summary", lambda client: client.get(
+            "/api/v1/transfer/summary", {"group_by": "transfer_type"}), heavy=True),
+        Scenario("user_lookup", lambda client: client.get(
+            "/api/v1/user/{}/".format(generator.choice(user_ids)))),
+        Scenario("transfer_lookup", lambda client: client.get(
+            "/api/v1/transfer/{}/".format(generator.choice(transfer_ids)))),
+    ]
+
+
+def run_scenario(scenario, requests):
+    client = Client()
+    latencies, query_counts, response_bytes = [], [], 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        with CaptureQueriesContext(connection) as queries:
+            request_started = time.perf_counter()
+            response = scenario.make_request(client)
+            content = b"".join(response.streaming_content) if response.streaming else response.content
+            latencies.append(time.perf_counter() - request_started)
+        if response.status_code >= 400:
+            raise RuntimeError("{} answered {}".format(scenario.name, response.status_code))
+        query_counts.append(len(queries))
+        response_bytes += len(content)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {"scenario": scenario.name,
+            "requests": requests,
+            "requests_per_second": requests / elapsed,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "queries_per_request": sum(query_counts) / requests,
+            "max_queries": max(query_counts),
+            "bytes_per_request": response_bytes / requests,
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def compare_results(previous, current, threshold):
+    previous_scenarios = {result["scenario"]: result for result in previous["scenarios"]}
+    regressions = []
+    for result in current["scenarios"]:
+        previous_result = previous_scenarios.get(result["scenario"])
+        if previous_result is None:
+            continue
+        change = (result["p95_ms"] - previous_result["p95_ms"]) / previous_result["p95_ms"]
+        marker = ""
+        if change > threshold or result["max_queries"] > previous_result["max_queries"]:
+            marker = "  REGRESSION"
+            regressions.append(result["scenario"])
+        print("{:<24} p95 {:>9.2f}ms -> {:>9.2f}ms ({:+.0%})  queries {} -> {}{}".format(
+            result["scenario"], previous_result["p95_ms"], result["p95_ms"], change,
+            previous_result["max_queries"], result["max_queries"], marker))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the nix_app API endpoints.")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--transfers", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=200,
+                        help="Requests per scenario; listing scenarios run a twentieth of them.")
+    parser.add_argument("--scenario", action="append", help="Run only the named scenarios.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--compare", help="Compare against a previous JSON results file.")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative p95 increase reported as a regression.")
+    arguments = parser.parse_args()
+
+    generator = random.Random(arguments.seed)
+    results = {"revision": git_revision(), "users": arguments.users, "transfers": arguments.transfers,
+               "requests": arguments.requests, "seed": arguments.seed, "scenarios": []}
+    with benchmark_database():
+        seed_started = time.perf_counter()
+        seed_database(arguments.users, arguments.transfers, arguments.seed)
+        print("Seeded {} users and {} transfers in {:.1f}s".format(
+            arguments.users, arguments.transfers, time.perf_counter() - seed_started))
+        for scenario in build_scenarios(generator):
+            if arguments.scenario and scenario.name not in arguments.scenario:
+                continue
+            lookup_cache().clear()
+            requests = max(1, arguments.requests // HEAVY_REQUEST_SHARE) if scenario.heavy else arguments.requests
+            result = run_scenario(scenario, requests)
+            results["scenarios"].append(result)
+            print("{scenario:<24} {requests:>5} req  {requests_per_second:>9.1f} req/s  p50 {p50_ms:>8.2f}ms  "
+                  "p95 {p95_ms:>8.2f}ms  p99 {p99_ms:>8.2f}ms  {queries_per_request:>6.1f} queries  "
+                  "rss {peak_rss_kb} kB".format(**result))
+
+    if arguments.output:
+        write_results(arguments.output, results)
+    if arguments.compare:
+        with open(arguments.compare) as previous_file:
+            if compare_results(json.load(previous_file), results, arguments.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import benchmark_database, git_revision, percentile, seed_database, write_results
+from django.db import connection
+from nix_app.models import User, Transfer
+
+SERVERS = {
+    "wsgi": ["-m", "gunicorn", "nix_banking.wsgi:application", "--worker-class", "sync", "--workers", "{workers}",
+             "--bind", "127.0.0.1:{port}", "--log-level", "warning"],
+    "asgi": ["-m", "uvicorn", "nix_banking.asgi:application", "--workers", "{workers}", "--host", "127.0.0.1",
+             "--port", "{port}", "--log-level", "warning", "--no-access-log"],
+}
+REQUEST_TIMEOUT = 10
+
+
+def free_port():
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+
+def start_server(mode, workers, port, database_path):
+    command = [sys.executable] + [part.format(workers=workers, port=port) for part in SERVERS[mode]]
+    environ = dict(os.environ, DATABASE_URL="sqlite:///" + database_path, NIX_DB_CONN_MAX_AGE="60")
+    server = subprocess.Popen(command, env=environ, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("{} server exited with {}".format(mode, server.returncode))
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("{} server did not start".format(mode))
+
+
+async def fetch(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write("GET {} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".format(path).encode())
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response.split(b" ", 2)[1]), len(response)
+
+
+async def slow_client(port, stop_at, trickle_seconds):
+    while time.monotonic() < stop_at:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /api/v1/transfer/total HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n")
+            for _ in range(int(trickle_seconds * 2)):
+                writer.write(b"X-Slow: 1\r\n")
+                await writer.drain()
+                await asyncio.sleep(0.5)
+            writer.write(b"\r\n")
+            await writer.drain()
+            await reader.read()
+            writer.close()
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+async def fast_client(port, paths, stop_at, generator, latencies, errors):
+    while time.monotonic() < stop_at:
+        started = time.perf_counter()
+        try:
+            status_code, _ = await asyncio.wait_for(fetch(port, generator.choice(paths)), REQUEST_TIMEOUT)
+            if status_code >= 400:
+                errors.append(status_code)
+            else:
+                latencies.append(time.perf_counter() - started)
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            errors.append("timeout")
+
+
+async def run_load(port, paths, concurrency, slow_clients, duration, trickle_seconds, seed):
+    stop_at = time.monotonic() + duration
+    latencies, errors = [], []
+    slow = [asyncio.ensure_future(slow_client(port, stop_at, trickle_seconds)) for _ in range(slow_clients)]
+    await asyncio.sleep(min(1, duration / 10))
+    started = time.perf_counter()
+    await asyncio.gather(*[fast_client(port, paths, stop_at, random.Random(seed + index), latencies, errors)
+                           for index in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    for task in slow:
+        task.cancel()
+    await asyncio.gather(*slow, return_exceptions=True)
+    latencies.sort()
+    return {"requests": len(latencies),
+            "requests_per_second": len(latencies) / elapsed,
+            "errors": len(errors),
+            "p50_ms": (percentile(latencies, 0.50) or 0) * 1000,
+            "p99_ms": (percentile(latencies, 0.99) or 0) * 1000}
+
+
+def read_paths():
+    user_ids = list(User.objects.values_list("id", flat=True)[:1000])
+    transfer_ids = list(Transfer.non_deleted_objects().values_list("id", flat=True)[:1000])
+    payers = list(Transfer.objects.values_list("payers_name", flat=True).distinct()[:100])
+    random.shuffle(user_ids)
+    return ["/api/v1/user/{}/".format(user_id) for user_id in user_ids[:50]] + \
+        ["/api/v1/transfer/{}/".format(transfer_id) for transfer_id in transfer_ids[:50]] + \
+        ["/api/v1/transfer/filter/payer/{}/".format(payer.replace(" ", "%20")) for payer in payers[:20]] + \
+        ["/api/v1/transfer/all?limit=50", "/api/v1/user/all?limit=50", "/api/v1/transfer/total"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare gunicorn (WSGI) and uvicorn (ASGI) under slow clients.")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--transfers", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=2, help="Server processes for both modes.")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent fast clients.")
+    parser.add_argument("--slow-clients", type=int, default=8,
+                        help="Clients that trickle their request headers, holding a connection open.")
+    parser.add_argument("--trickle-seconds", type=float, default=5)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--mode", action="append", choices=sorted(SERVERS), help="Run only these modes.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    arguments = parser.parse_args()
+
+    database_path = os.path.join(tempfile.mkdtemp(), "asgi_benchmark.sqlite3")
+    results = {"revision": git_revision(), "workers": arguments.workers, "concurrency": arguments.concurrency,
+               "slow_clients": arguments.slow_clients, "duration": arguments.duration, "modes": []}
+    with benchmark_database(database_path):
+        seed_database(arguments.users, arguments.transfers, arguments.seed)
+        paths = read_paths()
+        connection.close()
+        for mode in arguments.mode or sorted(SERVERS, reverse=True):
+            port = free_port()
+            server = start_server(mode, arguments.workers, port, database_path)
+            try:
+                result = asyncio.run(run_load(port, paths, arguments.concurrency, arguments.slow_clients,
+                                              arguments.duration, arguments.trickle_seconds, arguments.seed))
+            finally:
+                server.terminate()
+                server.wait()
+            result["mode"] = mode
+            results["modes"].append(result)
+            print("{mode:<5} {requests:>6} req  {requests_per_second:>8.1f} req/s  p50 {p50_ms:>8.2f}ms  "
+                  "p99 {p99_ms:>9.2f}ms  {errors} errors".format(**result))
+
+    if arguments.output:
+        write_results(arguments.output, results)
+
+
+if __name__ == "__main__":
+    main()
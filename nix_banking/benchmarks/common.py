@@ -0,0 +1,109 @@
+import contextlib
+import datetime
+import json
+import os
+import random
+import subprocess
+from io import StringIO
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "nix_banking.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment, teardown_test_environment  # noqa: E402
+from nix_app.models import User, Transfer  # noqa: E402
+
+SEED_BATCH_SIZE = 10000
+FIRST_DAY = datetime.date(2019, 1, 1)
+DAYS = 365
+BANKS = [("Banco do Brasil", 30), ("Itaú", 25), ("Bradesco", 20), ("Caixa", 15), ("Santander", 12),
+         ("Nubank", 8), ("Inter", 5), ("Sicoob", 3), ("Banrisul", 2), ("BTG", 1)]
+SAME_BANK_PROBABILITY = 0.3
+BUSINESS_HOUR_PROBABILITY = 0.8
+
+
+@contextlib.contextmanager
+def benchmark_database(test_name=None):
+    old_database_name = connection.settings_dict["NAME"]
+    if test_name:
+        connection.settings_dict["TEST"]["NAME"] = test_name
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_database_name, verbosity=0)
+        teardown_test_environment()
+
+
+def seed_database(users, transfers, seed=0, names=5000):
+    generator = random.Random(seed)
+    Transfer.objects.all().delete()
+    User.objects.all().delete()
+    User.objects.bulk_create([User(name="Empresa {:06d}".format(index), cnpj="{:014d}".format(index))
+                              for index in range(users)])
+    user_ids = list(User.objects.order_by("id").values_list("id", flat=True))
+    user_weights = _cumulative([1 / (rank + 1) ** 1.1 for rank in range(users)])
+    bank_names = [bank for bank, _ in BANKS]
+    bank_weights = _cumulative([weight for _, weight in BANKS])
+
+    for batch_start in range(0, transfers, SEED_BATCH_SIZE):
+        batch = []
+        for _ in range(batch_start, min(batch_start + SEED_BATCH_SIZE, transfers)):
+            payers_bank = generator.choices(bank_names, cum_weights=bank_weights)[0]
+            receivers_bank = payers_bank if generator.random() < SAME_BANK_PROBABILITY \
+                else generator.choices(bank_names, cum_weights=bank_weights)[0]
+            transfer = Transfer(
+                user_id_id=generator.choices(user_ids, cum_weights=user_weights)[0],
+                payers_name="Pagador {:05d}".format(generator.randrange(names)),
+                payers_bank=payers_bank,
+                payers_agency="{:04d}".format(generator.randrange(10000)),
+                payers_account="{:08d}".format(generator.randrange(10 ** 8)),
+                receivers_name="Recebedor {:05d}".format(generator.randrange(names)),
+                receivers_bank=receivers_bank,
+                receivers_agency="{:04d}".format(generator.randrange(10000)),
+                receivers_account="{:08d}".format(generator.randrange(10 ** 8)),
+                transfer_value=min(Transfer.MAX_TRANSFER_VALUE, max(1, int(generator.lognormvariate(6.5, 1.5)))),
+                creation_date=_random_datetime(generator))
+            transfer._prepare_for_save()
+            batch.append(transfer)
+        Transfer.objects.bulk_create(batch)
+    call_command("rebuild_transfer_aggregates", stdout=StringIO())
+
+
+def _random_datetime(generator):
+    day = FIRST_DAY + datetime.timedelta(days=generator.randrange(DAYS))
+    hour = generator.randrange(9, 18) if generator.random() < BUSINESS_HOUR_PROBABILITY else generator.randrange(24)
+    return datetime.datetime(day.year, day.month, day.day, hour, generator.randrange(60))
+
+
+def _cumulative(weights):
+    total, cumulative = 0, []
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return cumulative
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL) \
+            .decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, results):
+    with open(path, "w") as output_file:
+        json.dump(results, output_file, indent=2, default=str)
@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import benchmark_database, git_revision, percentile, write_results
+from django.db import connection, connections
+from django.test import Client
+from nix_app.backends.pool import connection_pool
+from nix_app.models import User
+
+CONFIGURATIONS = {
+    "default": {"PRAGMAS": {}, "CONN_MAX_AGE": 0, "POOL_SIZE": 0, "OPTIONS": {}},
+    "tuned": {"PRAGMAS": connection.settings_dict["PRAGMAS"], "CONN_MAX_AGE": 60, "POOL_SIZE": 16,
+              "OPTIONS": connection.settings_dict["OPTIONS"]},
+}
+
+
+def run_writers(threads, requests, user_ids, seed):
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def writer(index):
+        generator = random.Random(seed + index)
+        client = Client()
+        thread_latencies, thread_errors = [], 0
+        for _ in range(requests // threads):
+            started = time.perf_counter()
+            try:
+                response = client.post("/api/v1/transfer/new", content_type="application/json", data=json.dumps({
+                    "user_id": generator.choice(user_ids), "payers_bank": "Itaú", "receivers_bank": "Caixa",
+                    "transfer_value": generator.randrange(1, 10000),
+                    "creation_date": "2019-06-{:02d}T{:02d}:00:00".format(generator.randrange(1, 29),
+                                                                          generator.randrange(24))}))
+                failed = response.status_code != 201
+            except Exception:
+                failed = True
+            thread_latencies.append(time.perf_counter() - started)
+            thread_errors += failed
+        connections.close_all()
+        with lock:
+            latencies.extend(thread_latencies)
+            errors.append(thread_errors)
+
+    workers = [threading.Thread(target=writer, args=(index,)) for index in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {"threads": threads, "requests": len(latencies), "errors": sum(errors),
+            "writes_per_second": round((len(latencies) - sum(errors)) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2)}
+
+
+def benchmark_configuration(name, thread_counts, requests, seed):
+    connection.settings_dict.update(CONFIGURATIONS[name])
+    with tempfile.TemporaryDirectory() as directory:
+        with benchmark_database(os.path.join(directory, "benchmark.sqlite3")):
+            User.objects.bulk_create([User(name="Empresa {}".format(index)) for index in range(100)])
+            user_ids = list(User.objects.values_list("id", flat=True))
+            connection.close()
+            results = [run_writers(threads, requests, user_ids, seed) for threads in thread_counts]
+            pool = connection_pool(connection.settings_dict)
+            if pool is not None:
+                pool.clear()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent create_transfer throughput on a SQLite file "
+                                                 "with Django's default connection settings and the tuned ones.")
+    parser.add_argument("--threads", default="1,4,16", help="Comma separated writer thread counts.")
+    parser.add_argument("--requests", type=int, default=800, help="Requests per thread count.")
+    parser.add_argument("--configuration", action="append", choices=sorted(CONFIGURATIONS),
+                        help="Configurations to run; defaults to all.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    options = parser.parse_args(argv)
+    if connection.vendor != "sqlite":
+        parser.error("this benchmark compares SQLite settings; unset DATABASE_URL")
+
+    thread_counts = [int(threads) for threads in options.threads.split(",")]
+    results = {"revision": git_revision(), "configurations": {}}
+    for name in options.configuration or sorted(CONFIGURATIONS):
+        results["configurations"][name] = benchmark_configuration(name, thread_counts, options.requests,
+                                                                  options.seed)
+        for row in results["configurations"][name]:
+            print("{:<8} threads={threads:<3} writes/s={writes_per_second:<8} p50={p50_ms}ms p99={p99_ms}ms "
+                  "errors={errors}".format(name, **row))
+    if options.output:
+        write_results(options.output, results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
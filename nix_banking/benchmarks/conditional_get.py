@@ -0,0 +1,55 @@
+import argparse
+import time
+
+from benchmarks.common import benchmark_database, git_revision, seed_database, write_results
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+PATHS = ["/api/v1/transfer/all", "/api/v1/transfer/all?limit=100", "/api/v1/user/all", "/api/v1/transfer/total"]
+
+
+def measure(client, path, requests, headers):
+    response = client.get(path, **headers)
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        client.get(path, **headers)
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+    for _ in range(requests):
+        client.get(path, **headers)
+    return {"status": response.status_code,
+            "bytes": len(response.content),
+            "queries": len(queries),
+            "wall_ms": (time.perf_counter() - wall_started) / requests * 1000,
+            "cpu_ms": (time.process_time() - cpu_started) / requests * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare full and conditional (If-None-Match) GETs.")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--transfers", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=20, help="Requests per path and mode.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    arguments = parser.parse_args()
+
+    results = {"revision": git_revision(), "users": arguments.users, "transfers": arguments.transfers, "paths": []}
+    client = Client()
+    with benchmark_database():
+        seed_database(arguments.users, arguments.transfers, arguments.seed)
+        for path in PATHS:
+            etag = client.get(path)["ETag"]
+            full = measure(client, path, arguments.requests, {})
+            conditional = measure(client, path, arguments.requests, {"HTTP_IF_NONE_MATCH": etag})
+            result = {"path": path, "full": full, "conditional": conditional}
+            results["paths"].append(result)
+            print("{:<32} {:>9} B {:>3} queries {:>8.2f}ms cpu  ->  {} {:>3} B {:>3} queries {:>8.2f}ms cpu".format(
+                path, full["bytes"], full["queries"], full["cpu_ms"], conditional["status"], conditional["bytes"],
+                conditional["queries"], conditional["cpu_ms"]))
+
+    if arguments.output:
+        write_results(arguments.output, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import datetime
+import random
+import time
+
+from benchmarks.common import benchmark_database, git_revision, percentile, write_results
+from django.test import Client
+from nix_app.models import Transfer
+
+FIRST_NAMES = ["João", "José", "Antônio", "Francisco", "Luíza", "Maria", "Ana", "Conceição", "Sebastião", "Lúcia",
+               "Márcio", "Fábio", "Inês", "Rogério", "Cecília", "Otávio", "Vitória", "Estêvão", "Açucena", "Raí"]
+LAST_NAMES = ["Silva", "Santos", "Oliveira", "Souza", "Lima", "Pereira", "Gonçalves", "Araújo", "Simões", "Conceição",
+              "Fonseca", "Magalhães", "Brandão", "Galvão", "Assunção", "Falcão", "Peçanha", "Guimarães"]
+SEED_BATCH_SIZE = 10000
+
+
+def random_name(generator):
+    name = "{} {} {}".format(generator.choice(FIRST_NAMES), generator.choice(LAST_NAMES), generator.choice(LAST_NAMES))
+    return name.upper() if generator.random() < 0.2 else name
+
+
+def seed_transfers(count, generator):
+    creation_date = datetime.datetime(2019, 3, 1, 12)
+    for start in range(0, count, SEED_BATCH_SIZE):
+        batch = []
+        for _ in range(min(SEED_BATCH_SIZE, count - start)):
+            transfer = Transfer(payers_name=random_name(generator), receivers_name=random_name(generator),
+                                payers_bank="Itaú", receivers_bank="Caixa", transfer_value=generator.randrange(1, 5000),
+                                creation_date=creation_date)
+            transfer._prepare_for_save()
+            batch.append(transfer)
+        Transfer.objects.bulk_create(batch)
+
+
+def search_queries(generator, count):
+    queries = []
+    for _ in range(count):
+        name = random_name(generator)
+        queries.append(name[:generator.randrange(2, len(name) + 1)].lower())
+    return queries
+
+
+def time_search(client, queries, page_size):
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        response = client.get("/api/v1/transfer/search", {"q": query, "limit": page_size})
+        latencies.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise RuntimeError("search for {!r} answered {}".format(query, response.status_code))
+    return latencies
+
+
+def time_scan(queries, page_size):
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        list(Transfer.non_deleted_objects().filter(payers_name__icontains=query).order_by("id")
+             .values_list("id", "payers_name")[:page_size])
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def summarize(latencies):
+    latencies.sort()
+    return {"p50_ms": percentile(latencies, 0.50) * 1000, "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure indexed name search against an icontains scan.")
+    parser.add_argument("--transfers", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--scan-queries", type=int, default=20, help="Queries timed for the icontains baseline.")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--target-p95-ms", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    arguments = parser.parse_args()
+
+    generator = random.Random(arguments.seed)
+    results = {"revision": git_revision(), "transfers": arguments.transfers, "page_size": arguments.page_size}
+    with benchmark_database():
+        started = time.perf_counter()
+        seed_transfers(arguments.transfers, generator)
+        print("seeded {} transfers in {:.1f}s".format(arguments.transfers, time.perf_counter() - started))
+        queries = search_queries(generator, arguments.queries)
+        results["search"] = summarize(time_search(Client(), queries, arguments.page_size))
+        results["icontains_scan"] = summarize(time_scan(queries[:arguments.scan_queries], arguments.page_size))
+    results["target_p95_ms"] = arguments.target_p95_ms
+    results["target_met"] = results["search"]["p95_ms"] <= arguments.target_p95_ms
+    for name in ("search", "icontains_scan"):
+        print("{:<15} p50 {p50_ms:>9.2f}ms  p95 {p95_ms:>9.2f}ms  p99 {p99_ms:>9.2f}ms".format(name, **results[name]))
+    print("p95 target {:.0f}ms {}".format(arguments.target_p95_ms, "met" if results["target_met"] else "MISSED"))
+
+    if arguments.output:
+        write_results(arguments.output, results)
+
+
+if __name__ == "__main__":
+    main()
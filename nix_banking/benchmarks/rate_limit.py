@@ -0,0 +1,101 @@
+import argparse
+import threading
+import time
+
+from benchmarks.common import benchmark_database, git_revision, seed_database, write_results
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import Client, override_settings
+from nix_app.throttling import DjangoCacheRateLimitBackend, MemoryRateLimitBackend, bulkhead, rate_limiter
+
+BACKENDS = {
+    "memory": lambda: MemoryRateLimitBackend(),
+    "django_cache": lambda: DjangoCacheRateLimitBackend(),
+}
+
+
+def time_takes(backend, calls, clients, threads):
+    def worker(offset):
+        for index in range(offset, calls, threads):
+            backend.take("client-{}".format(index % clients), 1000000, 1000000)
+
+    workers = [threading.Thread(target=worker, args=(offset,)) for offset in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def time_bulkhead(calls):
+    def view(request):
+        return HttpResponse()
+
+    decorated = bulkhead("benchmark")(view)
+    with override_settings(NIX_BULKHEADS={"benchmark": {"MAX_CONCURRENT": 4}}):
+        timings = []
+        for target in (view, decorated):
+            started = time.perf_counter()
+            for _ in range(calls):
+                target(None)
+            timings.append((time.perf_counter() - started) / calls * 1e6)
+    return timings[1] - timings[0]
+
+
+def time_requests(path, requests, enabled):
+    budgets = {"cheap": {"RATE": 1000000, "BURST": 1000000}, "expensive": {"RATE": 1000000, "BURST": 1000000}}
+    client = Client()
+    with override_settings(NIX_RATE_LIMITS=dict(settings.NIX_RATE_LIMITS, ENABLED=enabled, BUDGETS=budgets)):
+        rate_limiter().clear()
+        for _ in range(min(100, requests)):
+            client.get(path)
+        started = time.perf_counter()
+        for _ in range(requests):
+            client.get(path)
+        return (time.perf_counter() - started) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the per-request overhead of rate limits and bulkheads.")
+    parser.add_argument("--calls", type=int, default=200000, help="Bucket takes per backend.")
+    parser.add_argument("--clients", type=int, default=10000, help="Distinct client keys.")
+    parser.add_argument("--threads", type=int, action="append", help="Thread counts (default 1 and 8).")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests through the test client per run.")
+    parser.add_argument("--rounds", type=int, default=5, help="Alternating runs per path; the fastest is kept.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    arguments = parser.parse_args()
+
+    results = {"revision": git_revision(), "calls": arguments.calls, "clients": arguments.clients,
+               "backends": [], "requests": []}
+    for name, make_backend in sorted(BACKENDS.items()):
+        for threads in arguments.threads or [1, 8]:
+            backend = make_backend()
+            backend.clear()
+            result = {"backend": name, "threads": threads,
+                      "us_per_take": time_takes(backend, arguments.calls, arguments.clients, threads)}
+            results["backends"].append(result)
+            print("take    {backend:<13} {threads:>2} threads  {us_per_take:>7.2f}us".format(**result))
+
+    results["bulkhead_us_per_view"] = time_bulkhead(arguments.calls)
+    print("bulkhead overhead per view {:>7.2f}us".format(results["bulkhead_us_per_view"]))
+
+    with benchmark_database():
+        seed_database(100, 1000)
+        for path in ("/api/v1/transfer/total", "/api/v1/transfer/all?limit=10"):
+            off, on = [], []
+            for _ in range(arguments.rounds):
+                off.append(time_requests(path, arguments.requests, False))
+                on.append(time_requests(path, arguments.requests, True))
+            off, on = min(off), min(on)
+            result = {"path": path, "us_disabled": off, "us_enabled": on, "us_overhead": on - off}
+            results["requests"].append(result)
+            print("request {path:<30} {us_disabled:>8.1f}us off  {us_enabled:>8.1f}us on  "
+                  "{us_overhead:>+7.1f}us".format(**result))
+
+    if arguments.output:
+        write_results(arguments.output, results)
+
+
+if __name__ == "__main__":
+    main()
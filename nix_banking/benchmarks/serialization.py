@@ -0,0 +1,80 @@
+import argparse
+import json
+import time
+import tracemalloc
+
+from benchmarks.common import benchmark_database, seed_database, write_results
+from rest_framework.renderers import JSONRenderer
+from nix_app.models import Transfer
+from nix_app.pagination import stream_rows
+from nix_app.serializers import dumps, transfer_row_serializer, transfer_rows, transfer_values
+
+USERS = 100
+
+
+def legacy_payload():
+    all_transfers_as_dict = []
+    for transfer in Transfer.non_deleted_objects().all():
+        transfer_dict = transfer.as_dict()
+        transfer_dict["user_id"] = transfer.user_id.id if transfer.user_id else None
+        all_transfers_as_dict.append(transfer_dict)
+    return JSONRenderer().render(json.dumps(all_transfers_as_dict))
+
+
+def compatible_payload():
+    return JSONRenderer().render(json.dumps(transfer_rows(Transfer.non_deleted_objects())))
+
+
+def raw_payload():
+    return dumps(transfer_rows(Transfer.non_deleted_objects()))
+
+
+def stream_payload():
+    response = stream_rows(transfer_values(Transfer.non_deleted_objects()), "ndjson", transfer_row_serializer())
+    return sum(len(chunk) for chunk in response.streaming_content)
+
+
+def measure(payload_function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        payload = payload_function()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        payload_function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(timings), "bytes": payload if isinstance(payload, int) else len(payload),
+            "peak_mb": peak / 2 ** 20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare transfer listing serialization paths.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-legacy", action="store_true",
+                        help="Skip the per-object path, which issues one user query per row.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    arguments = parser.parse_args()
+
+    results = []
+    with benchmark_database():
+        for rows in arguments.rows:
+            seed_database(USERS, rows)
+            paths = [("compatible", compatible_payload), ("raw", raw_payload), ("stream", stream_payload)]
+            if not arguments.skip_legacy:
+                paths.insert(0, ("legacy", legacy_payload))
+            for path_name, payload_function in paths:
+                result = dict(measure(payload_function, arguments.repeat), rows=rows, path=path_name)
+                results.append(result)
+                print("{rows:>9} rows  {path:<10} {seconds:>9.3f}s  {peak_mb:>9.1f}MB peak  {bytes:>12} bytes"
+                      .format(**result))
+
+    if arguments.output:
+        write_results(arguments.output, results)
+
+
+if __name__ == "__main__":
+    main()
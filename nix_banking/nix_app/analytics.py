@@ -0,0 +1,256 @@
+import array
+import bisect
+import datetime
+import heapq
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from nix_app.models import Transfer, transfers_changed
+
+DIMENSIONS = ("transfer_type", "user_id", "payers_bank", "receivers_bank", "payers_name", "receivers_name")
+STATE = ("first_day", "ids", "values", "days", "live", "codes", "dictionaries", "positions", "totals", "daily")
+DEFAULT_ANALYTICS_INDEX = {"ENABLED": True, "WINDOW_DAYS": 90, "MAX_AGE": 60}
+LOAD_CHUNK_SIZE = 10000
+_transfer_index = None
+_transfer_index_lock = threading.Lock()
+
+
+class Dictionary(object):
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class TransferIndex(object):
+    def __init__(self, window_days=90, max_age=60):
+        self.window_days = window_days
+        self.max_age = max_age
+        self.loaded_at = None
+        self.built = False
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._pending = None
+        self._generation = 0
+        self._clear()
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _clear(self):
+        self.first_day = (datetime.date.today() - datetime.timedelta(days=self.window_days)).toordinal()
+        self.ids = array.array("q")
+        self.values = array.array("q")
+        self.days = array.array("l")
+        self.live = bytearray()
+        self.codes = {dimension: array.array("l") for dimension in DIMENSIONS}
+        self.dictionaries = {dimension: Dictionary() for dimension in DIMENSIONS}
+        self.positions = {}
+        self.totals = {dimension: {} for dimension in DIMENSIONS}
+        self.daily = {}
+
+    def load(self):
+        # The new arrays are built without holding the lock. Updates that land meanwhile still apply to the
+        # current arrays and are replayed onto the new ones before they are swapped in.
+        with self._lock:
+            self._pending = []
+            generation = self._generation
+        try:
+            fresh = TransferIndex(self.window_days, self.max_age)
+            rows = Transfer.non_deleted_objects() \
+                .filter(creation_date__gte=datetime.date.fromordinal(fresh.first_day)) \
+                .values_list("id", "transfer_value", "creation_date", *DIMENSIONS)
+            for row in rows.iterator(chunk_size=LOAD_CHUNK_SIZE):
+                fresh._append(row)
+            with self._lock:
+                for transfer_id, row in self._pending:
+                    fresh._replace(transfer_id, row)
+                for name in STATE:
+                    setattr(self, name, getattr(fresh, name))
+                self.loaded_at = time.monotonic() if generation == self._generation else None
+                self.built = True
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def ensure_loaded(self):
+        if not self._stale():
+            return
+        # One thread rebuilds; the others answer from the current arrays meanwhile, and only wait when there are
+        # none yet.
+        if not self._load_lock.acquire(blocking=not self.built):
+            return
+        try:
+            if self._stale():
+                self.load()
+        finally:
+            self._load_lock.release()
+
+    def _stale(self):
+        with self._lock:
+            return self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self.loaded_at = None
+
+    def update(self, transfer_id, row):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((transfer_id, row))
+            if self.loaded_at is not None:
+                self._replace(transfer_id, row)
+
+    def remove(self, transfer_id):
+        self.update(transfer_id, None)
+
+    def _replace(self, transfer_id, row):
+        self._remove(transfer_id)
+        if row is not None:
+            self._append(row)
+
+    def _append(self, row):
+        transfer_id, transfer_value, creation_date = row[:3]
+        day = creation_date.toordinal()
+        if day < self.first_day:
+            return
+        if day not in self.daily:
+            self.daily[day] = dict({dimension: {} for dimension in DIMENSIONS}, histogram=Counter())
+        daily = self.daily[day]
+        self.positions[transfer_id] = len(self.ids)
+        self.ids.append(transfer_id)
+        self.values.append(transfer_value)
+        self.days.append(day)
+        self.live.append(1)
+        for dimension, value in zip(DIMENSIONS, row[3:]):
+            code = self.dictionaries[dimension].encode(value)
+            self.codes[dimension].append(code)
+            for totals in (daily[dimension].setdefault(code, [0, 0]), self.totals[dimension].setdefault(code, [0, 0])):
+                totals[0] += transfer_value
+                totals[1] += 1
+        daily["histogram"][transfer_value.bit_length()] += 1
+
+    def _remove(self, transfer_id):
+        position = self.positions.pop(transfer_id, None)
+        if position is None:
+            return
+        self.live[position] = 0
+        transfer_value = self.values[position]
+        daily = self.daily[self.days[position]]
+        for dimension in DIMENSIONS:
+            code = self.codes[dimension][position]
+            for totals in (daily[dimension][code], self.totals[dimension][code]):
+                totals[0] -= transfer_value
+                totals[1] -= 1
+        daily["histogram"][transfer_value.bit_length()] -= 1
+
+    def _first_day(self, days):
+        if days is None:
+            return self.first_day
+        if days < 1:
+            raise ValueError("Days must be positive, got {}".format(days))
+        return max(self.first_day, datetime.date.today().toordinal() - days + 1)
+
+    def group_by(self, dimension, days=None, limit=None):
+        if dimension not in DIMENSIONS:
+            raise ValueError("Cannot group transfers by {}".format(dimension))
+        self.ensure_loaded()
+        with self._lock:
+            first_day = self._first_day(days)
+            if first_day == self.first_day:
+                merged = self.totals[dimension]
+            else:
+                merged = {}
+                for day, daily in self.daily.items():
+                    if day < first_day:
+                        continue
+                    for code, (total, count) in daily[dimension].items():
+                        totals = merged.setdefault(code, [0, 0])
+                        totals[0] += total
+                        totals[1] += count
+            decode = self.dictionaries[dimension].values
+            rows = [{"group": decode[code], "total": total, "count": count}
+                    for code, (total, count) in merged.items() if count]
+        if limit is not None:
+            return heapq.nlargest(limit, rows, key=lambda row: row["total"])
+        return sorted(rows, key=lambda row: row["total"], reverse=True)
+
+    def histogram(self, days=None, edges=None):
+        self.ensure_loaded()
+        with self._lock:
+            first_day = self._first_day(days)
+            if edges is None:
+                buckets = Counter()
+                for day, daily in self.daily.items():
+                    if day >= first_day:
+                        buckets.update(daily["histogram"])
+                return [{"min": 2 ** (bucket - 1) if bucket else 0, "max": 2 ** bucket - 1, "count": count}
+                        for bucket, count in sorted(buckets.items()) if count]
+            edges = sorted(edges)
+            counts = [0] * (len(edges) + 1)
+            for transfer_value, day, live in zip(self.values, self.days, self.live):
+                if live and day >= first_day:
+                    counts[bisect.bisect_right(edges, transfer_value)] += 1
+        bounds = [None] + edges + [None]
+        return [{"min": bounds[index], "max": bounds[index + 1], "count": count} for index, count in enumerate(counts)]
+
+    def stats(self):
+        return {"transfers": len(self), "rows": len(self.ids), "days": len(self.daily),
+                "first_day": datetime.date.fromordinal(self.first_day).isoformat(),
+                "loaded": self.loaded_at is not None}
+
+
+def transfer_index():
+    global _transfer_index
+    config = dict(DEFAULT_ANALYTICS_INDEX, **getattr(settings, "NIX_ANALYTICS_INDEX", {}))
+    if not config["ENABLED"]:
+        return None
+    with _transfer_index_lock:
+        if _transfer_index is None:
+            _transfer_index = TransferIndex(config["WINDOW_DAYS"], config["MAX_AGE"])
+    return _transfer_index
+
+
+def _index_row(transfer):
+    if transfer.is_deleted:
+        return None
+    creation_date = transfer.creation_date.date() \
+        if isinstance(transfer.creation_date, datetime.datetime) else transfer.creation_date
+    return (transfer.id, transfer.transfer_value, creation_date) + \
+        tuple(getattr(transfer, "user_id_id" if dimension == "user_id" else dimension) for dimension in DIMENSIONS)
+
+
+# The index only follows committed writes, so a rolled back transaction leaves it untouched.
+def _transfer_saved(sender, instance, **kwargs):
+    index = _transfer_index
+    if index is not None:
+        transfer_id, row = instance.id, _index_row(instance)
+        transaction.on_commit(lambda: index.update(transfer_id, row))
+
+
+def _transfer_deleted(sender, instance, **kwargs):
+    index = _transfer_index
+    if index is not None:
+        transfer_id = instance.id
+        transaction.on_commit(lambda: index.remove(transfer_id))
+
+
+def _transfers_changed(sender, **kwargs):
+    index = _transfer_index
+    if index is not None:
+        transaction.on_commit(index.invalidate)
+
+
+post_save.connect(_transfer_saved, sender=Transfer, dispatch_uid="nix_app.analytics.transfer_saved")
+post_delete.connect(_transfer_deleted, sender=Transfer, dispatch_uid="nix_app.analytics.transfer_deleted")
+transfers_changed.connect(_transfers_changed, sender=Transfer, dispatch_uid="nix_app.analytics.transfers_changed")
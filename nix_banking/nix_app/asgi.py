@@ -0,0 +1,117 @@
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core import signals
+from django.core.handlers.wsgi import WSGIHandler, get_script_name
+from django.db import connections
+from django.urls import set_script_prefix
+
+def wsgi_environ(scope, body):
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {"REQUEST_METHOD": scope["method"],
+               "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin1"),
+               "PATH_INFO": scope["path"].encode("utf-8").decode("latin1"),
+               "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+               "SERVER_NAME": server_name,
+               "SERVER_PORT": str(server_port),
+               "SERVER_PROTOCOL": "HTTP/{}".format(scope.get("http_version", "1.1")),
+               "wsgi.version": (1, 0),
+               "wsgi.url_scheme": scope.get("scheme", "http"),
+               "wsgi.input": io.BytesIO(body),
+               "wsgi.errors": sys.stderr,
+               "wsgi.multithread": True,
+               "wsgi.multiprocess": True,
+               "wsgi.run_once": False}
+    if scope.get("client"):
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        value = value.decode("latin1")
+        environ[name] = "{},{}".format(environ[name], value) if name in environ else value
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+class ASGIHandler(WSGIHandler):
+    def __init__(self, *args, **kwargs):
+        super(ASGIHandler, self).__init__(*args, **kwargs)
+        self.executor = ThreadPoolExecutor(settings.NIX_ASGI_THREADS, thread_name_prefix="nix-asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.handle_http(scope, receive, send)
+        else:
+            raise ValueError("Unsupported ASGI scope type {}".format(scope["type"]))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def handle_http(self, scope, receive, send):
+        body = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        loop = asyncio.get_running_loop()
+        environ = wsgi_environ(scope, b"".join(body))
+        response = await loop.run_in_executor(self.executor, self.get_response_for, environ)
+        await send({"type": "http.response.start",
+                    "status": response.status_code,
+                    "headers": [(name.encode("latin1"), value.encode("latin1")) for name, value in response.items()] +
+                               [(b"Set-Cookie", cookie.output(header="").strip().encode("latin1"))
+                                for cookie in response.cookies.values()]})
+        if response.streaming:
+            await self.stream(response, send)
+        else:
+            try:
+                await send({"type": "http.response.body", "body": response.content})
+            finally:
+                await loop.run_in_executor(self.executor, response.close)
+
+    def get_response_for(self, environ):
+        set_script_prefix(get_script_name(environ))
+        signals.request_started.send(sender=self.__class__, environ=environ)
+        response = self.get_response(self.request_class(environ))
+        response._handler_class = self.__class__
+        return response
+
+    async def stream(self, response, send):
+        # A streamed response reads its rows through one database cursor, which has to stay on the thread and
+        # connection that opened it, so every stream gets a thread of its own rather than whichever pool thread is
+        # free. That thread idles while the client receives a chunk, so a slow client never holds a pool thread.
+        loop = asyncio.get_running_loop()
+        stream_executor = ThreadPoolExecutor(1, thread_name_prefix="nix-asgi-stream")
+        chunks = iter(response)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(stream_executor, next, chunks, None)
+                if chunk is None:
+                    break
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            await loop.run_in_executor(stream_executor, self.close_stream, response)
+            stream_executor.shutdown(wait=False)
+
+    @staticmethod
+    def close_stream(response):
+        try:
+            response.close()
+        finally:
+            connections.close_all()
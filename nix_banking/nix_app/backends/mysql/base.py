@@ -0,0 +1,6 @@
+from django.db.backends.mysql import base
+from nix_app.backends.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    pass
@@ -0,0 +1,65 @@
+import threading
+from django.db import DatabaseError
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool(object):
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            return self._idle.pop() if self._idle else None
+
+    def release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(connection)
+                return True
+        return False
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def __len__(self):
+        return len(self._idle)
+
+
+def connection_pool(settings_dict):
+    if not settings_dict.get("POOL_SIZE"):
+        return None
+    key = tuple(settings_dict.get(setting) for setting in ("ENGINE", "NAME", "HOST", "PORT", "USER"))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(settings_dict["POOL_SIZE"])
+        return _pools[key]
+
+
+class PooledDatabaseWrapperMixin(object):
+    def get_new_connection(self, conn_params):
+        pool = connection_pool(self.settings_dict)
+        connection = pool.acquire() if pool is not None else None
+        if connection is None:
+            connection = self.open_connection(conn_params)
+        return connection
+
+    def open_connection(self, conn_params):
+        return super(PooledDatabaseWrapperMixin, self).get_new_connection(conn_params)
+
+    def _close(self):
+        pool = connection_pool(self.settings_dict)
+        if pool is None or self.connection is None or (self.errors_occurred and not self.is_usable()):
+            return super(PooledDatabaseWrapperMixin, self)._close()
+        try:
+            self.connection.rollback()
+        except DatabaseError:
+            return super(PooledDatabaseWrapperMixin, self)._close()
+        if not pool.release(self.connection):
+            return super(PooledDatabaseWrapperMixin, self)._close()
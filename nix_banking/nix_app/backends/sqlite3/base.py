@@ -0,0 +1,10 @@
+from django.db.backends.sqlite3 import base
+from nix_app.backends.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    def open_connection(self, conn_params):
+        connection = super(DatabaseWrapper, self).open_connection(conn_params)
+        for pragma, value in self.settings_dict.get("PRAGMAS", {}).items():
+            connection.execute("PRAGMA {} = {}".format(pragma, value))
+        return connection
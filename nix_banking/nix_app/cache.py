@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+DEFAULT_LOOKUP_CACHE = {"BACKEND": "nix_app.cache.LRUCache", "OPTIONS": {}}
+_MISSING = object()
+_lookup_cache = None
+
+
+class BaseLookupCache(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_load(self, key, loader):
+        value = self.get(key)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def _record(self, value):
+        with self._lock:
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+
+class LRUCache(BaseLookupCache):
+    def __init__(self, max_size=10000, ttl=60):
+        super(LRUCache, self).__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        return self._record(_MISSING if entry is None else entry[1])
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return dict(super(LRUCache, self).stats(), size=len(self._entries), max_size=self.max_size)
+
+
+class DjangoCacheBackend(BaseLookupCache):
+    def __init__(self, alias="default", ttl=60, key_prefix="nix_app:lookup:"):
+        super(DjangoCacheBackend, self).__init__()
+        self.cache = caches[alias]
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+
+    def get(self, key):
+        return self._record(self.cache.get(self.key_prefix + key, _MISSING))
+
+    def set(self, key, value):
+        self.cache.set(self.key_prefix + key, value, self.ttl)
+
+    def delete(self, *keys):
+        self.cache.delete_many([self.key_prefix + key for key in keys])
+
+    def clear(self):
+        self.cache.clear()
+
+
+def lookup_cache():
+    global _lookup_cache
+    if _lookup_cache is None:
+        config = getattr(settings, "NIX_LOOKUP_CACHE", DEFAULT_LOOKUP_CACHE)
+        _lookup_cache = import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+    return _lookup_cache
+
+
+def user_key(user_id):
+    return "user:{}".format(user_id)
+
+
+def transfer_key(transfer_id):
+    return "transfer:{}".format(transfer_id)
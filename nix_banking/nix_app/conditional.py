@@ -0,0 +1,37 @@
+import calendar
+import functools
+import hashlib
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from nix_app.models import TableVersion
+
+
+def table_etag(request, versions):
+    digest = hashlib.sha1()
+    for table in sorted(versions):
+        digest.update("{}:{};".format(table, versions[table].version).encode())
+    # Pages, cursors and formats of one endpoint are different representations of the same tables.
+    digest.update(request.get_full_path().encode("utf-8"))
+    digest.update(request.META.get("HTTP_ACCEPT", "").encode("latin1"))
+    return quote_etag(digest.hexdigest())
+
+
+def conditional(*tables):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+            versions = TableVersion.current(tables)
+            etag = table_etag(request, versions)
+            last_modified = max(calendar.timegm(row.updated_at.utctimetuple()) for row in versions.values()) \
+                if versions else None
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified) or \
+                view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response["ETag"] = etag
+                if last_modified is not None:
+                    response["Last-Modified"] = http_date(last_modified)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,74 @@
+import csv
+import io
+import zlib
+from django.http import StreamingHttpResponse
+from nix_app.models import Transfer
+from nix_app.serializers import dumps, transfer_row_serializer, transfer_values
+
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def export_chunks(queryset, export_format, fields=Transfer.FIELD_NAMES, after_id=None,
+                  chunk_size=EXPORT_CHUNK_SIZE, compress=False):
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError("Unknown export format {}".format(export_format))
+    if chunk_size < 1:
+        raise ValueError("Chunk size must be positive, got {}".format(chunk_size))
+    serialize = transfer_row_serializer(fields)
+    row_chunks = keyset_chunks(transfer_values(queryset, fields), after_id, chunk_size)
+    if export_format == "csv":
+        content = _csv_chunks(row_chunks, serialize, fields, include_header=after_id is None)
+    else:
+        content = _ndjson_chunks(row_chunks, serialize)
+    if compress:
+        content = _gzip_chunks(content)
+    return content
+
+
+def export_response(queryset, export_format, fields=Transfer.FIELD_NAMES, after_id=None, compress=False):
+    content = export_chunks(queryset, export_format, fields, after_id, compress=compress)
+    filename = "transfers.{}{}".format(export_format, ".gz" if compress else "")
+    response = StreamingHttpResponse(content, content_type="application/gzip" if compress
+                                     else EXPORT_FORMATS[export_format])
+    response["Content-Disposition"] = 'attachment; filename="{}"'.format(filename)
+    return response
+
+
+def keyset_chunks(queryset, after_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+    while True:
+        chunk = queryset.filter(id__gt=after_id) if after_id is not None else queryset
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1][0]
+
+
+def _csv_chunks(row_chunks, serialize, fields, include_header):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if include_header:
+        writer.writerow(fields)
+    for rows in row_chunks:
+        writer.writerows(serialize(row).values() for row in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _ndjson_chunks(row_chunks, serialize):
+    for rows in row_chunks:
+        yield b"".join(dumps(serialize(row)) + b"\n" for row in rows)
+
+
+def _gzip_chunks(content):
+    compressor = zlib.compressobj(wbits=GZIP_WBITS)
+    for chunk in content:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,51 @@
+import functools
+import hashlib
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from nix_app.models import IdempotencyKey
+from nix_app.routers import client_id
+
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field("key").max_length
+
+
+def replay(stored, request_hash):
+    if stored.request_hash != request_hash:
+        return HttpResponse(status=422)
+    response = HttpResponse(stored.body, status=stored.status_code, content_type=stored.content_type or None)
+    if stored.location:
+        response["Location"] = stored.location
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def idempotent(scope):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request.META.get("HTTP_IDEMPOTENCY_KEY")
+            if not key or request.method != "POST":
+                return view(request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return HttpResponse(status=400)
+            client = client_id(request)
+            request_hash = hashlib.sha256(request.body).hexdigest()
+            stored = IdempotencyKey.lookup(client, scope, key)
+            if stored is not None:
+                return replay(stored, request_hash)
+            try:
+                with transaction.atomic():
+                    response = view(request, *args, **kwargs)
+                    if response.status_code < 500:
+                        if hasattr(response, "render"):
+                            response.render()
+                        IdempotencyKey.record(client, scope, key, request_hash, response,
+                                              settings.NIX_IDEMPOTENCY_KEY_TTL)
+            except IntegrityError:
+                stored = IdempotencyKey.lookup(client, scope, key)
+                if stored is None:
+                    raise
+                return replay(stored, request_hash)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,102 @@
+import csv
+import gzip
+import io
+import multiprocessing
+from collections import deque
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, connections, transaction
+from nix_app.models import User, Transfer, TransferAggregate, TableVersion, transfers_changed
+
+IMPORT_BATCH_SIZE = 5000
+IMPORT_FIELDS = tuple(field for field in Transfer._meta.concrete_fields if not field.primary_key)
+USER_ID_POSITION = IMPORT_FIELDS.index(Transfer._meta.get_field("user_id"))
+COPY_NULL = "\\N"
+
+
+def open_transfer_file(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8-sig", newline="")
+    return open(path, encoding="utf-8-sig", newline="")
+
+
+def read_batches(transfer_file, batch_size=IMPORT_BATCH_SIZE):
+    reader = csv.DictReader(transfer_file)
+    batch = []
+    for row in reader:
+        batch.append((reader.line_num, row))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parse_batch(batch):
+    parsed, rejected = [], []
+    for line, row in batch:
+        try:
+            transfer = Transfer._from_bulk_dict(row)
+            parsed.append((line, [field.get_db_prep_save(getattr(transfer, field.attname), connection)
+                                  for field in IMPORT_FIELDS], transfer._aggregate_contribution()))
+        except (ObjectDoesNotExist, TypeError, ValueError) as error:
+            rejected.append((line, str(error)))
+    return parsed, rejected
+
+
+def parsed_batches(batches, workers=1):
+    if workers == 1:
+        for batch in batches:
+            yield parse_batch(batch)
+        return
+    connections.close_all()
+    with multiprocessing.Pool(workers) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.apply_async(parse_batch, (batch,)))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def load_batch(parsed):
+    user_ids = {values[USER_ID_POSITION] for _, values, _ in parsed if values[USER_ID_POSITION] is not None}
+    existing_user_ids = set(User.objects.filter(id__in=user_ids).values_list("id", flat=True))
+    rows, contributions, rejected = [], [], []
+    for line, values, contribution in parsed:
+        user_id = values[USER_ID_POSITION]
+        if user_id is not None and user_id not in existing_user_ids:
+            rejected.append((line, "User with id {} does not exist.".format(user_id)))
+            continue
+        rows.append(values)
+        contributions.append(contribution)
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            _copy_rows(rows)
+        else:
+            _insert_rows(rows)
+        TransferAggregate.apply_deltas(TransferAggregate.contribution_deltas(contributions))
+        TableVersion.bump(TableVersion.TRANSFERS)
+    transfers_changed.send(sender=Transfer)
+    return len(rows), rejected
+
+
+def _columns():
+    return ", ".join(connection.ops.quote_name(field.column) for field in IMPORT_FIELDS)
+
+
+def _insert_rows(rows):
+    with connection.cursor() as cursor:
+        cursor.executemany("INSERT INTO {} ({}) VALUES ({})".format(
+            connection.ops.quote_name(Transfer._meta.db_table), _columns(),
+            ", ".join(["%s"] * len(IMPORT_FIELDS))), rows)
+
+
+def _copy_rows(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([COPY_NULL if value is None else value for value in row] for row in rows)
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert("COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '{}')".format(
+            connection.ops.quote_name(Transfer._meta.db_table), _columns(), COPY_NULL), buffer)
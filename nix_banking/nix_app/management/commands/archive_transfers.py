@@ -0,0 +1,40 @@
+import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min, Max
+from nix_app.models import Transfer
+
+
+class Command(BaseCommand):
+    help = "Moves soft-deleted transfers, and transfers created before a month, to the archive table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--before", help="Archive transfers created before this month (YYYY-MM). Defaults to "
+                                             "NIX_ARCHIVE_AFTER_MONTHS months ago.")
+        parser.add_argument("--deleted-only", action="store_true", help="Only archive soft-deleted transfers.")
+        parser.add_argument("--chunk-size", type=int, default=5000,
+                            help="Number of transfer ids archived per transaction.")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the transfers to archive.")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+        before = None if options["deleted_only"] else self._before(options["before"])
+        archived = 0
+        bounds = Transfer.objects.aggregate(min_id=Min("id"), max_id=Max("id"))
+        if bounds["min_id"] is not None:
+            for start_id in range(bounds["min_id"], bounds["max_id"] + 1, options["chunk_size"]):
+                archived += Transfer.archive(start_id, start_id + options["chunk_size"], before, options["dry_run"])
+        self.stdout.write("{} {} transfers{}.".format(
+            "Would archive" if options["dry_run"] else "Archived", archived,
+            " created before {} or deleted".format(before.isoformat()) if before else " deleted"))
+
+    def _before(self, before):
+        if before:
+            try:
+                return Transfer._date_period(before)[0].replace(day=1)
+            except ValueError:
+                raise CommandError("--before must look like YYYY-MM, got {}".format(before))
+        today = datetime.date.today()
+        months = today.year * 12 + today.month - 1 - settings.NIX_ARCHIVE_AFTER_MONTHS
+        return datetime.date(months // 12, months % 12 + 1, 1)
@@ -0,0 +1,46 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+from nix_app.exports import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_chunks
+from nix_app.models import Transfer
+
+
+class Command(BaseCommand):
+    help = "Streams non-deleted transfers as CSV or NDJSON, optionally gzip compressed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+        parser.add_argument("--output", help="File to write to; defaults to standard output.")
+        parser.add_argument("--gzip", action="store_true", help="Compress the export with gzip.")
+        parser.add_argument("--after-id", type=int, help="Resume after the transfer with this id.")
+        parser.add_argument("--fields", help="Comma separated transfer fields to export.")
+        parser.add_argument("--filter", action="append", default=[], metavar="PARAM=VALUE",
+                            help="Filter like the transfer filter endpoint, e.g. --filter date=2019-03.")
+        parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            chunks = export_chunks(Transfer.filter_by_params(self._filters(options["filter"])), options["format"],
+                                   Transfer.projection_fields(options["fields"]), options["after_id"],
+                                   options["chunk_size"], options["gzip"])
+            if options["output"]:
+                with open(options["output"], "wb") as output:
+                    self._write(chunks, output)
+            else:
+                self._write(chunks, sys.stdout.buffer)
+        except ValueError as error:
+            raise CommandError(error)
+
+    def _filters(self, filter_options):
+        filters = QueryDict(mutable=True)
+        for filter_option in filter_options:
+            param, separator, value = filter_option.partition("=")
+            if not separator:
+                raise CommandError("Filters must look like PARAM=VALUE, got {}".format(filter_option))
+            filters.appendlist(param, value)
+        return filters
+
+    def _write(self, chunks, output):
+        for chunk in chunks:
+            output.write(chunk)
+        output.flush()
@@ -0,0 +1,34 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from nix_app.imports import IMPORT_BATCH_SIZE, load_batch, open_transfer_file, parsed_batches, read_batches
+
+
+class Command(BaseCommand):
+    help = "Imports transfers from a CSV settlement file whose columns are named like the create_transfer fields."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV file to import; files ending in .gz are decompressed.")
+        parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE,
+                            help="Number of rows validated and loaded per transaction.")
+        parser.add_argument("--workers", type=int, default=1,
+                            help="Number of processes parsing and validating rows.")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1 or options["workers"] < 1:
+            raise CommandError("--batch-size and --workers must be positive")
+        imported, rejected = 0, 0
+        started = time.perf_counter()
+        try:
+            with open_transfer_file(options["path"]) as transfer_file:
+                batches = read_batches(transfer_file, options["batch_size"])
+                for parsed, parse_rejected in parsed_batches(batches, options["workers"]):
+                    loaded, load_rejected = load_batch(parsed)
+                    imported += loaded
+                    for line, error in sorted(parse_rejected + load_rejected):
+                        self.stderr.write("Rejected line {}: {}".format(line, error))
+                        rejected += 1
+        except OSError as error:
+            raise CommandError(error)
+        elapsed = time.perf_counter() - started
+        self.stdout.write("Imported {} transfers in {:.1f}s ({:.0f} rows/s), rejected {} lines.".format(
+            imported, elapsed, (imported + rejected) / elapsed if elapsed else 0, rejected))
@@ -0,0 +1,49 @@
+import multiprocessing
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, OperationalError
+from nix_app.models import TransferIntake
+
+
+def drain_intake(batch_size, once, poll_interval):
+    connections.close_all()
+    processed = 0
+    while True:
+        try:
+            batch = TransferIntake.process_batch(batch_size)
+        except OperationalError:
+            batch = None
+        if batch:
+            processed += batch
+        elif batch == 0 and once:
+            return processed
+        else:
+            time.sleep(poll_interval)
+
+
+class Command(BaseCommand):
+    help = "Processes transfers queued by asynchronous create_transfer requests with a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(),
+                            help="Number of worker processes; 1 processes the queue in this process.")
+        parser.add_argument("--batch-size", type=int, default=TransferIntake.BATCH_SIZE,
+                            help="Number of queued transfers each worker claims and commits at a time.")
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty.")
+        parser.add_argument("--poll-interval", type=float, default=1.0,
+                            help="Seconds to wait before polling an empty or locked queue again.")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--workers and --batch-size must be positive")
+        worker_arguments = (options["batch_size"], options["once"], options["poll_interval"])
+        started = time.perf_counter()
+        if options["workers"] == 1:
+            processed = drain_intake(*worker_arguments)
+        else:
+            connections.close_all()
+            with multiprocessing.Pool(options["workers"]) as pool:
+                processed = sum(pool.starmap(drain_intake, [worker_arguments] * options["workers"]))
+        elapsed = time.perf_counter() - started
+        self.stdout.write("Processed {} queued transfers in {:.1f}s ({:.0f} transfers/s).".format(
+            processed, elapsed, processed / elapsed if elapsed else 0))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from nix_app.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Deletes expired idempotency keys in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=IdempotencyKey.PURGE_BATCH_SIZE,
+                            help="Number of keys deleted per query.")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        purged = IdempotencyKey.purge_expired(options["batch_size"])
+        self.stdout.write("Purged {} expired idempotency keys.".format(purged))
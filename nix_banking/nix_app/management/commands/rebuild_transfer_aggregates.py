@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Min, Max
+from nix_app.models import Transfer, TransferAggregate, TableVersion
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the transfer running totals from the transfers table, or reconciles them with --reconcile."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reconcile", action="store_true",
+                            help="Only adjust the totals that differ from the transfers table.")
+        parser.add_argument("--chunk-size", type=int, default=100000,
+                            help="Number of transfer ids aggregated per query.")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+        with transaction.atomic():
+            self._lock_transfers()
+            expected_totals = self._expected_totals(options["chunk_size"])
+            if options["reconcile"]:
+                adjusted = self._reconcile(expected_totals)
+                self.stdout.write("Adjusted {} of {} transfer totals.".format(adjusted, len(expected_totals)))
+            else:
+                TransferAggregate.objects.all().delete()
+                TransferAggregate.objects.bulk_create(
+                    [TransferAggregate(user_id_id=user_id, transfer_type=transfer_type, day=day, total=total,
+                                       count=count)
+                     for (user_id, transfer_type, day), (total, count) in expected_totals.items()])
+                self.stdout.write("Rebuilt {} transfer totals.".format(len(expected_totals)))
+            TableVersion.bump(TableVersion.TRANSFERS)
+
+    def _lock_transfers(self):
+        # Transfers written while the totals are summed would be missed or counted twice, so hold writers off.
+        table = connection.ops.quote_name(Transfer._meta.db_table)
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("LOCK TABLE {} IN SHARE MODE".format(table))
+            elif connection.vendor == "sqlite":
+                cursor.execute("UPDATE {0} SET {1} = {1} WHERE 0 = 1".format(table, connection.ops.quote_name("id")))
+            else:
+                list(Transfer.objects.select_for_update().values_list("id", flat=True))
+
+    def _expected_totals(self, chunk_size):
+        expected_totals = {}
+        bounds = Transfer.objects.aggregate(min_id=Min("id"), max_id=Max("id"))
+        if bounds["min_id"] is None:
+            return expected_totals
+        for start_id in range(bounds["min_id"], bounds["max_id"] + 1, chunk_size):
+            for key, (total, count) in TransferAggregate.expected_deltas(start_id, start_id + chunk_size).items():
+                current_total, current_count = expected_totals.get(key, (0, 0))
+                expected_totals[key] = (current_total + total, current_count + count)
+        return expected_totals
+
+    def _reconcile(self, expected_totals):
+        differences = dict(expected_totals)
+        for aggregate in TransferAggregate.objects.iterator():
+            key = (aggregate.user_id_id, aggregate.transfer_type, aggregate.day)
+            total, count = differences.get(key, (0, 0))
+            differences[key] = (total - aggregate.total, count - aggregate.count)
+        differences = {key: delta for key, delta in differences.items() if delta != (0, 0)}
+        TransferAggregate.apply_deltas(differences)
+        TransferAggregate.objects.filter(total=0, count=0).delete()
+        return len(differences)
@@ -0,0 +1,26 @@
+from collections import Counter
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min, Max
+from nix_app.models import Transfer
+
+
+class Command(BaseCommand):
+    help = "Re-applies the transfer type rules to stored transfers with set-based UPDATEs over id ranges."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=100000,
+                            help="Number of transfer ids reclassified per transaction.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report the changes.")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+        changes = Counter()
+        bounds = Transfer.objects.aggregate(min_id=Min("id"), max_id=Max("id"))
+        if bounds["min_id"] is not None:
+            for start_id in range(bounds["min_id"], bounds["max_id"] + 1, options["chunk_size"]):
+                changes.update(Transfer.reclassify(start_id, start_id + options["chunk_size"], options["dry_run"]))
+        self.stdout.write("{} {} transfers.".format("Would reclassify" if options["dry_run"] else "Reclassified",
+                                                    sum(changes.values())))
+        for (old_type, new_type), count in sorted(changes.items()):
+            self.stdout.write("{} -> {}: {}".format(old_type, new_type, count))
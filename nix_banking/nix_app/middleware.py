@@ -0,0 +1,164 @@
+import bisect
+import contextlib
+import logging
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_DUPLICATE_QUERY_THRESHOLD = 3
+
+
+class ViewMetrics(object):
+    def __init__(self):
+        self.requests = 0
+        self.wall_seconds = 0.0
+        self.db_seconds = 0.0
+        self.render_seconds = 0.0
+        self.queries = 0
+        self.duplicate_queries = 0
+        self.n_plus_one_requests = 0
+        self.response_bytes = 0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view, wall_seconds, db_seconds, render_seconds, queries, duplicate_queries, response_bytes):
+        with self._lock:
+            metrics = self._views.get(view)
+            if metrics is None:
+                metrics = self._views[view] = ViewMetrics()
+            metrics.requests += 1
+            metrics.wall_seconds += wall_seconds
+            metrics.db_seconds += db_seconds
+            metrics.render_seconds += render_seconds
+            metrics.queries += queries
+            metrics.duplicate_queries += duplicate_queries
+            metrics.n_plus_one_requests += 1 if duplicate_queries else 0
+            metrics.response_bytes += response_bytes
+            bucket = bisect.bisect_left(DURATION_BUCKETS, wall_seconds)
+            if bucket < len(DURATION_BUCKETS):
+                metrics.buckets[bucket] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {view: dict(vars(metrics), buckets=list(metrics.buckets)) for view, metrics in self._views.items()}
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+    def as_prometheus_text(self):
+        lines = []
+        snapshot = sorted(self.snapshot().items())
+        counters = [("nix_http_requests_total", "requests", "Requests handled per view."),
+                    ("nix_db_queries_total", "queries", "SQL queries issued per view."),
+                    ("nix_db_query_duration_seconds_total", "db_seconds", "Time spent in SQL per view."),
+                    ("nix_render_duration_seconds_total", "render_seconds", "Time spent rendering responses."),
+                    ("nix_db_duplicate_queries_total", "duplicate_queries", "Repeated SQL statements per view."),
+                    ("nix_n_plus_one_requests_total", "n_plus_one_requests", "Requests with repeated SQL."),
+                    ("nix_http_response_bytes_total", "response_bytes", "Response bytes sent per view.")]
+        for name, field, description in counters:
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} counter".format(name))
+            for view, metrics in snapshot:
+                lines.append('{}{{view="{}"}} {}'.format(name, view, metrics[field]))
+        name = "nix_http_request_duration_seconds"
+        lines.append("# HELP {} Wall time per request.".format(name))
+        lines.append("# TYPE {} histogram".format(name))
+        for view, metrics in snapshot:
+            cumulative_count = 0
+            for bucket, count in zip(DURATION_BUCKETS, metrics["buckets"]):
+                cumulative_count += count
+                lines.append('{}_bucket{{view="{}",le="{}"}} {}'.format(name, view, bucket, cumulative_count))
+            lines.append('{}_bucket{{view="{}",le="+Inf"}} {}'.format(name, view, metrics["requests"]))
+            lines.append('{}_sum{{view="{}"}} {}'.format(name, view, metrics["wall_seconds"]))
+            lines.append('{}_count{{view="{}"}} {}'.format(name, view, metrics["requests"]))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class QueryRecorder(object):
+    def __init__(self):
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.statements[sql] += 1
+
+    def duplicate_queries(self, threshold):
+        return sum(count - 1 for count in self.statements.values() if count >= threshold)
+
+
+class RequestMetricsMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.duplicate_threshold = getattr(settings, "NIX_METRICS_DUPLICATE_QUERY_THRESHOLD",
+                                           DEFAULT_DUPLICATE_QUERY_THRESHOLD)
+        self.server_timing = getattr(settings, "NIX_METRICS_SERVER_TIMING", False)
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request._render_seconds = 0.0
+        started = time.perf_counter()
+        with self._recording(recorder):
+            response = self.get_response(request)
+        view = request.resolver_match.url_name if getattr(request, "resolver_match", None) else "unresolved"
+
+        if response.streaming:
+            response.streaming_content = self._instrument_stream(request, view, response.streaming_content,
+                                                                 recorder, started)
+            return response
+        wall_seconds = self._record(request, view, recorder, started, len(response.content))
+        if self.server_timing:
+            response["Server-Timing"] = 'app;dur={:.2f}, db;dur={:.2f};desc="{} queries", render;dur={:.2f}'.format(
+                wall_seconds * 1000, recorder.seconds * 1000, sum(recorder.statements.values()),
+                request._render_seconds * 1000)
+        return response
+
+    def process_template_response(self, request, response):
+        started = time.perf_counter()
+
+        def record_render_time(rendered_response):
+            request._render_seconds += time.perf_counter() - started
+        response.add_post_render_callback(record_render_time)
+        return response
+
+    def _instrument_stream(self, request, view, streaming_content, recorder, started):
+        streamed_bytes = 0
+        with self._recording(recorder):
+            for chunk in streaming_content:
+                streamed_bytes += len(chunk)
+                yield chunk
+        self._record(request, view, recorder, started, streamed_bytes)
+
+    def _record(self, request, view, recorder, started, response_bytes):
+        wall_seconds = time.perf_counter() - started
+        duplicate_queries = recorder.duplicate_queries(self.duplicate_threshold)
+        if duplicate_queries:
+            logger.warning("%s repeated SQL statements %s times", view, duplicate_queries)
+        registry.record(view, wall_seconds, recorder.seconds, request._render_seconds,
+                        sum(recorder.statements.values()), duplicate_queries, response_bytes)
+        return wall_seconds
+
+    @staticmethod
+    def _recording(recorder):
+        stack = contextlib.ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        return stack
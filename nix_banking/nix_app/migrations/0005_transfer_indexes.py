@@ -0,0 +1,25 @@
+# Generated by Django 2.1.7 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nix_app', '0004_auto_20190227_0226'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['is_deleted', 'creation_date'], name='transfer_deleted_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['is_deleted', 'payers_name'], name='transfer_deleted_payer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['is_deleted', 'receivers_name'], name='transfer_deleted_receiver_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.1.7 on 2026-10-18 10:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_aggregates(apps, schema_editor):
+    schema_editor.execute(
+        'INSERT INTO nix_app_transferaggregate (user_id_id, transfer_type, day, total, count) '
+        'SELECT user_id_id, transfer_type, creation_date, SUM(transfer_value), COUNT(id) FROM nix_app_transfer '
+        'WHERE is_deleted = %s GROUP BY user_id_id, transfer_type, creation_date', params=[False])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nix_app', '0005_transfer_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferAggregate',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('transfer_type', models.CharField(choices=[('CC', 'CC'), ('TED', 'TED'), ('DOC', 'DOC')], max_length=3, verbose_name='Tipo da transferência')),
+                ('day', models.DateField(verbose_name='Dia')),
+                ('total', models.BigIntegerField(default=0, verbose_name='Valor total')),
+                ('count', models.BigIntegerField(default=0, verbose_name='Quantidade')),
+                ('user_id', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='transfer_aggregates', to='nix_app.User', verbose_name='Totais de transferências')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='transferaggregate',
+            unique_together={('user_id', 'transfer_type', 'day')},
+        ),
+        migrations.RunPython(backfill_aggregates, migrations.RunPython.noop),
+    ]
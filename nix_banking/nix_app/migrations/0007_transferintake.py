@@ -0,0 +1,32 @@
+# Generated by Django 2.1.7 on 2026-10-18 11:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nix_app', '0006_transferaggregate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferIntake',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('payload', models.TextField(verbose_name='Dados da transferência')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('processing', 'processing'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=10, verbose_name='Situação')),
+                ('error', models.TextField(default='', verbose_name='Erro')),
+                ('claimed_by', models.CharField(default='', max_length=32, verbose_name='Processado por')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Recebida em')),
+                ('claimed_at', models.DateTimeField(null=True, verbose_name='Em processamento desde')),
+                ('processed_at', models.DateTimeField(null=True, verbose_name='Processada em')),
+                ('transfer_id', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='intakes', to='nix_app.Transfer', verbose_name='Transferência')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='transferintake',
+            index=models.Index(fields=['status', 'id'], name='intake_status_idx'),
+        ),
+    ]
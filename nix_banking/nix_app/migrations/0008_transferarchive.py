@@ -0,0 +1,39 @@
+# Generated by Django 2.1.7 on 2026-10-18 13:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nix_app', '0007_transferintake'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferArchive',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('payers_name', models.CharField(default='', max_length=128, verbose_name='Nome do pagador')),
+                ('payers_bank', models.CharField(default='', max_length=128, verbose_name='Banco do pagador')),
+                ('payers_agency', models.CharField(default='', max_length=128, verbose_name='Agência do pagador')),
+                ('payers_account', models.CharField(default='', max_length=128, verbose_name='Conta do pagador')),
+                ('receivers_name', models.CharField(default='', max_length=128, verbose_name='Nome do recebedor')),
+                ('receivers_bank', models.CharField(default='', max_length=128, verbose_name='Banco do recebedor')),
+                ('receivers_agency', models.CharField(default='', max_length=128, verbose_name='Agência do recebedor')),
+                ('receivers_account', models.CharField(default='', max_length=128, verbose_name='Conta do recebedor')),
+                ('transfer_value', models.PositiveIntegerField(default=1, verbose_name='Valor da Transferência')),
+                ('transfer_type', models.CharField(choices=[('CC', 'CC'), ('TED', 'TED'), ('DOC', 'DOC')], default='DOC', max_length=3, verbose_name='Tipo da transferência')),
+                ('creation_date', models.DateField(verbose_name='Data de criação')),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('month', models.DateField(verbose_name='Mês')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Arquivada em')),
+                ('user_id', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_transfers', to='nix_app.User', verbose_name='Transferências arquivadas')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='transferarchive',
+            index=models.Index(fields=['is_deleted', 'month', 'creation_date'], name='archive_deleted_month_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.1.7 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nix_app', '0008_transferarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('client', models.CharField(max_length=128, verbose_name='Cliente')),
+                ('scope', models.CharField(max_length=32, verbose_name='Operação')),
+                ('key', models.CharField(max_length=255, verbose_name='Chave de idempotência')),
+                ('request_hash', models.CharField(max_length=64, verbose_name='Hash da requisição')),
+                ('status_code', models.PositiveSmallIntegerField(verbose_name='Status da resposta')),
+                ('content_type', models.CharField(default='', max_length=128, verbose_name='Tipo da resposta')),
+                ('body', models.TextField(default='', verbose_name='Corpo da resposta')),
+                ('location', models.CharField(default='', max_length=255, verbose_name='Location da resposta')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Criada em')),
+                ('expires_at', models.DateTimeField(verbose_name='Expira em')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='idempotencykey',
+            unique_together={('client', 'scope', 'key')},
+        ),
+        migrations.AddIndex(
+            model_name='idempotencykey',
+            index=models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ),
+    ]
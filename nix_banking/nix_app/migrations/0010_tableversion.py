@@ -0,0 +1,29 @@
+# Generated by Django 2.1.7 on 2026-10-18 16:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def create_table_versions(apps, schema_editor):
+    TableVersion = apps.get_model('nix_app', 'TableVersion')
+    for table in ('transfer', 'user'):
+        TableVersion.objects.using(schema_editor.connection.alias).get_or_create(table=table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nix_app', '0009_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableVersion',
+            fields=[
+                ('table', models.CharField(max_length=32, primary_key=True, serialize=False, verbose_name='Tabela')),
+                ('version', models.BigIntegerField(default=0, verbose_name='Versão')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Alterada em')),
+            ],
+        ),
+        migrations.RunPython(create_table_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 2.1.7 on 2026-10-18 17:05
+
+import unicodedata
+
+from django.db import migrations, models
+
+BACKFILL_BATCH_SIZE = 5000
+TRIGRAM_INDEXES = (('transfer_payer_search_trgm', 'payers_name_search'),
+                   ('transfer_receiver_search_trgm', 'receivers_name_search'))
+
+
+# A copy of nix_app.models.normalize_name as of this migration, so later changes to it do not alter history.
+def normalize_name(name, max_length=128):
+    decomposed = unicodedata.normalize("NFKD", name or "")
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())[:max_length]
+
+
+def backfill_search_names(apps, schema_editor):
+    Transfer = apps.get_model('nix_app', 'Transfer')
+    transfers = Transfer.objects.using(schema_editor.connection.alias).only('id', 'payers_name', 'receivers_name')
+    batch = []
+    for transfer in transfers.order_by('id').iterator(chunk_size=BACKFILL_BATCH_SIZE):
+        transfer.payers_name_search = normalize_name(transfer.payers_name)
+        transfer.receivers_name_search = normalize_name(transfer.receivers_name)
+        batch.append(transfer)
+        if len(batch) == BACKFILL_BATCH_SIZE:
+            Transfer.objects.using(schema_editor.connection.alias).bulk_update(
+                batch, ['payers_name_search', 'receivers_name_search'])
+            batch = []
+    Transfer.objects.using(schema_editor.connection.alias).bulk_update(
+        batch, ['payers_name_search', 'receivers_name_search'])
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, column in TRIGRAM_INDEXES:
+        schema_editor.execute('CREATE INDEX {} ON nix_app_transfer USING gin ({} gin_trgm_ops)'.format(name, column))
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in TRIGRAM_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nix_app', '0010_tableversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transfer',
+            name='payers_name_search',
+            field=models.CharField(default='', editable=False, max_length=128,
+                                   verbose_name='Nome do pagador normalizado'),
+        ),
+        migrations.AddField(
+            model_name='transfer',
+            name='receivers_name_search',
+            field=models.CharField(default='', editable=False, max_length=128,
+                                   verbose_name='Nome do recebedor normalizado'),
+        ),
+        migrations.RunPython(backfill_search_names, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['is_deleted', 'payers_name_search'], name='transfer_payer_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['is_deleted', 'receivers_name_search'], name='transfer_receiver_search_idx'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
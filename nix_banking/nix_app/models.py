@@ -1,7 +1,26 @@
-from django.db import models
+from django.db import DatabaseError, connection, connections, models, transaction
+from django.db.models import F, Q, Sum, Count, Min, Max, Avg, Case, When, Value, Prefetch, Window
+from django.db.models.functions import RowNumber, TruncDay, TruncMonth
+from django.db.models.signals import post_migrate
+from django.dispatch import Signal
 from model_utils import Choices
 import datetime
+import functools
+import json
+import operator
+import unicodedata
+import uuid
 from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
+from nix_app.cache import lookup_cache, user_key, transfer_key
+
+transfers_changed = Signal()
+
+
+def normalize_name(name, max_length=128):
+    decomposed = unicodedata.normalize("NFKD", name or "")
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())[:max_length]
 
 
 class User(models.Model):
@@ -13,13 +32,77 @@ class User(models.Model):
     def __str__(self):
         return u"Usuário {}".format(self.name)
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super(User, self).save(*args, **kwargs)
+            TableVersion.bump(TableVersion.USERS)
+        lookup_cache().delete(user_key(self.id))
+
+    def delete(self, *args, **kwargs):
+        user_id = self.id
+        transfer_keys = [transfer_key(transfer_id) for transfer_id in self.transfers.values_list("id", flat=True)]
+        with transaction.atomic():
+            deleted = super(User, self).delete(*args, **kwargs)
+            TableVersion.bump(TableVersion.USERS, TableVersion.TRANSFERS)
+        lookup_cache().delete(user_key(user_id), *transfer_keys)
+        return deleted
+
     def as_dict(self):
         return {'name': self.name, 'cnpj': self.cnpj}
 
+    @staticmethod
+    def transfer_history(user_ids, cursors=None, page_size=100):
+        cursors = cursors or {}
+        after_ids = {user_id: int(cursors[user_id]) for user_id in user_ids if cursors.get(user_id) is not None}
+        page = Transfer.first_per_user(user_ids, after_ids, page_size + 1).order_by("id")
+        users = User.objects.filter(id__in=user_ids).order_by("id") \
+            .prefetch_related(Prefetch("transfers", queryset=page, to_attr="transfer_page"))
+        totals = {row["user_id"]: row for row in TransferAggregate.objects.filter(user_id__in=user_ids).order_by()
+                  .values("user_id").annotate(transfer_total=Sum("total"), transfer_count=Sum("count"))}
+        history = []
+        for user in users:
+            user_totals = totals.get(user.id, {})
+            history.append({"id": user.id, "name": user.name, "cnpj": user.cnpj,
+                            "transfer_total": user_totals.get("transfer_total", 0),
+                            "transfer_count": user_totals.get("transfer_count", 0),
+                            "transfers": [transfer.as_dict() for transfer in user.transfer_page[:page_size]],
+                            "next_cursor": user.transfer_page[page_size - 1].id
+                            if len(user.transfer_page) > page_size else None})
+        return history
+
 
 class Transfer(models.Model):
     TRANSFER_TYPE_OPTIONS = Choices('CC', 'TED', 'DOC')
     MAX_TRANSFER_VALUE = 100000
+    BULK_CREATE_BATCH_SIZE = 1000
+    CREATION_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+    TED_MAX_VALUE = 5000
+    TED_HOURS = (10, 16)
+    BATCH_CHANGE_CHUNK_SIZE = 1000
+    BATCH_ACTIONS = ("delete", "restore", "update")
+    BATCH_UPDATE_FIELDS = ("payers_name", "payers_bank", "payers_agency", "payers_account", "receivers_name",
+                           "receivers_bank", "receivers_agency", "receivers_account", "transfer_value",
+                           "transfer_value_delta", "creation_date")
+    AGGREGATE_FIELDS = ("user_id_id", "transfer_type", "creation_date", "transfer_value", "is_deleted")
+    FIELD_NAMES = ("id", "user_id", "payers_name", "payers_bank", "payers_agency", "payers_account",
+                   "receivers_name", "receivers_bank", "receivers_agency", "receivers_account",
+                   "transfer_value", "transfer_type", "creation_date")
+    FILTER_LOOKUPS = {"min_value": ("transfer_value__gte", int),
+                      "max_value": ("transfer_value__lte", int),
+                      "transfer_type": ("transfer_type__in", str),
+                      "user_id": ("user_id__in", int),
+                      "payers_name": ("payers_name", str),
+                      "receivers_name": ("receivers_name", str),
+                      "payers_bank": ("payers_bank__in", str),
+                      "receivers_bank": ("receivers_bank__in", str)}
+    SUMMARY_GROUPS = {"transfer_type": F("transfer_type"),
+                      "user_id": F("user_id"),
+                      "payers_bank": F("payers_bank"),
+                      "receivers_bank": F("receivers_bank"),
+                      "day": TruncDay("creation_date"),
+                      "month": TruncMonth("creation_date")}
+    SEARCH_FIELDS = {"payer": ("payers_name", "payers_name_search"),
+                     "receiver": ("receivers_name", "receivers_name_search")}
     id = models.AutoField(primary_key=True)
     user_id = models.ForeignKey(User, related_name='transfers', verbose_name="Transferências",
                                 on_delete=models.CASCADE, null=True)
@@ -36,33 +119,197 @@ class Transfer(models.Model):
                                      verbose_name="Tipo da transferência", max_length=3)
     creation_date = models.DateField(verbose_name="Data de criação")
     is_deleted = models.BooleanField(default=False)
+    payers_name_search = models.CharField(default="", max_length=128, editable=False,
+                                          verbose_name="Nome do pagador normalizado")
+    receivers_name_search = models.CharField(default="", max_length=128, editable=False,
+                                             verbose_name="Nome do recebedor normalizado")
     objects = models.Manager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["is_deleted", "creation_date"], name="transfer_deleted_date_idx"),
+            models.Index(fields=["is_deleted", "payers_name"], name="transfer_deleted_payer_idx"),
+            models.Index(fields=["is_deleted", "receivers_name"], name="transfer_deleted_receiver_idx"),
+            models.Index(fields=["is_deleted", "payers_name_search"], name="transfer_payer_search_idx"),
+            models.Index(fields=["is_deleted", "receivers_name_search"], name="transfer_receiver_search_idx"),
+        ]
+
     def __str__(self):
         return u"Transferência {}".format(self.id)
 
     def save(self, *args, **kwargs):
+        self._prepare_for_save()
+        contribution = self._aggregate_contribution()
+        with transaction.atomic():
+            previous_contribution = self._previous_contribution()
+            super(Transfer, self).save(*args, **kwargs)
+            TransferAggregate.apply_deltas(TransferAggregate.contribution_deltas(
+                [contribution], [previous_contribution]))
+            TableVersion.bump(TableVersion.TRANSFERS)
+        lookup_cache().delete(transfer_key(self.id))
+
+    def _prepare_for_save(self):
         if self.transfer_value > self.MAX_TRANSFER_VALUE:
             raise ValueError("Transfer value cannot exceed R$ {}".format(self.MAX_TRANSFER_VALUE))
+        if self.transfer_value < 1:
+            raise ValueError("Transfer value must be positive, got {}".format(self.transfer_value))
         if self.creation_date is None:
             self.creation_date = datetime.datetime.now()
         self._set_transfer_type()
-        super(Transfer, self).save(*args, **kwargs)
+        for name_field, search_field in Transfer.SEARCH_FIELDS.values():
+            setattr(self, search_field, normalize_name(getattr(self, name_field)))
 
     def delete(self, *args, **kwargs):
         self.is_deleted = True
         self.save()
 
     def hard_delete(self):
-        super(Transfer, self).delete()
+        transfer_id = self.id
+        with transaction.atomic():
+            previous_contribution = self._previous_contribution()
+            super(Transfer, self).delete()
+            TransferAggregate.apply_deltas(TransferAggregate.contribution_deltas([], [previous_contribution]))
+            TableVersion.bump(TableVersion.TRANSFERS)
+        lookup_cache().delete(transfer_key(transfer_id))
+
+    def _previous_contribution(self):
+        if self.pk is None:
+            return None
+        # What this instance saw when it was loaded may already be stale, so lock and read the stored row.
+        saved = Transfer.objects.select_for_update().only(*Transfer.AGGREGATE_FIELDS).filter(pk=self.pk).first()
+        return saved._aggregate_contribution() if saved is not None else None
+
+    def _aggregate_contribution(self):
+        if self.is_deleted or self.creation_date is None:
+            return None
+        day = self.creation_date.date() if isinstance(self.creation_date, datetime.datetime) \
+            else self.creation_date
+        return (self.user_id_id, self.transfer_type, day), self.transfer_value
 
     @staticmethod
     def non_deleted_objects():
         return Transfer.objects.filter(is_deleted=False)
 
+    @staticmethod
+    def first_per_user(user_ids, after_ids, rows_per_user):
+        users = Q(user_id__in=[user_id for user_id in user_ids if user_id not in after_ids])
+        for user_id, after_id in after_ids.items():
+            users |= Q(user_id=user_id, id__gt=after_id)
+        ranked = Transfer.non_deleted_objects().filter(users) \
+            .annotate(position=Window(RowNumber(), partition_by=[F("user_id")], order_by=F("id").asc())) \
+            .values("id", "position")
+        sql, params = ranked.query.sql_with_params()
+        return Transfer.non_deleted_objects().extra(
+            where=["{}.{} IN (SELECT ranked.id FROM ({}) ranked WHERE ranked.position <= %s)".format(
+                connection.ops.quote_name(Transfer._meta.db_table), connection.ops.quote_name("id"), sql)],
+            params=params + (rows_per_user,))
+
+    @staticmethod
+    def filter_by_params(query_params, queryset=None):
+        if queryset is None:
+            queryset = Transfer.non_deleted_objects()
+        lookups = {}
+        for param, (lookup, cast) in Transfer.FILTER_LOOKUPS.items():
+            if param not in query_params:
+                continue
+            if lookup.endswith("__in"):
+                lookups[lookup] = [cast(value) for value in query_params.getlist(param)]
+            else:
+                lookups[lookup] = cast(query_params[param])
+        if "date" in query_params:
+            lookups.update(Transfer.creation_date_filter(query_params["date"]))
+        return queryset.filter(**lookups)
+
+    @staticmethod
+    def search_by_name(field, query, queryset=None):
+        if field not in Transfer.SEARCH_FIELDS:
+            raise ValueError("Unknown search field {}".format(field))
+        search_field = Transfer.SEARCH_FIELDS[field][1]
+        prefix = normalize_name(query)
+        if not prefix:
+            raise ValueError("Search query is empty")
+        if queryset is None:
+            queryset = Transfer.non_deleted_objects()
+        if connection.vendor == "postgresql":
+            return queryset.filter(**{search_field + "__startswith": prefix})
+        # Bumping the last character bounds the range without characters that 3-byte MySQL utf8 cannot store.
+        upper_bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return queryset.filter(**{search_field + "__gte": prefix, search_field + "__lt": upper_bound})
+
+    @staticmethod
+    def projection_fields(fields=None):
+        if not fields:
+            return Transfer.FIELD_NAMES
+        projection = tuple(fields.split(","))
+        for field in projection:
+            if field not in Transfer.FIELD_NAMES:
+                raise ValueError("Unknown transfer field {}".format(field))
+        return projection
+
+    @staticmethod
+    def creation_date_filter(date_filter):
+        if ".." in date_filter:
+            start_filter, end_filter = date_filter.split("..", 1)
+        else:
+            start_filter = end_filter = date_filter
+        lookups = {}
+        if start_filter:
+            lookups["creation_date__gte"] = Transfer._date_period(start_filter)[0]
+        if end_filter:
+            lookups["creation_date__lt"] = Transfer._date_period(end_filter)[1]
+        if not lookups:
+            raise ValueError("Date filter {} is empty".format(date_filter))
+        return lookups
+
+    @staticmethod
+    def _date_period(date_string):
+        parts = [int(part) for part in date_string.split("-")]
+        if len(parts) == 1:
+            return datetime.date(parts[0], 1, 1), datetime.date(parts[0] + 1, 1, 1)
+        if len(parts) == 2:
+            start = datetime.date(parts[0], parts[1], 1)
+            return start, (start + datetime.timedelta(days=31)).replace(day=1)
+        if len(parts) == 3:
+            start = datetime.date(*parts)
+            return start, start + datetime.timedelta(days=1)
+        raise ValueError("Invalid date filter {}".format(date_string))
+
+    @staticmethod
+    def transfer_total():
+        return TransferAggregate.objects.aggregate(total=Sum("total"))["total"] or 0
+
+    @staticmethod
+    def summary(group_by=None, queryset=None):
+        if queryset is None:
+            queryset = Transfer.non_deleted_objects()
+        aggregates = {"total": Sum("transfer_value"),
+                      "count": Count("id"),
+                      "min": Min("transfer_value"),
+                      "max": Max("transfer_value"),
+                      "avg": Avg("transfer_value")}
+        if group_by is None:
+            return Transfer._summary_row(queryset.aggregate(**aggregates))
+        if group_by not in Transfer.SUMMARY_GROUPS:
+            raise ValueError("Cannot group transfers by {}".format(group_by))
+        grouped = queryset.annotate(group=Transfer.SUMMARY_GROUPS[group_by]).order_by() \
+            .values("group").annotate(**aggregates).order_by("group")
+        return [Transfer._summary_row(row) for row in grouped.iterator()]
+
+    @staticmethod
+    def _summary_row(row):
+        summary_row = {"total": row["total"] or 0,
+                       "count": row["count"],
+                       "min": row["min"],
+                       "max": row["max"],
+                       "avg": float(row["avg"]) if row["avg"] is not None else None}
+        if "group" in row:
+            group = row["group"]
+            summary_row["group"] = group.isoformat() if isinstance(group, datetime.date) else group
+        return summary_row
+
     def as_dict(self):
         transfer_dict = {"id": self.id,
-                         "user_id": self.user_id.id if self.user_id else None,
+                         "user_id": self.user_id_id,
                          "payers_name": self.payers_name,
                          "payers_bank": self.payers_bank,
                          "payers_agency": self.payers_agency,
@@ -76,12 +323,55 @@ class Transfer(models.Model):
                          "creation_date": self.creation_date.isoformat() if self.creation_date else None}
         return transfer_dict
 
+    @staticmethod
+    def bulk_create_from_dicts(transfers_data, batch_size=BULK_CREATE_BATCH_SIZE):
+        user_ids = set()
+        for transfer_data in transfers_data:
+            try:
+                if isinstance(transfer_data, dict) and transfer_data.get("user_id"):
+                    user_ids.add(int(transfer_data["user_id"]))
+            except (TypeError, ValueError):
+                pass
+        existing_user_ids = set(User.objects.filter(id__in=user_ids).values_list("id", flat=True))
+
+        transfers, errors = [], []
+        for row, transfer_data in enumerate(transfers_data):
+            try:
+                transfers.append(Transfer._from_bulk_dict(transfer_data, existing_user_ids))
+            except (ObjectDoesNotExist, TypeError, ValueError) as error:
+                errors.append({"row": row, "error": str(error)})
+
+        with transaction.atomic():
+            for start in range(0, len(transfers), batch_size):
+                Transfer.objects.bulk_create(transfers[start:start + batch_size])
+            TransferAggregate.apply_deltas(TransferAggregate.contribution_deltas(
+                [transfer._aggregate_contribution() for transfer in transfers]))
+            TableVersion.bump(TableVersion.TRANSFERS)
+        transfers_changed.send(sender=Transfer)
+        return len(transfers), errors
+
+    @staticmethod
+    def _from_bulk_dict(transfer_data, existing_user_ids=None):
+        if not isinstance(transfer_data, dict):
+            raise TypeError("Transfer data must be an object")
+        transfer = Transfer()
+        if transfer_data.get("user_id"):
+            if existing_user_ids is not None and int(transfer_data["user_id"]) not in existing_user_ids:
+                raise ObjectDoesNotExist("User with id {} does not exist.".format(transfer_data["user_id"]))
+            transfer.user_id_id = int(transfer_data["user_id"])
+        transfer._set_fields_from_dict(transfer_data)
+        transfer._prepare_for_save()
+        return transfer
+
     def get_data_from_dict(self, transfer_data):
         try:
             if transfer_data.get("user_id"):
                 self.user_id = User.objects.get(id=transfer_data["user_id"])
         except ObjectDoesNotExist:
             raise ObjectDoesNotExist("User with id {} does not exist.".format(transfer_data["user_id"]))
+        self._set_fields_from_dict(transfer_data)
+
+    def _set_fields_from_dict(self, transfer_data):
         self.payers_name = transfer_data.get("payers_name") if transfer_data.get("payers_name") else ""
         self.payers_bank = transfer_data.get("payers_bank") if transfer_data.get("payers_bank") else ""
         self.payers_agency = transfer_data.get("payers_agency") if transfer_data.get("payers_agency") else ""
@@ -90,18 +380,503 @@ class Transfer(models.Model):
         self.receivers_agency = transfer_data.get("receivers_agency") if transfer_data.get("receivers_agency") else ""
         self.receivers_account = transfer_data.get("receivers_account") if transfer_data.get("receivers_account") else ""
         self.transfer_value = int(transfer_data.get("transfer_value")) if transfer_data.get("transfer_value") else 1
-        self.transfer_type = transfer_data.get("transfer_type") \
-            if transfer_data.get("transfer_type") else self._set_transfer_type()
+        if transfer_data.get("transfer_type"):
+            self.transfer_type = transfer_data["transfer_type"]
         if transfer_data.get("creation_date"):
             if isinstance(transfer_data["creation_date"], str):
-                transfer_data["creation_date"] = datetime.datetime. \
-                    strptime(transfer_data["creation_date"], "%Y-%m-%dT%H:%M:%S")
+                transfer_data["creation_date"] = Transfer.parse_creation_date(transfer_data["creation_date"])
+            elif not isinstance(transfer_data["creation_date"], datetime.datetime):
+                raise ValueError("Creation date must be a string, got {!r}".format(transfer_data["creation_date"]))
             self.creation_date = transfer_data["creation_date"]
 
+    @staticmethod
+    def parse_creation_date(creation_date):
+        if len(creation_date) == 19 and creation_date[10] == "T" and creation_date[13] == creation_date[16] == ":":
+            return datetime.datetime.fromisoformat(creation_date)
+        return datetime.datetime.strptime(creation_date, Transfer.CREATION_DATE_FORMAT)
+
     def _set_transfer_type(self):
         if self.receivers_bank == self.payers_bank:
             self.transfer_type = self.TRANSFER_TYPE_OPTIONS.CC
-        elif self.transfer_value < 5000 and 10 < self.creation_date.hour < 16:
+        elif self.transfer_value < self.TED_MAX_VALUE and \
+                self.TED_HOURS[0] < self.creation_date.hour < self.TED_HOURS[1]:
             self.transfer_type = self.TRANSFER_TYPE_OPTIONS.TED
         else:
             self.transfer_type = self.TRANSFER_TYPE_OPTIONS.DOC
+
+    @staticmethod
+    def _transfer_type_rules(hour_field=None):
+        if hour_field is None:
+            ted_hours = Q(transfer_type=Transfer.TRANSFER_TYPE_OPTIONS.TED)
+        else:
+            ted_hours = Q(**{hour_field + "__gt": Transfer.TED_HOURS[0], hour_field + "__lt": Transfer.TED_HOURS[1]})
+        return [(Q(payers_bank=F("receivers_bank")), Transfer.TRANSFER_TYPE_OPTIONS.CC),
+                (Q(transfer_value__lt=Transfer.TED_MAX_VALUE) & ted_hours, Transfer.TRANSFER_TYPE_OPTIONS.TED)], \
+            Transfer.TRANSFER_TYPE_OPTIONS.DOC
+
+    @staticmethod
+    def transfer_type_expression(hour_field=None):
+        rules, default = Transfer._transfer_type_rules(hour_field)
+        return Case(*[When(condition, then=Value(transfer_type)) for condition, transfer_type in rules],
+                    default=Value(default), output_field=models.CharField(max_length=3))
+
+    @staticmethod
+    def misclassified(hour_field=None):
+        rules, default = Transfer._transfer_type_rules(hour_field)
+        unmatched, conditions = Q(), []
+        for condition, transfer_type in rules:
+            conditions.append(unmatched & condition & ~Q(transfer_type=transfer_type))
+            unmatched &= ~condition
+        conditions.append(unmatched & ~Q(transfer_type=default))
+        return functools.reduce(operator.or_, conditions)
+
+    @staticmethod
+    def reclassify(start_id, end_id, dry_run=False):
+        misclassified = Transfer.objects.filter(Transfer.misclassified(), id__gte=start_id, id__lt=end_id)
+        changes = {(row["transfer_type"], row["new_type"]): row["count"] for row in misclassified
+                   .annotate(new_type=Transfer.transfer_type_expression()).order_by()
+                   .values("transfer_type", "new_type").annotate(count=Count("id"))}
+        if dry_run or not changes:
+            return changes
+        with transaction.atomic():
+            Transfer.lock_rows(Transfer.objects.filter(id__gte=start_id, id__lt=end_id))
+            totals_before = TransferAggregate.expected_deltas(start_id, end_id)
+            transfer_ids = list(misclassified.values_list("id", flat=True))
+            misclassified.update(transfer_type=Transfer.transfer_type_expression())
+            TransferAggregate.apply_changes(totals_before, TransferAggregate.expected_deltas(start_id, end_id))
+            TableVersion.bump(TableVersion.TRANSFERS)
+        lookup_cache().delete(*[transfer_key(transfer_id) for transfer_id in transfer_ids])
+        transfers_changed.send(sender=Transfer)
+        return changes
+
+    @staticmethod
+    def lock_rows(transfers):
+        # Held until commit, so a concurrent save cannot land between the before and after totals.
+        list(transfers.select_for_update().order_by("id").values_list("id", flat=True))
+
+    @staticmethod
+    def archive(start_id, end_id, before=None, dry_run=False):
+        archivable = Q(is_deleted=True) | Q(creation_date__lt=before) if before else Q(is_deleted=True)
+        transfers = Transfer.objects.filter(archivable, id__gte=start_id, id__lt=end_id)
+        if dry_run:
+            return transfers.count()
+        with transaction.atomic():
+            transfers = list(transfers)
+            TransferArchive.objects.bulk_create([TransferArchive.from_transfer(transfer) for transfer in transfers])
+            TransferAggregate.apply_deltas(TransferAggregate.contribution_deltas(
+                [], [transfer._aggregate_contribution() for transfer in transfers]))
+            Transfer.objects.filter(id__in=[transfer.id for transfer in transfers]).delete()
+            TableVersion.bump(TableVersion.TRANSFERS)
+        lookup_cache().delete(*[transfer_key(transfer.id) for transfer in transfers])
+        transfers_changed.send(sender=Transfer)
+        return len(transfers)
+
+    @staticmethod
+    def batch_change(action, transfers, values=None, transfer_ids=None, chunk_size=BATCH_CHANGE_CHUNK_SIZE):
+        changes, guard = Transfer._batch_changes(action, values or {})
+        counts = {"matched": 0, "updated": 0}
+        for chunk_ids in Transfer._id_chunks(transfers, transfer_ids, chunk_size):
+            counts["matched"] += len(chunk_ids)
+            with transaction.atomic():
+                chunk = Transfer.objects.filter(id__in=chunk_ids)
+                Transfer.lock_rows(chunk)
+                totals_before = TransferAggregate.grouped_totals(chunk)
+                counts["updated"] += chunk.filter(guard).update(**changes)
+                if action == "update":
+                    chunk.filter(Transfer.misclassified()).update(transfer_type=Transfer.transfer_type_expression())
+                TransferAggregate.apply_changes(totals_before, TransferAggregate.grouped_totals(chunk))
+                TableVersion.bump(TableVersion.TRANSFERS)
+            lookup_cache().delete(*[transfer_key(transfer_id) for transfer_id in chunk_ids])
+        transfers_changed.send(sender=Transfer)
+        counts["rejected"] = counts["matched"] - counts["updated"]
+        return counts
+
+    @staticmethod
+    def _batch_changes(action, values):
+        if action == "delete":
+            return {"is_deleted": True}, Q(is_deleted=False)
+        if action == "restore":
+            return {"is_deleted": False}, Q(is_deleted=True)
+        if action != "update":
+            raise ValueError("Unknown batch action {}".format(action))
+        if not values or not isinstance(values, dict):
+            raise ValueError("Batch updates need values")
+        unknown = set(values) - set(Transfer.BATCH_UPDATE_FIELDS)
+        if unknown or {"transfer_value", "transfer_value_delta"}.issubset(values):
+            raise ValueError("Cannot batch update {}".format(", ".join(sorted(unknown)) or "transfer_value twice"))
+        changes, guard = {}, Q(is_deleted=False)
+        for field, value in values.items():
+            if field == "transfer_value":
+                changes[field] = int(value)
+                if not 1 <= changes[field] <= Transfer.MAX_TRANSFER_VALUE:
+                    raise ValueError("Transfer value must be between 1 and {}".format(Transfer.MAX_TRANSFER_VALUE))
+            elif field == "transfer_value_delta":
+                changes["transfer_value"] = F("transfer_value") + int(value)
+                guard &= Q(transfer_value__gte=1 - int(value),
+                           transfer_value__lte=Transfer.MAX_TRANSFER_VALUE - int(value))
+            elif field == "creation_date":
+                changes[field] = Transfer.parse_creation_date(value).date()
+            else:
+                changes[field] = str(value)
+        for name_field, search_field in Transfer.SEARCH_FIELDS.values():
+            if name_field in changes:
+                changes[search_field] = normalize_name(changes[name_field])
+        return changes, guard
+
+    @staticmethod
+    def _id_chunks(transfers, transfer_ids, chunk_size):
+        if transfer_ids is not None:
+            transfer_ids = sorted(set(transfer_ids))
+            for start in range(0, len(transfer_ids), chunk_size):
+                chunk_ids = list(transfers.filter(id__in=transfer_ids[start:start + chunk_size])
+                                 .values_list("id", flat=True))
+                if chunk_ids:
+                    yield chunk_ids
+            return
+        last_id = 0
+        while True:
+            chunk_ids = list(transfers.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:chunk_size])
+            if not chunk_ids:
+                return
+            last_id = chunk_ids[-1]
+            yield chunk_ids
+
+
+class TransferAggregate(models.Model):
+    BULK_DELTAS_THRESHOLD = 50
+    BULK_DELTAS_BATCH_SIZE = 500
+    TOTAL_GROUPS = {"user_id": F("user_id"),
+                    "transfer_type": F("transfer_type"),
+                    "day": F("day"),
+                    "month": TruncMonth("day")}
+    id = models.AutoField(primary_key=True)
+    user_id = models.ForeignKey(User, related_name='transfer_aggregates', verbose_name="Totais de transferências",
+                                on_delete=models.CASCADE, null=True)
+    transfer_type = models.CharField(choices=Transfer.TRANSFER_TYPE_OPTIONS, verbose_name="Tipo da transferência",
+                                     max_length=3)
+    day = models.DateField(verbose_name="Dia")
+    total = models.BigIntegerField(default=0, verbose_name="Valor total")
+    count = models.BigIntegerField(default=0, verbose_name="Quantidade")
+    objects = models.Manager()
+
+    class Meta:
+        unique_together = ("user_id", "transfer_type", "day")
+
+    def __str__(self):
+        return u"Total de transferências {} {} {}".format(self.user_id_id, self.transfer_type, self.day)
+
+    @staticmethod
+    def contribution_deltas(added, removed=()):
+        deltas = {}
+        for contributions, sign in ((added, 1), (removed, -1)):
+            for contribution in contributions:
+                if contribution is None:
+                    continue
+                key, transfer_value = contribution
+                total, count = deltas.get(key, (0, 0))
+                deltas[key] = (total + sign * transfer_value, count + sign)
+        return deltas
+
+    @staticmethod
+    def apply_deltas(deltas):
+        deltas = {key: delta for key, delta in deltas.items() if delta != (0, 0)}
+        if len(deltas) > TransferAggregate.BULK_DELTAS_THRESHOLD:
+            keys = list(deltas)
+            for start in range(0, len(keys), TransferAggregate.BULK_DELTAS_BATCH_SIZE):
+                TransferAggregate._apply_delta_batch({key: deltas[key] for key in
+                                                      keys[start:start + TransferAggregate.BULK_DELTAS_BATCH_SIZE]})
+            return
+        for (user_id, transfer_type, day), (total, count) in deltas.items():
+            aggregate = TransferAggregate.objects.filter(user_id=user_id, transfer_type=transfer_type, day=day)
+            if aggregate.update(total=F("total") + total, count=F("count") + count):
+                continue
+            if user_id is None:
+                TransferAggregate.objects.create(user_id_id=user_id, transfer_type=transfer_type, day=day,
+                                                 total=total, count=count)
+                continue
+            # A concurrent first write may insert the same row, so insert-or-ignore an empty one and add to it.
+            TransferAggregate.objects.bulk_create([TransferAggregate(user_id_id=user_id, transfer_type=transfer_type,
+                                                                     day=day)], ignore_conflicts=True)
+            aggregate.update(total=F("total") + total, count=F("count") + count)
+
+    @staticmethod
+    def _apply_delta_batch(deltas):
+        existing = TransferAggregate._aggregate_ids(deltas)
+        missing = {key for key in deltas if key not in existing and key[0] is not None}
+        if missing:
+            TransferAggregate.objects.bulk_create([
+                TransferAggregate(user_id_id=user_id, transfer_type=transfer_type, day=day)
+                for user_id, transfer_type, day in missing], ignore_conflicts=True)
+            existing.update(TransferAggregate._aggregate_ids(missing))
+        if existing:
+            with connection.cursor() as cursor:
+                cursor.executemany("UPDATE {0} SET {1} = {1} + %s, {2} = {2} + %s WHERE {3} = %s".format(
+                    *[connection.ops.quote_name(name) for name in (TransferAggregate._meta.db_table, "total",
+                                                                     "count", "id")]),
+                    [deltas[key] + (aggregate_id,) for key, aggregate_id in existing.items()])
+        TransferAggregate.objects.bulk_create([
+            TransferAggregate(user_id_id=user_id, transfer_type=transfer_type, day=day, total=total, count=count)
+            for (user_id, transfer_type, day), (total, count) in deltas.items()
+            if (user_id, transfer_type, day) not in existing])
+
+    @staticmethod
+    def _aggregate_ids(keys):
+        user_ids = {user_id for user_id, _, _ in keys}
+        users = Q(user_id__in=user_ids - {None})
+        if None in user_ids:
+            users |= Q(user_id__isnull=True)
+        return {(user_id, transfer_type, day): aggregate_id for aggregate_id, user_id, transfer_type, day in
+                TransferAggregate.objects.filter(users, day__in={day for _, _, day in keys})
+                .values_list("id", "user_id", "transfer_type", "day") if (user_id, transfer_type, day) in keys}
+
+    @staticmethod
+    def totals(group_by):
+        if group_by not in TransferAggregate.TOTAL_GROUPS:
+            raise ValueError("Cannot group transfer totals by {}".format(group_by))
+        grouped = TransferAggregate.objects.annotate(group=TransferAggregate.TOTAL_GROUPS[group_by]).order_by() \
+            .values("group").annotate(total=Sum("total"), count=Sum("count")).filter(count__gt=0).order_by("group")
+        return [{"group": row["group"].isoformat() if isinstance(row["group"], datetime.date) else row["group"],
+                 "total": row["total"], "count": row["count"]} for row in grouped.iterator()]
+
+    @staticmethod
+    def expected_deltas(start_id, end_id):
+        return TransferAggregate.grouped_totals(Transfer.objects.filter(id__gte=start_id, id__lt=end_id))
+
+    @staticmethod
+    def grouped_totals(transfers):
+        grouped = transfers.filter(is_deleted=False).order_by() \
+            .values("user_id", "transfer_type", "creation_date") \
+            .annotate(total=Sum("transfer_value"), count=Count("id"))
+        return {(row["user_id"], row["transfer_type"], row["creation_date"]): (row["total"], row["count"])
+                for row in grouped.iterator()}
+
+    @staticmethod
+    def apply_changes(totals_before, totals_after):
+        deltas = dict(totals_after)
+        for key, (total, count) in totals_before.items():
+            current_total, current_count = deltas.get(key, (0, 0))
+            deltas[key] = (current_total - total, current_count - count)
+        TransferAggregate.apply_deltas(deltas)
+
+
+class TransferArchive(models.Model):
+    id = models.IntegerField(primary_key=True)
+    user_id = models.ForeignKey(User, related_name='archived_transfers', verbose_name="Transferências arquivadas",
+                                on_delete=models.CASCADE, null=True)
+    payers_name = models.CharField(default="", max_length=128, verbose_name="Nome do pagador")
+    payers_bank = models.CharField(default="", max_length=128, verbose_name="Banco do pagador")
+    payers_agency = models.CharField(default="", max_length=128, verbose_name="Agência do pagador")
+    payers_account = models.CharField(default="", max_length=128, verbose_name="Conta do pagador")
+    receivers_name = models.CharField(default="", max_length=128, verbose_name="Nome do recebedor")
+    receivers_bank = models.CharField(default="", max_length=128, verbose_name="Banco do recebedor")
+    receivers_agency = models.CharField(default="", max_length=128, verbose_name="Agência do recebedor")
+    receivers_account = models.CharField(default="", max_length=128, verbose_name="Conta do recebedor")
+    transfer_value = models.PositiveIntegerField(default=1, verbose_name="Valor da Transferência")
+    transfer_type = models.CharField(choices=Transfer.TRANSFER_TYPE_OPTIONS, default=Transfer.TRANSFER_TYPE_OPTIONS.DOC,
+                                     verbose_name="Tipo da transferência", max_length=3)
+    creation_date = models.DateField(verbose_name="Data de criação")
+    is_deleted = models.BooleanField(default=False)
+    month = models.DateField(verbose_name="Mês")
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name="Arquivada em")
+    objects = models.Manager()
+
+    class Meta:
+        indexes = [models.Index(fields=["is_deleted", "month", "creation_date"],
+                                name="archive_deleted_month_idx")]
+
+    def __str__(self):
+        return u"Transferência arquivada {}".format(self.id)
+
+    @staticmethod
+    def from_transfer(transfer):
+        creation_date = transfer.creation_date.date() if isinstance(transfer.creation_date, datetime.datetime) \
+            else transfer.creation_date
+        search_fields = {search_field for _, search_field in Transfer.SEARCH_FIELDS.values()}
+        return TransferArchive(month=creation_date.replace(day=1),
+                               **{field.attname: getattr(transfer, field.attname)
+                                  for field in Transfer._meta.concrete_fields if field.attname not in search_fields})
+
+    @staticmethod
+    def filter_by_date(date_filter):
+        lookups = Transfer.creation_date_filter(date_filter)
+        last_month = TransferArchive.objects.filter(is_deleted=False).aggregate(month=Max("month"))["month"]
+        if last_month is None or lookups.get("creation_date__gte", last_month).replace(day=1) > last_month:
+            return TransferArchive.objects.none()
+        if "creation_date__gte" in lookups:
+            lookups["month__gte"] = lookups["creation_date__gte"].replace(day=1)
+        if "creation_date__lt" in lookups:
+            lookups["month__lte"] = (lookups["creation_date__lt"] - datetime.timedelta(days=1)).replace(day=1)
+        return TransferArchive.objects.filter(is_deleted=False, **lookups)
+
+
+class TransferIntake(models.Model):
+    STATUS_OPTIONS = Choices('pending', 'processing', 'done', 'failed')
+    BATCH_SIZE = 500
+    CLAIM_TIMEOUT = datetime.timedelta(minutes=5)
+    id = models.AutoField(primary_key=True)
+    payload = models.TextField(verbose_name="Dados da transferência")
+    status = models.CharField(choices=STATUS_OPTIONS, default=STATUS_OPTIONS.pending, max_length=10,
+                              verbose_name="Situação")
+    error = models.TextField(default="", verbose_name="Erro")
+    transfer_id = models.ForeignKey(Transfer, related_name='intakes', verbose_name="Transferência",
+                                    on_delete=models.SET_NULL, null=True)
+    claimed_by = models.CharField(default="", max_length=32, verbose_name="Processado por")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Recebida em")
+    claimed_at = models.DateTimeField(null=True, verbose_name="Em processamento desde")
+    processed_at = models.DateTimeField(null=True, verbose_name="Processada em")
+    objects = models.Manager()
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "id"], name="intake_status_idx")]
+
+    def __str__(self):
+        return u"Transferência recebida {}".format(self.id)
+
+    @staticmethod
+    def enqueue(transfer_data):
+        intake = TransferIntake(payload=json.dumps(transfer_data))
+        intake.save()
+        return intake
+
+    def as_dict(self):
+        return {"tracking_id": self.id,
+                "status": self.status,
+                "transfer_id": self.transfer_id_id,
+                "error": self.error}
+
+    @staticmethod
+    def progress():
+        counts = dict(TransferIntake.objects.order_by().values_list("status").annotate(Count("id")))
+        return {status: counts.get(status, 0) for status, _ in TransferIntake.STATUS_OPTIONS}
+
+    @staticmethod
+    def claim_batch(batch_size, worker_token):
+        now = timezone.now()
+        claimable = Q(status=TransferIntake.STATUS_OPTIONS.pending) | \
+            Q(status=TransferIntake.STATUS_OPTIONS.processing, claimed_at__lt=now - TransferIntake.CLAIM_TIMEOUT)
+        intake_ids = list(TransferIntake.objects.filter(claimable).order_by("id")
+                          .values_list("id", flat=True)[:batch_size])
+        TransferIntake.objects.filter(claimable, id__in=intake_ids) \
+            .update(status=TransferIntake.STATUS_OPTIONS.processing, claimed_by=worker_token, claimed_at=now)
+        return list(TransferIntake.objects.filter(id__in=intake_ids, claimed_by=worker_token,
+                                                  status=TransferIntake.STATUS_OPTIONS.processing).order_by("id"))
+
+    @staticmethod
+    def process_batch(batch_size=BATCH_SIZE):
+        intakes = TransferIntake.claim_batch(batch_size, uuid.uuid4().hex)
+        with transaction.atomic():
+            for intake in intakes:
+                try:
+                    with transaction.atomic():
+                        transfer = Transfer()
+                        transfer.get_data_from_dict(json.loads(intake.payload))
+                        transfer.save()
+                    intake.status = TransferIntake.STATUS_OPTIONS.done
+                    intake.transfer_id = transfer
+                except (ObjectDoesNotExist, TypeError, ValueError, AttributeError, DatabaseError) as error:
+                    intake.status = TransferIntake.STATUS_OPTIONS.failed
+                    intake.error = str(error)
+                intake.processed_at = timezone.now()
+            TransferIntake.objects.bulk_update(intakes, ["status", "error", "transfer_id", "processed_at"])
+        return len(intakes)
+
+
+class IdempotencyKey(models.Model):
+    PURGE_BATCH_SIZE = 1000
+    id = models.AutoField(primary_key=True)
+    client = models.CharField(max_length=128, verbose_name="Cliente")
+    scope = models.CharField(max_length=32, verbose_name="Operação")
+    key = models.CharField(max_length=255, verbose_name="Chave de idempotência")
+    request_hash = models.CharField(max_length=64, verbose_name="Hash da requisição")
+    status_code = models.PositiveSmallIntegerField(verbose_name="Status da resposta")
+    content_type = models.CharField(default="", max_length=128, verbose_name="Tipo da resposta")
+    body = models.TextField(default="", verbose_name="Corpo da resposta")
+    location = models.CharField(default="", max_length=255, verbose_name="Location da resposta")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Criada em")
+    expires_at = models.DateTimeField(verbose_name="Expira em")
+    objects = models.Manager()
+
+    class Meta:
+        unique_together = ("client", "scope", "key")
+        indexes = [models.Index(fields=["expires_at"], name="idempotency_expires_idx")]
+
+    def __str__(self):
+        return u"Chave de idempotência {}".format(self.key)
+
+    @staticmethod
+    def lookup(client, scope, key):
+        stored = IdempotencyKey.objects.filter(client=client, scope=scope, key=key).first()
+        if stored is not None and stored.expires_at <= timezone.now():
+            stored.delete()
+            return None
+        return stored
+
+    @staticmethod
+    def record(client, scope, key, request_hash, response, ttl):
+        IdempotencyKey.objects.create(client=client, scope=scope, key=key, request_hash=request_hash,
+                                      status_code=response.status_code,
+                                      content_type=response.get("Content-Type", "") if response.content else "",
+                                      body=response.content.decode("utf-8"), location=response.get("Location", ""),
+                                      expires_at=timezone.now() + datetime.timedelta(seconds=ttl))
+
+    @staticmethod
+    def purge_expired(batch_size=PURGE_BATCH_SIZE):
+        purged = 0
+        while True:
+            expired_ids = list(IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).order_by("expires_at")
+                               .values_list("id", flat=True)[:batch_size])
+            if not expired_ids:
+                return purged
+            purged += IdempotencyKey.objects.filter(id__in=expired_ids).delete()[0]
+
+
+class TableVersion(models.Model):
+    TRANSFERS = "transfer"
+    USERS = "user"
+    table = models.CharField(primary_key=True, max_length=32, verbose_name="Tabela")
+    version = models.BigIntegerField(default=0, verbose_name="Versão")
+    updated_at = models.DateTimeField(default=timezone.now, verbose_name="Alterada em")
+    objects = models.Manager()
+
+    def __str__(self):
+        return u"Versão {} de {}".format(self.version, self.table)
+
+    @staticmethod
+    def bump(*tables):
+        # Versions move after the write commits, so the hot version rows are never locked for the length of a
+        # write transaction; one bump per transaction covers all of its writes.
+        tables = frozenset(tables)
+        if any(tables <= getattr(pending, "tables", frozenset())
+               for _, pending in transaction.get_connection().run_on_commit):
+            return
+        bump = functools.partial(TableVersion._bump, tables)
+        bump.tables = tables
+        transaction.on_commit(bump)
+
+    @staticmethod
+    def _bump(tables):
+        now = timezone.now()
+        for table in sorted(tables):
+            if not TableVersion.objects.filter(table=table).update(version=F("version") + 1, updated_at=now):
+                TableVersion.objects.get_or_create(table=table, defaults={"version": 1, "updated_at": now})
+
+    @staticmethod
+    def current(tables):
+        return {row.table: row for row in TableVersion.objects.filter(table__in=tables)}
+
+
+def create_table_versions(sender, using="default", apps=None, **kwargs):
+    # Migration 0010 seeds the rows; this puts them back after a flush, which empties every table.
+    if sender.name != TableVersion._meta.app_label or apps is None:
+        return
+    try:
+        table_version = apps.get_model(TableVersion._meta.app_label, "TableVersion")
+    except LookupError:
+        return
+    if table_version._meta.db_table not in connections[using].introspection.table_names():
+        return
+    for table in (TableVersion.TRANSFERS, TableVersion.USERS):
+        table_version.objects.using(using).get_or_create(table=table)
+
+
+post_migrate.connect(create_table_versions, dispatch_uid="nix_app.models.create_table_versions")
@@ -0,0 +1,108 @@
+import base64
+import json
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from nix_app.serializers import dumps
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 2000
+STREAM_FORMATS = {"ndjson": "application/x-ndjson", "json": "application/json"}
+
+
+def get_page_size(query_params):
+    page_size = int(query_params.get("limit", DEFAULT_PAGE_SIZE))
+    if page_size < 1:
+        raise ValueError("Page size must be positive, got {}".format(page_size))
+    return min(page_size, MAX_PAGE_SIZE)
+
+
+def keyset_page(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE, serialize=None):
+    queryset = queryset.order_by("id")
+    if cursor is not None:
+        queryset = queryset.filter(id__gt=int(cursor))
+    rows = list(queryset[:page_size + 1])
+    results = [serialize(row) if serialize else row for row in rows[:page_size]]
+    next_cursor = _row_id(rows[page_size - 1]) if len(rows) > page_size else None
+    return {"results": results, "next_cursor": next_cursor}
+
+
+def ranked_page(queryset, rank_field, cursor=None, page_size=DEFAULT_PAGE_SIZE, serialize=None):
+    queryset = queryset.order_by(rank_field, "id")
+    if cursor is not None:
+        rank, row_id = _decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{rank_field + "__gt": rank}) | Q(**{rank_field: rank, "id__gt": row_id}),
+                                   **{rank_field + "__gte": rank})
+    rows = list(queryset[:page_size + 1])
+    results = [serialize(row) if serialize else row for row in rows[:page_size]]
+    next_cursor = _encode_cursor(_row_rank(rows[page_size - 1], rank_field), _row_id(rows[page_size - 1])) \
+        if len(rows) > page_size else None
+    return {"results": results, "next_cursor": next_cursor}
+
+
+def _encode_cursor(rank, row_id):
+    return base64.urlsafe_b64encode(json.dumps([rank, row_id]).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor):
+    try:
+        rank, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+    except (TypeError, UnicodeError, ValueError) as error:
+        raise ValueError("Invalid cursor {}: {}".format(cursor, error))
+    if not isinstance(rank, str) or not isinstance(row_id, int) or isinstance(row_id, bool):
+        raise ValueError("Invalid cursor {}: expected a name and an id".format(cursor))
+    return rank, row_id
+
+
+def _row_rank(row, rank_field):
+    if isinstance(row, dict):
+        return row[rank_field]
+    if isinstance(row, tuple):
+        return row[-1]
+    return getattr(row, rank_field)
+
+
+def _row_id(row):
+    if isinstance(row, dict):
+        return row["id"]
+    if isinstance(row, tuple):
+        return row[0]
+    return row.id
+
+
+def stream_rows(queryset, stream_format, serialize=None, chunk_size=STREAM_CHUNK_SIZE):
+    if stream_format not in STREAM_FORMATS:
+        raise ValueError("Unknown stream format {}".format(stream_format))
+    rows = queryset.order_by("id").iterator(chunk_size=chunk_size)
+    if serialize:
+        rows = (serialize(row) for row in rows)
+    if stream_format == "ndjson":
+        content = _ndjson_chunks(rows, chunk_size)
+    else:
+        content = _json_array_chunks(rows, chunk_size)
+    return StreamingHttpResponse(content, content_type=STREAM_FORMATS[stream_format])
+
+
+def _encoded_chunks(rows, chunk_size, separator):
+    encoded_rows = []
+    for row in rows:
+        encoded_rows.append(dumps(row))
+        if len(encoded_rows) == chunk_size:
+            yield separator.join(encoded_rows)
+            encoded_rows = []
+    if encoded_rows:
+        yield separator.join(encoded_rows)
+
+
+def _ndjson_chunks(rows, chunk_size):
+    for chunk in _encoded_chunks(rows, chunk_size, b"\n"):
+        yield chunk + b"\n"
+
+
+def _json_array_chunks(rows, chunk_size):
+    yield b"["
+    separator = b""
+    for chunk in _encoded_chunks(rows, chunk_size, b","):
+        yield separator + chunk
+        separator = b","
+    yield b"]"
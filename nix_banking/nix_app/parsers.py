@@ -0,0 +1,16 @@
+import json
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            return [json.loads(line) for line in stream.read().decode(encoding).splitlines() if line.strip()]
+        except ValueError as error:
+            raise ParseError('NDJSON parse error - {}'.format(error))
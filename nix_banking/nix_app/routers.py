@@ -0,0 +1,136 @@
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+
+PIN_KEY_PREFIX = "nix_app:replica_pin:"
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+_current_replica = contextvars.ContextVar("nix_app_current_replica", default=None)
+
+
+class ReplicaSet(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next = 0
+        self.in_flight = Counter()
+        self._unavailable_until = {}
+
+    def select(self, aliases, strategy="round_robin"):
+        now = time.monotonic()
+        with self._lock:
+            available = [alias for alias in aliases if self._unavailable_until.get(alias, 0) <= now]
+            if not available:
+                return None
+            start = self._next % len(available)
+            self._next += 1
+            if strategy == "least_loaded":
+                rotated = available[start:] + available[:start]
+                return min(rotated, key=lambda alias: self.in_flight[alias])
+            return available[start]
+
+    def mark_unavailable(self, alias, seconds):
+        with self._lock:
+            self._unavailable_until[alias] = time.monotonic() + seconds
+
+    def reset(self):
+        with self._lock:
+            self._next = 0
+            self.in_flight.clear()
+            self._unavailable_until.clear()
+
+    def _track(self, alias, change):
+        with self._lock:
+            self.in_flight[alias] += change
+
+    @contextlib.contextmanager
+    def using(self, alias):
+        self._track(alias, 1)
+        token = _current_replica.set(alias)
+        try:
+            yield
+        finally:
+            _current_replica.reset(token)
+            self._track(alias, -1)
+
+    def stream_from(self, alias, content):
+        # The replica is current only while a chunk is produced, not while this generator is suspended.
+        content = iter(content)
+        self._track(alias, 1)
+        try:
+            while True:
+                token = _current_replica.set(alias)
+                try:
+                    chunk = next(content)
+                except StopIteration:
+                    return
+                finally:
+                    _current_replica.reset(token)
+                yield chunk
+        finally:
+            self._track(alias, -1)
+
+
+replicas = ReplicaSet()
+
+
+class ReadReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        return _current_replica.get()
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {"default"}.union(settings.NIX_READ_REPLICAS)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+def client_id(request):
+    return request.META.get("HTTP_X_API_KEY") or request.META.get("REMOTE_ADDR", "")
+
+
+def pin_to_primary(request):
+    cache.set(PIN_KEY_PREFIX + client_id(request), True, settings.NIX_READ_YOUR_WRITES_SECONDS)
+
+
+def pinned_to_primary(request):
+    return cache.get(PIN_KEY_PREFIX + client_id(request), False)
+
+
+def read_replica(view):
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.NIX_READ_REPLICAS or pinned_to_primary(request):
+            return view(request, *args, **kwargs)
+        alias = replicas.select(settings.NIX_READ_REPLICAS, settings.NIX_READ_REPLICA_SELECTION)
+        if alias is None:
+            return view(request, *args, **kwargs)
+        try:
+            with replicas.using(alias):
+                response = view(request, *args, **kwargs)
+        except DatabaseError:
+            replicas.mark_unavailable(alias, settings.NIX_READ_REPLICA_RETRY_SECONDS)
+            return view(request, *args, **kwargs)
+        if response.streaming:
+            response.streaming_content = replicas.stream_from(alias, response.streaming_content)
+        return response
+    return wrapper
+
+
+class ReadYourWritesMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if settings.NIX_READ_REPLICAS and request.method in WRITE_METHODS and response.status_code < 400:
+            pin_to_primary(request)
+        return response
@@ -0,0 +1,50 @@
+import json
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+from nix_app.models import Transfer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+RAW_JSON_PARAM = "raw"
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def wants_raw_json(request):
+    return request.query_params.get(RAW_JSON_PARAM, "").lower() in ("1", "true")
+
+
+def json_response(request, data, response_status=status.HTTP_200_OK):
+    if wants_raw_json(request):
+        return HttpResponse(dumps(data), content_type="application/json", status=response_status)
+    return Response(json.dumps(data), status=response_status)
+
+
+def transfer_values(queryset, fields=Transfer.FIELD_NAMES):
+    return queryset.values_list("id", *[field for field in fields if field != "id"]).order_by("id")
+
+
+def transfer_row_serializer(fields=Transfer.FIELD_NAMES):
+    columns = ["id"] + [field for field in fields if field != "id"]
+    positions = [columns.index(field) for field in fields]
+    date_position = fields.index("creation_date") if "creation_date" in fields else None
+
+    def serialize(row):
+        values = [row[position] for position in positions]
+        if date_position is not None and values[date_position] is not None:
+            values[date_position] = values[date_position].isoformat()
+        return dict(zip(fields, values))
+    return serialize
+
+
+def transfer_rows(queryset, fields=Transfer.FIELD_NAMES):
+    serialize = transfer_row_serializer(fields)
+    return [serialize(row) for row in transfer_values(queryset, fields).iterator()]
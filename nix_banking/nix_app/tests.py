@@ -1,9 +1,39 @@
-from django.test import TestCase, Client
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.cache import cache
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import IntegerField, Value
+from django.db.models.query import QuerySet
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+import asyncio
+import csv
+import gzip
 import json
-from nix_app.models import User, Transfer
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock
+from nix_app.analytics import TransferIndex, transfer_index
+from nix_app.asgi import ASGIHandler
+from nix_app.backends.pool import connection_pool
+from nix_app.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from nix_app.exports import export_chunks
+from nix_app.cache import LRUCache, DjangoCacheBackend, lookup_cache
+from nix_app.middleware import RequestMetricsMiddleware, registry
+from nix_app.models import User, Transfer, TransferAggregate, TransferArchive, TransferIntake, IdempotencyKey, \
+    TableVersion
+from nix_app.pagination import _encode_cursor
+from nix_app.routers import ReadReplicaRouter, ReplicaSet, replicas
+from nix_app.throttling import Bulkhead, DjangoCacheRateLimitBackend, MemoryRateLimitBackend, get_bulkhead, rate_limiter
 import datetime
+import time
 
 client = Client()
 
@@ -217,4 +247,1603 @@ class GetSumOfAllTransfersTest(TestCase):
         expected_total = 1000
         response = client.get(reverse('get_transfer_total'), content_type='application/json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(json.loads(response.data), {'transfer_total': expected_total})
\ No newline at end of file
+        self.assertEqual(json.loads(response.data), {'transfer_total': expected_total})
+
+class GetTransferSummaryTest(TestCase):
+    def setUp(self):
+        test_user = User()
+        test_user.save()
+        Transfer(user_id=test_user, transfer_value=100, payers_bank="Bank A", receivers_bank="Bank A",
+                 creation_date=datetime.date(2019, 1, 1)).save()
+        Transfer(user_id=test_user, transfer_value=300, payers_bank="Bank A", receivers_bank="Bank A",
+                 creation_date=datetime.date(2019, 1, 2)).save()
+        Transfer(user_id=test_user, transfer_value=600, payers_bank="Bank B", receivers_bank="Bank A",
+                 creation_date=datetime.datetime(2019, 2, 1, 12)).save()
+        deleted_transfer = Transfer(user_id=test_user, transfer_value=5000)
+        deleted_transfer.save()
+        deleted_transfer.delete()
+
+    def test_can_summarize_all_transfers(self):
+        response = client.get(reverse('get_transfer_summary'), content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.data), {'total': 1000, 'count': 3, 'min': 100, 'max': 600,
+                                                     'avg': 1000 / 3})
+
+    def test_can_summarize_by_transfer_type(self):
+        response = client.get(reverse('get_transfer_summary'), {'group_by': 'transfer_type'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.data),
+                         [{'group': 'CC', 'total': 400, 'count': 2, 'min': 100, 'max': 300, 'avg': 200.0},
+                          {'group': 'TED', 'total': 600, 'count': 1, 'min': 600, 'max': 600, 'avg': 600.0}])
+
+    def test_can_summarize_by_month(self):
+        response = client.get(reverse('get_transfer_summary'), {'group_by': 'month'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        summary = json.loads(response.data)
+        self.assertEqual([(row['group'], row['total']) for row in summary],
+                         [('2019-01-01', 400), ('2019-02-01', 600)])
+
+    def test_cant_summarize_by_unknown_group(self):
+        response = client.get(reverse('get_transfer_summary'), {'group_by': 'payers_account'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PaginateAndStreamListingsTest(TestCase):
+    def setUp(self):
+        self.user = User(name="User A", cnpj="123")
+        self.user.save()
+        for transfer_value in range(1, 6):
+            Transfer(user_id=self.user, transfer_value=transfer_value).save()
+
+    def test_can_page_through_transfers(self):
+        response = client.get(reverse('get_all_transfers'), {'limit': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first_page = json.loads(response.data)
+        self.assertEqual([transfer['transfer_value'] for transfer in first_page['results']], [1, 2])
+        response = client.get(reverse('get_all_transfers'), {'limit': 2, 'cursor': first_page['next_cursor']})
+        second_page = json.loads(response.data)
+        self.assertEqual([transfer['transfer_value'] for transfer in second_page['results']], [3, 4])
+        response = client.get(reverse('get_all_transfers'), {'limit': 2, 'cursor': second_page['next_cursor']})
+        last_page = json.loads(response.data)
+        self.assertEqual([transfer['transfer_value'] for transfer in last_page['results']], [5])
+        self.assertIsNone(last_page['next_cursor'])
+
+    def test_can_page_users(self):
+        response = client.get(reverse('get_all_users'), {'limit': 10})
+        self.assertEqual(json.loads(response.data), {'results': [{'id': self.user.id, 'name': 'User A',
+                                                                  'cnpj': '123'}],
+                                                     'next_cursor': None})
+
+    def test_cant_page_with_invalid_limit(self):
+        response = client.get(reverse('get_all_transfers'), {'limit': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_can_stream_transfers_as_ndjson(self):
+        response = client.get(reverse('get_all_transfers'), {'stream': 'ndjson'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['transfer_value'] for line in lines], [1, 2, 3, 4, 5])
+
+    def test_can_stream_transfers_as_json_array(self):
+        response = client.get(reverse('get_all_transfers'), {'stream': 'json'})
+        transfers = json.loads(b"".join(response.streaming_content).decode())
+        self.assertEqual([transfer['transfer_value'] for transfer in transfers], [1, 2, 3, 4, 5])
+
+    def test_cant_stream_unknown_format(self):
+        response = client.get(reverse('get_all_users'), {'stream': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CreateTransfersInBulkTest(TestCase):
+    def setUp(self):
+        self.test_user = User()
+        self.test_user.save()
+        self.transfers = [{"user_id": self.test_user.id, "transfer_value": 1000, "receivers_bank": "Test Bank",
+                           "creation_date": "2019-01-01T18:00:00"},
+                          {"user_id": self.test_user.id, "receivers_bank": "Test Bank", "payers_bank": "Test Bank"},
+                          {"user_id": self.test_user.id, "transfer_value": 4000, "receivers_bank": "Test Bank",
+                           "creation_date": "2019-01-01T12:00:00"}]
+
+    def test_can_create_transfers_from_json_array(self):
+        with self.assertNumQueries(14):
+            response = client.post(reverse('create_transfers_in_bulk') + '?batch_size=2',
+                                   data=json.dumps(self.transfers),
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(json.loads(response.data), {'created': 3, 'errors': []})
+        self.assertEqual(list(Transfer.non_deleted_objects().order_by('id').values_list('transfer_type', flat=True)),
+                         [Transfer.TRANSFER_TYPE_OPTIONS.DOC, Transfer.TRANSFER_TYPE_OPTIONS.CC,
+                          Transfer.TRANSFER_TYPE_OPTIONS.TED])
+
+    def test_can_create_transfers_from_ndjson(self):
+        response = client.post(reverse('create_transfers_in_bulk'),
+                               data="\n".join(json.dumps(transfer) for transfer in self.transfers),
+                               content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Transfer.non_deleted_objects().count(), 3)
+
+    def test_reports_invalid_rows(self):
+        invalid_transfers = [{"user_id": self.test_user.id + 1, "receivers_bank": "Test Bank"},
+                             {"user_id": self.test_user.id, "transfer_value": Transfer.MAX_TRANSFER_VALUE + 1,
+                              "receivers_bank": "Test Bank"},
+                             {"user_id": self.test_user.id, "transfer_value": "-5", "receivers_bank": "Test Bank"},
+                             {"user_id": self.test_user.id, "creation_date": 5, "receivers_bank": "Test Bank"}]
+        response = client.post(reverse('create_transfers_in_bulk'),
+                               data=json.dumps(self.transfers + invalid_transfers),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        report = json.loads(response.data)
+        self.assertEqual(report['created'], 3)
+        self.assertEqual([error['row'] for error in report['errors']], [3, 4, 5, 6])
+        self.assertEqual(report['errors'][3]['error'], "Creation date must be a string, got 5")
+        self.assertEqual(Transfer.non_deleted_objects().count(), 3)
+
+    def test_cant_create_transfers_from_object(self):
+        response = client.post(reverse('create_transfers_in_bulk'),
+                               data=json.dumps(self.transfers[0]),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FilterTransfersByDateRangeTest(TestCase):
+    def setUp(self):
+        self.user = User()
+        self.user.save()
+        for creation_date in [datetime.date(2018, 12, 31), datetime.date(2019, 1, 1), datetime.date(2019, 1, 31),
+                              datetime.date(2019, 2, 1), datetime.date(2020, 1, 1)]:
+            Transfer(user_id=self.user, creation_date=creation_date).save()
+
+    def filter_by_date(self, date_filter):
+        response = client.get(reverse('filter_transfers', kwargs={'filter_type': "date", 'filter': date_filter}),
+                              content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [transfer['creation_date'] for transfer in json.loads(response.data)]
+
+    def test_can_filter_by_day(self):
+        self.assertEqual(self.filter_by_date("2019-01-31"), ["2019-01-31"])
+
+    def test_can_filter_by_month(self):
+        self.assertEqual(self.filter_by_date("2019-01"), ["2019-01-01", "2019-01-31"])
+
+    def test_can_filter_by_year(self):
+        self.assertEqual(self.filter_by_date("2019"), ["2019-01-01", "2019-01-31", "2019-02-01"])
+
+    def test_can_filter_by_range(self):
+        self.assertEqual(self.filter_by_date("2019-01-31..2019-02"), ["2019-01-31", "2019-02-01"])
+        self.assertEqual(self.filter_by_date("2019-02.."), ["2019-02-01", "2020-01-01"])
+        self.assertEqual(self.filter_by_date("..2018"), ["2018-12-31"])
+
+    def test_cant_filter_by_invalid_date(self):
+        for date_filter in ["2019-13", "yesterday", ".."]:
+            response = client.get(reverse('filter_transfers', kwargs={'filter_type': "date", 'filter': date_filter}),
+                                  content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FilterTransfersQueryPlanTest(TestCase):
+    def assertUsesIndex(self, queryset, index_name):
+        query_plan = queryset.explain()
+        self.assertIn(index_name, query_plan)
+        self.assertNotIn("SCAN", query_plan)
+
+    def test_date_filter_uses_index(self):
+        for date_filter in ["2019-01-01", "2019-01", "2019", "2019-01..2019-03", "2019.."]:
+            self.assertUsesIndex(Transfer.non_deleted_objects().filter(**Transfer.creation_date_filter(date_filter)),
+                                 "transfer_deleted_date_idx")
+
+    def test_payer_filter_uses_index(self):
+        self.assertUsesIndex(Transfer.non_deleted_objects().filter(payers_name="Payer"), "transfer_deleted_payer_idx")
+
+    def test_receiver_filter_uses_index(self):
+        self.assertUsesIndex(Transfer.non_deleted_objects().filter(receivers_name="Receiver"),
+                             "transfer_deleted_receiver_idx")
+
+
+class QueryTransfersTest(TestCase):
+    def setUp(self):
+        self.payer = User(name="Payer")
+        self.payer.save()
+        self.other_user = User(name="Other user")
+        self.other_user.save()
+        self.matching_transfer = Transfer(user_id=self.payer, payers_name="Payer X", payers_bank="Bank A",
+                                          receivers_bank="Bank B", transfer_value=1000,
+                                          creation_date=datetime.datetime(2019, 1, 10, 12))
+        self.matching_transfer.save()
+        Transfer(user_id=self.payer, payers_name="Payer X", payers_bank="Bank A", receivers_bank="Bank B",
+                 transfer_value=1000, creation_date=datetime.datetime(2019, 1, 10, 18)).save()
+        Transfer(user_id=self.payer, payers_name="Payer X", payers_bank="Bank A", receivers_bank="Bank B",
+                 transfer_value=2000, creation_date=datetime.datetime(2019, 3, 10, 12)).save()
+        Transfer(user_id=self.other_user, payers_name="Payer Y", payers_bank="Bank A", receivers_bank="Bank B",
+                 transfer_value=3000, creation_date=datetime.datetime(2019, 1, 10, 12)).save()
+
+    def test_can_combine_filters(self):
+        with self.assertNumQueries(1):
+            response = client.get(reverse('query_transfers'), {'payers_name': 'Payer X', 'transfer_type': 'TED',
+                                                               'date': '2019-01-01..2019-01-31'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.data), [Transfer.objects.get(id=self.matching_transfer.id).as_dict()])
+
+    def test_can_filter_by_value_range_and_users(self):
+        response = client.get(reverse('query_transfers') + '?min_value=1500&max_value=3000&user_id={}&user_id={}'
+                              .format(self.payer.id, self.other_user.id))
+        self.assertEqual([transfer['transfer_value'] for transfer in json.loads(response.data)], [2000, 3000])
+
+    def test_can_project_fields(self):
+        response = client.get(reverse('query_transfers'), {'user_id': self.other_user.id,
+                                                           'fields': 'transfer_value,creation_date'})
+        self.assertEqual(json.loads(response.data), [{'transfer_value': 3000, 'creation_date': '2019-01-10'}])
+
+    def test_can_page_projected_transfers(self):
+        response = client.get(reverse('query_transfers'), {'fields': 'transfer_value', 'limit': 3})
+        page = json.loads(response.data)
+        self.assertEqual(page['results'], [{'transfer_value': 1000}, {'transfer_value': 1000},
+                                           {'transfer_value': 2000}])
+        self.assertEqual(page['next_cursor'], 3)
+
+    def test_cant_query_with_invalid_parameters(self):
+        for query_params in [{'fields': 'id,password'}, {'min_value': 'cheap'}, {'date': 'last week'}]:
+            response = client.get(reverse('query_transfers'), query_params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SerializeTransfersTest(TestCase):
+    def setUp(self):
+        user = User(name="User A", cnpj="123")
+        user.save()
+        Transfer(user_id=user, transfer_value=100, payers_name="Pagador ção").save()
+        Transfer(transfer_value=200, receivers_bank="Test Bank").save()
+
+    def test_compatible_output_is_byte_identical(self):
+        legacy_content = JSONRenderer().render(json.dumps([transfer.as_dict()
+                                                           for transfer in Transfer.non_deleted_objects()]))
+        with self.assertNumQueries(2):
+            response = client.get(reverse('get_all_transfers'))
+        self.assertEqual(response.content, legacy_content)
+
+    def test_can_encode_json_once(self):
+        response = client.get(reverse('get_all_transfers'), {'raw': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content), [transfer.as_dict()
+                                                        for transfer in Transfer.non_deleted_objects()])
+
+    def test_as_dict_does_not_load_user(self):
+        transfer = Transfer.non_deleted_objects().first()
+        with self.assertNumQueries(0):
+            self.assertEqual(transfer.as_dict()['user_id'], transfer.user_id_id)
+
+
+class LookupCacheBackendsTest(TestCase):
+    def test_lru_cache_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get_or_load("a", lambda: "reloaded"), 1)
+        self.assertEqual(cache.get_or_load("b", lambda: "reloaded"), "reloaded")
+        self.assertEqual(cache.stats(), {"hits": 2, "misses": 1, "evictions": 2, "size": 2, "max_size": 2})
+
+    def test_lru_cache_expires_entries(self):
+        cache = LRUCache(ttl=0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+        self.assertEqual(cache.get_or_load("a", lambda: "reloaded"), "reloaded")
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_django_cache_backend(self):
+        cache = DjangoCacheBackend()
+        cache.clear()
+        self.assertEqual(cache.get_or_load("a", lambda: {"name": "loaded"}), {"name": "loaded"})
+        self.assertEqual(cache.get_or_load("a", lambda: {"name": "reloaded"}), {"name": "loaded"})
+        cache.delete("a")
+        self.assertEqual(cache.get_or_load("a", lambda: {"name": "reloaded"}), {"name": "reloaded"})
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 2, "evictions": 0})
+
+
+class CachedLookupsTest(TestCase):
+    def setUp(self):
+        lookup_cache().clear()
+        self.user = User(name="User A", cnpj="123")
+        self.user.save()
+        self.transfer = Transfer(user_id=self.user, transfer_value=100)
+        self.transfer.save()
+
+    def get_transfer(self):
+        return client.get(reverse('get_delete_update_transfer', kwargs={'transfer_id': self.transfer.id}))
+
+    def get_user(self):
+        return client.get(reverse('get_delete_update_user', kwargs={'user_id': self.user.id}))
+
+    def test_repeated_lookups_hit_cache(self):
+        with self.assertNumQueries(1):
+            self.get_transfer()
+        with self.assertNumQueries(0):
+            response = self.get_transfer()
+        self.assertEqual(json.loads(response.data)['transfer_value'], 100)
+        with self.assertNumQueries(1):
+            self.get_user()
+        with self.assertNumQueries(0):
+            response = self.get_user()
+        self.assertEqual(json.loads(response.data), {'name': 'User A', 'cnpj': '123'})
+
+    def test_transfer_save_invalidates_cache(self):
+        self.get_transfer()
+        self.transfer.transfer_value = 200
+        self.transfer.save()
+        self.assertEqual(json.loads(self.get_transfer().data)['transfer_value'], 200)
+
+    def test_transfer_deletes_invalidate_cache(self):
+        self.get_transfer()
+        self.transfer.delete()
+        self.assertEqual(self.get_transfer().status_code, status.HTTP_404_NOT_FOUND)
+        other_transfer = Transfer(user_id=self.user)
+        other_transfer.save()
+        other_transfer_url = reverse('get_delete_update_transfer', kwargs={'transfer_id': other_transfer.id})
+        client.get(other_transfer_url)
+        other_transfer.hard_delete()
+        response = client.get(other_transfer_url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_user_writes_invalidate_cache(self):
+        self.get_user()
+        self.get_transfer()
+        client.put(reverse('get_delete_update_user', kwargs={'user_id': self.user.id}),
+                   data=json.dumps({'name': 'User B', 'cnpj': '456'}), content_type='application/json')
+        self.assertEqual(json.loads(self.get_user().data), {'name': 'User B', 'cnpj': '456'})
+        client.delete(reverse('get_delete_update_user', kwargs={'user_id': self.user.id}))
+        self.assertEqual(self.get_user().status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.get_transfer().status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_can_get_cache_stats(self):
+        self.get_transfer()
+        self.get_transfer()
+        response = client.get(reverse('get_lookup_cache_stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = json.loads(response.data)
+        self.assertEqual((stats['hits'] > 0, stats['misses'] > 0), (True, True))
+
+
+
+class TransferAggregatesTest(TestCase):
+    def setUp(self):
+        self.user = User()
+        self.user.save()
+        self.other_user = User()
+        self.other_user.save()
+        self.transfer = Transfer(user_id=self.user, transfer_value=100, payers_bank="Bank A", receivers_bank="Bank A",
+                                 creation_date=datetime.date(2019, 1, 1))
+        self.transfer.save()
+        Transfer(user_id=self.user, transfer_value=200, payers_bank="Bank A", receivers_bank="Bank A",
+                 creation_date=datetime.date(2019, 1, 1)).save()
+        Transfer(user_id=self.other_user, transfer_value=700, receivers_bank="Bank B",
+                 creation_date=datetime.datetime(2019, 2, 1, 12)).save()
+
+    def aggregates(self):
+        return sorted(TransferAggregate.objects.values_list("user_id", "transfer_type", "day", "total", "count"))
+
+    def test_save_increments_totals(self):
+        self.assertEqual(self.aggregates(), [(self.user.id, 'CC', datetime.date(2019, 1, 1), 300, 2),
+                                             (self.other_user.id, 'TED', datetime.date(2019, 2, 1), 700, 1)])
+        with self.assertNumQueries(1):
+            self.assertEqual(Transfer.transfer_total(), 1000)
+
+    def test_edit_moves_totals(self):
+        transfer = Transfer.objects.get(id=self.transfer.id)
+        transfer.transfer_value = 150
+        transfer.payers_bank = "Bank C"
+        transfer.creation_date = datetime.datetime(2019, 1, 1, 18)
+        transfer.save()
+        self.assertEqual(self.aggregates(), [(self.user.id, 'CC', datetime.date(2019, 1, 1), 200, 1),
+                                             (self.user.id, 'DOC', datetime.date(2019, 1, 1), 150, 1),
+                                             (self.other_user.id, 'TED', datetime.date(2019, 2, 1), 700, 1)])
+
+    def test_deletes_decrement_totals(self):
+        client.delete(reverse('get_delete_update_transfer', kwargs={'transfer_id': self.transfer.id}))
+        self.assertEqual(Transfer.transfer_total(), 900)
+        Transfer.objects.get(id=self.transfer.id).hard_delete()
+        self.assertEqual(Transfer.transfer_total(), 900)
+        Transfer.non_deleted_objects().get(transfer_value=700).hard_delete()
+        self.assertEqual(Transfer.transfer_total(), 200)
+
+    def test_saving_deferred_transfers_moves_totals(self):
+        transfer = Transfer.objects.only("id", "transfer_value").get(id=self.transfer.id)
+        transfer.transfer_value = 150
+        transfer.save()
+        self.assertEqual(self.aggregates()[0], (self.user.id, 'CC', datetime.date(2019, 1, 1), 350, 2))
+        Transfer.objects.defer("is_deleted").get(id=self.transfer.id).hard_delete()
+        self.assertEqual(self.aggregates()[0], (self.user.id, 'CC', datetime.date(2019, 1, 1), 200, 1))
+
+    def test_stale_instances_do_not_drift_totals(self):
+        first = Transfer.objects.get(id=self.transfer.id)
+        second = Transfer.objects.get(id=self.transfer.id)
+        first.transfer_value = 150
+        first.save()
+        second.transfer_value = 120
+        second.save()
+        self.assertEqual(self.aggregates()[0], (self.user.id, 'CC', datetime.date(2019, 1, 1), 320, 2))
+        first.hard_delete()
+        self.assertEqual(self.aggregates()[0], (self.user.id, 'CC', datetime.date(2019, 1, 1), 200, 1))
+
+    def test_bulk_create_increments_totals(self):
+        Transfer.bulk_create_from_dicts([{"user_id": self.user.id, "transfer_value": 50, "payers_bank": "Bank A",
+                                          "receivers_bank": "Bank A", "creation_date": "2019-01-01T09:00:00"}])
+        self.assertEqual(self.aggregates()[0], (self.user.id, 'CC', datetime.date(2019, 1, 1), 350, 3))
+
+    def test_can_get_totals_by_group(self):
+        response = client.get(reverse('get_transfer_totals'), {'group_by': 'month'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.data), [{'group': '2019-01-01', 'total': 300, 'count': 2},
+                                                     {'group': '2019-02-01', 'total': 700, 'count': 1}])
+        response = client.get(reverse('get_transfer_totals'), {'group_by': 'payers_bank'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_can_rebuild_totals(self):
+        expected_aggregates = self.aggregates()
+        TransferAggregate.objects.all().delete()
+        output = StringIO()
+        call_command('rebuild_transfer_aggregates', chunk_size=1, stdout=output)
+        self.assertEqual(self.aggregates(), expected_aggregates)
+        self.assertIn("Rebuilt 2 transfer totals.", output.getvalue())
+
+    def test_can_reconcile_totals(self):
+        expected_aggregates = self.aggregates()
+        TransferAggregate.objects.filter(user_id=self.user).update(total=1)
+        TransferAggregate.objects.create(user_id=self.other_user, transfer_type='DOC', day=datetime.date(2019, 3, 1),
+                                         total=10, count=1)
+        output = StringIO()
+        call_command('rebuild_transfer_aggregates', reconcile=True, stdout=output)
+        self.assertEqual(self.aggregates(), expected_aggregates)
+        self.assertIn("Adjusted 2 of 2 transfer totals.", output.getvalue())
+
+    def test_first_writes_for_a_day_do_not_collide(self):
+        day = datetime.date(2019, 3, 1)
+        update = QuerySet.update
+        raced = []
+
+        def concurrent_update(queryset, **kwargs):
+            if queryset.model is TransferAggregate and not raced:
+                raced.append(True)
+                TransferAggregate.objects.create(user_id=self.user, transfer_type='CC', day=day, total=40, count=1)
+                return 0
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', concurrent_update):
+            TransferAggregate.apply_deltas({(self.user.id, 'CC', day): (60, 1)})
+        self.assertEqual(TransferAggregate.objects.filter(day=day).values_list("total", "count").get(), (100, 2))
+
+
+
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        registry.reset()
+        user = User()
+        user.save()
+        Transfer(user_id=user, transfer_value=100).save()
+
+    def test_records_view_metrics(self):
+        client.get(reverse('get_all_transfers'))
+        client.get(reverse('get_all_transfers'), {'stream': 'ndjson'}).getvalue()
+        metrics = registry.snapshot()['get_all_transfers']
+        self.assertEqual(metrics['requests'], 2)
+        self.assertEqual(metrics['queries'], 4)
+        self.assertEqual(metrics['duplicate_queries'], 0)
+        self.assertGreater(metrics['response_bytes'], 0)
+        self.assertGreater(metrics['render_seconds'], 0)
+
+    def test_detects_repeated_queries(self):
+        def n_plus_one_view(request):
+            for transfer in Transfer.objects.all():
+                for _ in range(3):
+                    User.objects.filter(id=transfer.user_id_id).exists()
+            return HttpResponse("ok")
+        request = RequestFactory().get('/')
+        RequestMetricsMiddleware(n_plus_one_view)(request)
+        metrics = registry.snapshot()['unresolved']
+        self.assertEqual(metrics['queries'], 4)
+        self.assertEqual(metrics['duplicate_queries'], 2)
+        self.assertEqual(metrics['n_plus_one_requests'], 1)
+
+    def test_can_get_prometheus_metrics(self):
+        client.get(reverse('get_transfer_total'))
+        response = client.get(reverse('get_metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4')
+        content = response.content.decode()
+        self.assertIn('nix_http_requests_total{view="get_transfer_total"} 1', content)
+        self.assertIn('nix_db_queries_total{view="get_transfer_total"} 2', content)
+        self.assertIn('nix_http_request_duration_seconds_count{view="get_transfer_total"} 1', content)
+
+    @override_settings(NIX_METRICS_SERVER_TIMING=True)
+    def test_can_send_server_timing_header(self):
+        response = Client().get(reverse('get_transfer_total'))
+        self.assertRegex(response['Server-Timing'], r'^app;dur=[0-9.]+, db;dur=[0-9.]+;desc="2 queries"')
+
+
+class TransferIntakeTest(TestCase):
+    def setUp(self):
+        self.user = User(name="User A", cnpj="123")
+        self.user.save()
+        self.transfer_data = {"user_id": self.user.id, "payers_name": "Payer", "payers_bank": "001",
+                              "payers_agency": "1", "payers_account": "1", "receivers_name": "Receiver",
+                              "receivers_bank": "002", "receivers_agency": "2", "receivers_account": "2",
+                              "transfer_value": 100, "creation_date": "2019-03-01T10:00:00"}
+
+    def enqueue(self, transfer_data):
+        return client.post(reverse('create_transfer'), data=json.dumps(transfer_data),
+                           content_type='application/json', HTTP_PREFER='respond-async')
+
+    def get_intake(self, tracking_id):
+        return json.loads(client.get(reverse('get_transfer_intake', kwargs={'intake_id': tracking_id})).data)
+
+    def test_async_create_transfer_is_queued(self):
+        response = self.enqueue(self.transfer_data)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        tracking_id = json.loads(response.data)['tracking_id']
+        self.assertEqual(response['Location'], reverse('get_transfer_intake', kwargs={'intake_id': tracking_id}))
+        self.assertEqual(Transfer.objects.count(), 0)
+        self.assertEqual(self.get_intake(tracking_id),
+                         {'tracking_id': tracking_id, 'status': 'pending', 'transfer_id': None, 'error': ''})
+
+    @override_settings(NIX_ASYNC_TRANSFER_INTAKE=True)
+    def test_async_intake_setting_queues_every_transfer(self):
+        response = client.post(reverse('create_transfer'), data=json.dumps(self.transfer_data),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+    def test_worker_processes_queued_transfers(self):
+        tracking_id = json.loads(self.enqueue(self.transfer_data).data)['tracking_id']
+        missing_user = dict(self.transfer_data, user_id=self.user.id + 1)
+        failed_id = json.loads(self.enqueue(missing_user).data)['tracking_id']
+        too_big = dict(self.transfer_data, transfer_value=Transfer.MAX_TRANSFER_VALUE + 1)
+        self.enqueue(too_big)
+        out = StringIO()
+        call_command('process_transfer_intake', workers=1, once=True, stdout=out)
+        self.assertIn('Processed 3 queued transfers', out.getvalue())
+        transfer = Transfer.objects.get()
+        self.assertEqual(transfer.transfer_value, 100)
+        self.assertEqual(Transfer.transfer_total(), 100)
+        intake = self.get_intake(tracking_id)
+        self.assertEqual((intake['status'], intake['transfer_id']), ('done', transfer.id))
+        self.assertEqual(self.get_intake(failed_id)['status'], 'failed')
+        response = client.get(reverse('get_transfer_intake_progress'))
+        self.assertEqual(json.loads(response.data), {'pending': 0, 'processing': 0, 'done': 1, 'failed': 2})
+
+    def test_database_errors_fail_only_their_intake(self):
+        save = Transfer.save
+
+        def failing_save(transfer, *args, **kwargs):
+            save(transfer, *args, **kwargs)
+            if transfer.transfer_value == 200:
+                raise IntegrityError("duplicate transfer")
+
+        for transfer_value in (100, 200, 300):
+            TransferIntake.enqueue(dict(self.transfer_data, transfer_value=transfer_value))
+        with mock.patch.object(Transfer, 'save', failing_save):
+            self.assertEqual(TransferIntake.process_batch(), 3)
+        self.assertEqual(sorted(Transfer.objects.values_list('transfer_value', flat=True)), [100, 300])
+        self.assertEqual(Transfer.transfer_total(), 400)
+        self.assertEqual(list(TransferIntake.objects.order_by('id').values_list('status', 'error')),
+                         [('done', ''), ('failed', 'duplicate transfer'), ('done', '')])
+
+    def test_claims_are_exclusive_until_they_expire(self):
+        for _ in range(3):
+            TransferIntake.enqueue(self.transfer_data)
+        self.assertEqual(len(TransferIntake.claim_batch(2, "worker-a")), 2)
+        self.assertEqual(len(TransferIntake.claim_batch(2, "worker-b")), 1)
+        self.assertEqual(TransferIntake.claim_batch(2, "worker-c"), [])
+        stale = timezone.now() - TransferIntake.CLAIM_TIMEOUT - datetime.timedelta(seconds=1)
+        TransferIntake.objects.filter(claimed_by="worker-a").update(claimed_at=stale)
+        self.assertEqual(len(TransferIntake.claim_batch(5, "worker-c")), 2)
+
+    def test_cant_get_unknown_intake(self):
+        response = client.get(reverse('get_transfer_intake', kwargs={'intake_id': 1}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ExportTransfersTest(TestCase):
+    def setUp(self):
+        user = User(name="User A", cnpj="123")
+        user.save()
+        self.transfers = []
+        for value in (100, 200, 300):
+            transfer = Transfer(user_id=user, transfer_value=value, payers_name="Pagador, ção",
+                                creation_date=datetime.datetime(2019, 3, 1, 10))
+            transfer.save()
+            self.transfers.append(transfer)
+        Transfer(user_id=user, transfer_value=400, creation_date=datetime.datetime(2019, 4, 1, 10)).save()
+        self.transfers[1].delete()
+
+    def export(self, **params):
+        response = client.get(reverse('export_transfers'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b"".join(response.streaming_content)
+
+    def test_can_export_csv(self):
+        rows = list(csv.reader(self.export(date='2019-03').decode().splitlines()))
+        self.assertEqual(rows[0], list(Transfer.FIELD_NAMES))
+        self.assertEqual([row[0] for row in rows[1:]], [str(self.transfers[0].id), str(self.transfers[2].id)])
+        self.assertIn("Pagador, ção", rows[1])
+
+    def test_can_export_gzipped_ndjson_after_id(self):
+        content = self.export(export='ndjson', gzip='true', after=self.transfers[0].id, fields='id,transfer_value')
+        rows = [json.loads(line) for line in gzip.decompress(content).decode().splitlines()]
+        self.assertEqual([row['transfer_value'] for row in rows], [300, 400])
+
+    def test_exports_in_constant_size_chunks(self):
+        chunks = export_chunks(Transfer.non_deleted_objects(), "ndjson", chunk_size=1)
+        with self.assertNumQueries(4):
+            self.assertEqual(len(list(chunks)), 3)
+
+    def test_cant_export_unknown_format(self):
+        response = client.get(reverse('export_transfers'), {'export': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_can_export_to_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "transfers.csv.gz")
+            call_command('export_transfers', output=path, gzip=True, filter=['min_value=250'])
+            with gzip.open(path, "rt") as export:
+                rows = list(csv.DictReader(export))
+        self.assertEqual([row['transfer_value'] for row in rows], ['300', '400'])
+
+
+class ImportTransfersTest(TestCase):
+    def setUp(self):
+        self.user = User(name="User A", cnpj="123")
+        self.user.save()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_file(self, rows, name="transfers.csv"):
+        path = os.path.join(self.directory.name, name)
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(path, "wt", newline="") as transfer_file:
+            writer = csv.writer(transfer_file)
+            writer.writerow(["user_id", "payers_bank", "receivers_bank", "transfer_value", "creation_date"])
+            writer.writerows(rows)
+        return path
+
+    def import_file(self, path, **options):
+        out, err = StringIO(), StringIO()
+        call_command('import_transfers', path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_can_import_transfers(self):
+        path = self.write_file([[self.user.id, "001", "001", 100, "2019-03-01T10:00:00"],
+                                [self.user.id, "001", "002", 200, "2019-03-01T12:00:00"],
+                                ["", "001", "002", 300, ""],
+                                [self.user.id + 1, "001", "002", 400, "2019-03-01T12:00:00"],
+                                [self.user.id, "001", "002", 500, "2019-03-01 12:00"],
+                                [self.user.id, "001", "002", Transfer.MAX_TRANSFER_VALUE + 1, ""]],
+                               "transfers.csv.gz")
+        out, err = self.import_file(path, batch_size=2)
+        self.assertIn("Imported 3 transfers", out)
+        self.assertIn("rejected 3 lines", out)
+        self.assertEqual(err.splitlines(), [
+            "Rejected line 5: User with id {} does not exist.".format(self.user.id + 1),
+            "Rejected line 6: time data '2019-03-01 12:00' does not match format '%Y-%m-%dT%H:%M:%S'",
+            "Rejected line 7: Transfer value cannot exceed R$ {}".format(Transfer.MAX_TRANSFER_VALUE)])
+        self.assertEqual(list(Transfer.objects.order_by("id").values_list("transfer_value", flat=True)),
+                         [100, 200, 300])
+        self.assertEqual(Transfer.objects.get(transfer_value=200).transfer_type, "TED")
+        self.assertEqual(Transfer.transfer_total(), 600)
+        self.assertEqual(Transfer.objects.get(transfer_value=100).creation_date, datetime.date(2019, 3, 1))
+
+    def test_rejects_non_positive_values_before_loading(self):
+        path = self.write_file([[self.user.id, "001", "001", 100, "2019-03-01T10:00:00"],
+                                [self.user.id, "001", "001", -5, "2019-03-01T10:00:00"],
+                                [self.user.id, "001", "001", 0, "2019-03-01T10:00:00"]])
+        out, err = self.import_file(path)
+        self.assertIn("Imported 1 transfers", out)
+        self.assertEqual(err.splitlines(), ["Rejected line 3: Transfer value must be positive, got -5",
+                                            "Rejected line 4: Transfer value must be positive, got 0"])
+        self.assertEqual(Transfer.transfer_total(), 100)
+
+    def test_import_matches_create_transfer(self):
+        path = self.write_file([[self.user.id, "001", "002", 4000, "2019-03-01T17:30:00"]])
+        self.import_file(path)
+        transfer = Transfer()
+        transfer.get_data_from_dict({"user_id": self.user.id, "payers_bank": "001", "receivers_bank": "002",
+                                     "transfer_value": "4000", "creation_date": "2019-03-01T17:30:00"})
+        transfer.save()
+        imported, created = Transfer.objects.order_by("id")
+        self.assertEqual(imported.as_dict(), dict(created.as_dict(), id=imported.id))
+
+    def test_can_parse_with_process_pool(self):
+        path = self.write_file([[self.user.id, "001", "002", value, "2019-03-01T10:00:00"] for value in range(1, 8)])
+        out, err = self.import_file(path, batch_size=2, workers=2)
+        self.assertIn("Imported 7 transfers", out)
+        self.assertEqual(Transfer.transfer_total(), 28)
+
+    def test_fast_creation_date_parsing_matches_strptime(self):
+        for creation_date in ("2019-03-01T10:00:00", "2019-12-31T23:59:59"):
+            self.assertEqual(Transfer.parse_creation_date(creation_date),
+                             datetime.datetime.strptime(creation_date, Transfer.CREATION_DATE_FORMAT))
+        for creation_date in ("2019-03-01T10:00", "2019-03-01 10:00:00", "2019-02-30T10:00:00"):
+            with self.assertRaises(ValueError):
+                Transfer.parse_creation_date(creation_date)
+
+
+class DatabaseBackendTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def database(self, **settings):
+        settings_dict = dict(connection.settings_dict, NAME=os.path.join(self.directory.name, "db.sqlite3"),
+                             OPTIONS={}, PRAGMAS={}, POOL_SIZE=0)
+        settings_dict.update(settings)
+        database = SQLiteDatabaseWrapper(settings_dict, alias="backend_test")
+        self.addCleanup(database.close)
+        if settings_dict["POOL_SIZE"]:
+            self.addCleanup(connection_pool(settings_dict).clear)
+        return database
+
+    def pragma(self, database, pragma):
+        with database.cursor() as cursor:
+            cursor.execute("PRAGMA {}".format(pragma))
+            return cursor.fetchone()[0]
+
+    def test_sqlite_pragmas_are_applied(self):
+        database = self.database(PRAGMAS={"journal_mode": "WAL", "synchronous": "NORMAL", "mmap_size": 1048576})
+        self.assertEqual(self.pragma(database, "journal_mode"), "wal")
+        self.assertEqual(self.pragma(database, "synchronous"), 1)
+        self.assertEqual(self.pragma(database, "mmap_size"), 1048576)
+        self.assertEqual(self.pragma(self.database(), "synchronous"), 2)
+
+    def test_pool_reuses_closed_connections(self):
+        first, second, third = [self.database(POOL_SIZE=1) for _ in range(3)]
+        first.ensure_connection()
+        raw_connection = first.connection
+        first.close()
+        self.assertEqual(len(connection_pool(first.settings_dict)), 1)
+        second.ensure_connection()
+        third.ensure_connection()
+        self.assertIs(second.connection, raw_connection)
+        self.assertIsNot(third.connection, raw_connection)
+        second.close()
+        third.close()
+        self.assertEqual(len(connection_pool(first.settings_dict)), 1)
+
+    def test_pool_rolls_back_open_transactions(self):
+        first, second = self.database(POOL_SIZE=1), self.database(POOL_SIZE=1)
+        with first.cursor() as cursor:
+            cursor.execute("CREATE TABLE pooled (value INTEGER)")
+        first.set_autocommit(False)
+        with first.cursor() as cursor:
+            cursor.execute("INSERT INTO pooled VALUES (1)")
+        first.close()
+        with second.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM pooled")
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+
+@override_settings(NIX_READ_REPLICAS=["replica_test"])
+class ReadReplicaRoutingTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.databases["replica_test"] = dict(
+            connection.settings_dict, NAME=os.path.join(directory.name, "replica.sqlite3"), CONN_MAX_AGE=0,
+            PRAGMAS={}, POOL_SIZE=0)
+        self.addCleanup(self.remove_replica)
+        with connections["replica_test"].schema_editor() as editor:
+            for model in (User, Transfer, TransferAggregate, TableVersion):
+                editor.create_model(model)
+        user = User(name="User A", cnpj="123")
+        user.save()
+        Transfer(user_id=user, transfer_value=100).save()
+        User.objects.using("replica_test").bulk_create([User(id=user.id, name="Replica user", cnpj="123")])
+        Transfer.objects.using("replica_test").bulk_create([Transfer(user_id_id=user.id, transfer_value=777,
+                                                                     creation_date=datetime.date(2019, 3, 1))])
+        replicas.reset()
+        cache.clear()
+
+    def remove_replica(self):
+        connections["replica_test"].close()
+        del connections.databases["replica_test"]
+        del connections._connections.replica_test
+
+    def transfer_values(self, response):
+        return [transfer['transfer_value'] for transfer in json.loads(response.data)]
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.transfer_values(client.get(reverse('get_all_transfers'))), [777])
+        response = client.get(reverse('get_all_users'))
+        self.assertEqual([user['name'] for user in json.loads(response.data)], ['Replica user'])
+        response = client.get(reverse('get_all_transfers'), {'stream': 'ndjson'})
+        self.assertEqual(json.loads(b"".join(response.streaming_content))['transfer_value'], 777)
+
+    def test_single_lookups_and_writes_use_primary(self):
+        transfer = Transfer.objects.get()
+        response = client.get(reverse('get_delete_update_transfer', kwargs={'transfer_id': transfer.id}))
+        self.assertEqual(json.loads(response.data)['transfer_value'], 100)
+
+    def test_writes_pin_client_to_primary(self):
+        response = client.post(reverse('create_user'), data=json.dumps({"name": "User B", "cnpj": "456"}),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.transfer_values(client.get(reverse('get_all_transfers'))), [100])
+        response = client.get(reverse('get_all_transfers'), REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(self.transfer_values(response), [777])
+
+    def test_falls_back_to_primary_when_replica_fails(self):
+        with connections["replica_test"].schema_editor() as editor:
+            editor.delete_model(Transfer)
+        self.assertEqual(self.transfer_values(client.get(reverse('get_all_transfers'))), [100])
+        self.assertIsNone(replicas.select(["replica_test"]))
+
+    def test_replica_selection(self):
+        replica_set = ReplicaSet()
+        self.assertEqual([replica_set.select(["a", "b"]) for _ in range(3)], ["a", "b", "a"])
+        with replica_set.using("b"), replica_set.using("b"), replica_set.using("a"):
+            self.assertEqual(replica_set.select(["a", "b", "c"], "least_loaded"), "c")
+            self.assertEqual(replica_set.select(["a", "b"], "least_loaded"), "a")
+        replica_set.mark_unavailable("a", 30)
+        self.assertEqual(replica_set.select(["a", "b"], "least_loaded"), "b")
+
+    def test_streams_read_from_replica_only_while_producing_chunks(self):
+        router = ReadReplicaRouter()
+        replica_set = ReplicaSet()
+        content = replica_set.stream_from("a", (router.db_for_read(Transfer) for _ in range(2)))
+        self.assertEqual(next(content), "a")
+        self.assertIsNone(router.db_for_read(Transfer))
+        self.assertEqual(replica_set.in_flight["a"], 1)
+        self.assertEqual(list(content), ["a"])
+        self.assertEqual(replica_set.in_flight["a"], 0)
+
+
+class ReclassifyTransfersTest(TestCase):
+    def setUp(self):
+        self.user = User(name="User A", cnpj="123")
+        self.user.save()
+
+    def create_transfer(self, payers_bank, receivers_bank, transfer_value, hour=12):
+        transfer = Transfer(user_id=self.user, payers_bank=payers_bank, receivers_bank=receivers_bank,
+                            transfer_value=transfer_value, creation_date=datetime.datetime(2019, 3, 1, hour))
+        transfer.save()
+        return transfer
+
+    def reclassify(self, *args):
+        out = StringIO()
+        call_command('reclassify_transfers', *args, stdout=out)
+        return out.getvalue().splitlines()
+
+    def test_set_based_rules_match_per_row_rule(self):
+        for hour in range(24):
+            transfer_ids = [self.create_transfer(payers_bank, receivers_bank, transfer_value, hour).id
+                            for payers_bank, receivers_bank in (("001", "001"), ("001", "002"))
+                            for transfer_value in (1, Transfer.TED_MAX_VALUE - 1, Transfer.TED_MAX_VALUE, 100000)]
+            transfers = Transfer.objects.filter(id__in=transfer_ids) \
+                .annotate(creation_hour=Value(hour, output_field=IntegerField()))
+            for transfer_type, expected_type in transfers.annotate(
+                    expected_type=Transfer.transfer_type_expression("creation_hour")) \
+                    .values_list("transfer_type", "expected_type"):
+                self.assertEqual(transfer_type, expected_type)
+            self.assertFalse(transfers.filter(Transfer.misclassified("creation_hour")).exists())
+        self.assertEqual(self.reclassify(), ["Reclassified 0 transfers."])
+
+    def test_applies_many_deltas_in_batches(self):
+        deltas = {(user_id, "DOC", datetime.date(2019, 1, 1) + datetime.timedelta(days=day)): (day + 1, 1)
+                  for day in range(TransferAggregate.BULK_DELTAS_THRESHOLD + 10) for user_id in (self.user.id, None)}
+        with self.assertNumQueries(5):
+            TransferAggregate.apply_deltas(deltas)
+        with self.assertNumQueries(2):
+            TransferAggregate.apply_deltas(deltas)
+        self.assertEqual({(aggregate.user_id_id, aggregate.transfer_type, aggregate.day):
+                          (aggregate.total, aggregate.count) for aggregate in TransferAggregate.objects.all()},
+                         {key: (total * 2, count * 2) for key, (total, count) in deltas.items()})
+
+    def test_reclassifies_changed_transfers(self):
+        same_bank = self.create_transfer("001", "001", 100)
+        ted = self.create_transfer("001", "002", 100)
+        doc = self.create_transfer("001", "002", 100, hour=20)
+        large = self.create_transfer("001", "002", 6000)
+        Transfer.objects.filter(id=same_bank.id).update(receivers_bank="002")
+        Transfer.objects.filter(id=ted.id).update(transfer_value=7000)
+        Transfer.objects.filter(id=doc.id).update(receivers_bank="001")
+        Transfer.objects.filter(id=large.id).update(transfer_type="TED")
+        call_command('rebuild_transfer_aggregates', '--reconcile', stdout=StringIO())
+        self.assertEqual(self.reclassify("--dry-run"), ["Would reclassify 4 transfers.", "CC -> DOC: 1",
+                                                         "DOC -> CC: 1", "TED -> DOC: 2"])
+        self.assertEqual(self.reclassify("--chunk-size", "2"), ["Reclassified 4 transfers.", "CC -> DOC: 1",
+                                                                 "DOC -> CC: 1", "TED -> DOC: 2"])
+        self.assertEqual(dict(Transfer.objects.values_list("id", "transfer_type")),
+                         {same_bank.id: "DOC", ted.id: "DOC", doc.id: "CC", large.id: "DOC"})
+        self.assertEqual(self.reclassify(), ["Reclassified 0 transfers."])
+        out = StringIO()
+        call_command('rebuild_transfer_aggregates', '--reconcile', stdout=out)
+        self.assertIn("Adjusted 0 of", out.getvalue())
+
+
+class ArchiveTransfersTest(TestCase):
+    def setUp(self):
+        lookup_cache().clear()
+        self.user = User(name="User A", cnpj="123")
+        self.user.save()
+        self.old = self.create_transfer(100, datetime.datetime(2017, 5, 10, 12))
+        self.old_deleted = self.create_transfer(200, datetime.datetime(2017, 5, 11, 12))
+        self.recent_deleted = self.create_transfer(300, datetime.datetime(2019, 3, 1, 12))
+        self.recent = self.create_transfer(400, datetime.datetime(2019, 3, 2, 12))
+        self.old_deleted.delete()
+        self.recent_deleted.delete()
+
+    def create_transfer(self, transfer_value, creation_date):
+        transfer = Transfer(user_id=self.user, transfer_value=transfer_value, creation_date=creation_date)
+        transfer.save()
+        return transfer
+
+    def archive(self, *args):
+        out = StringIO()
+        call_command('archive_transfers', *args, stdout=out)
+        return out.getvalue().strip()
+
+    def filter_by_date(self, date_filter, **params):
+        response = client.get(reverse('filter_transfers', kwargs={'filter_type': 'date', 'filter': date_filter}),
+                              params)
+        return [transfer['transfer_value'] for transfer in json.loads(response.data)]
+
+    def test_can_archive_deleted_transfers(self):
+        self.assertEqual(self.archive("--deleted-only", "--dry-run"), "Would archive 2 transfers deleted.")
+        self.assertEqual(self.archive("--deleted-only"), "Archived 2 transfers deleted.")
+        self.assertEqual(list(Transfer.objects.order_by("id").values_list("id", flat=True)),
+                         [self.old.id, self.recent.id])
+        self.assertEqual(list(TransferArchive.objects.order_by("id").values_list("id", "is_deleted", "month")),
+                         [(self.old_deleted.id, True, datetime.date(2017, 5, 1)),
+                          (self.recent_deleted.id, True, datetime.date(2019, 3, 1))])
+        self.assertEqual(Transfer.transfer_total(), 500)
+
+    def test_can_archive_old_transfers(self):
+        client.get(reverse('get_delete_update_transfer', kwargs={'transfer_id': self.old.id}))
+        self.assertEqual(self.archive("--before", "2018-01", "--chunk-size", "2"),
+                         "Archived 3 transfers created before 2018-01-01 or deleted.")
+        self.assertEqual(list(Transfer.objects.values_list("id", flat=True)), [self.recent.id])
+        self.assertEqual(Transfer.transfer_total(), 400)
+        out = StringIO()
+        call_command('rebuild_transfer_aggregates', '--reconcile', stdout=out)
+        self.assertIn("Adjusted 0 of", out.getvalue())
+        response = client.get(reverse('get_delete_update_transfer', kwargs={'transfer_id': self.old.id}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_date_filters_can_include_archive(self):
+        self.archive("--before", "2018-01")
+        self.assertEqual(self.filter_by_date("2017..2019"), [400])
+        self.assertEqual(self.filter_by_date("2017..2019", archived="true"), [100, 400])
+        self.assertEqual(self.filter_by_date("2017-05-10", archived="true"), [100])
+        self.assertEqual(self.filter_by_date("2017-06..", archived="true"), [400])
+
+    def test_archive_is_pruned_by_date_range(self):
+        self.archive("--before", "2018-01")
+        with self.assertNumQueries(1):
+            self.assertFalse(TransferArchive.filter_by_date("2018-01..").exists())
+        self.assertIn('"month" >=', str(TransferArchive.filter_by_date("2017-05").query))
+
+
+class TransferAnalyticsTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User(name="User A", cnpj="123")
+        self.user.save()
+        today = datetime.date.today()
+        self.transfer = self.create_transfer(100, "Bank A", "Alice", today)
+        self.create_transfer(300, "Bank A", "Bob", today - datetime.timedelta(days=10))
+        self.create_transfer(2000, "Bank B", "Bob", today - datetime.timedelta(days=40))
+        self.create_transfer(5000, "Bank C", "Carol", today - datetime.timedelta(days=400))
+        transfer_index().invalidate()
+
+    def create_transfer(self, transfer_value, payers_bank, payers_name, creation_date):
+        transfer = Transfer(user_id=self.user, transfer_value=transfer_value, payers_bank=payers_bank,
+                            receivers_bank=payers_bank, payers_name=payers_name,
+                            creation_date=datetime.datetime.combine(creation_date, datetime.time(12)))
+        transfer.save()
+        return transfer
+
+    def analytics(self, **params):
+        response = client.get(reverse('get_transfer_analytics'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.data)
+
+    def test_can_group_recent_transfers(self):
+        self.assertEqual(self.analytics(op="group_by", by="payers_bank"),
+                         [{"group": "Bank B", "total": 2000, "count": 1},
+                          {"group": "Bank A", "total": 400, "count": 2}])
+        self.assertEqual(self.analytics(op="group_by", by="payers_bank", days=30),
+                         [{"group": "Bank A", "total": 400, "count": 2}])
+        with self.assertNumQueries(0):
+            self.assertEqual(transfer_index().group_by("user_id"), [{"group": self.user.id, "total": 2400, "count": 3}])
+
+    def test_can_get_top_groups(self):
+        self.assertEqual(self.analytics(op="top", by="payers_name", k=1), [{"group": "Bob", "total": 2300, "count": 2}])
+
+    def test_can_get_histograms(self):
+        self.assertEqual(self.analytics(op="histogram"), [{"min": 64, "max": 127, "count": 1},
+                                                          {"min": 256, "max": 511, "count": 1},
+                                                          {"min": 1024, "max": 2047, "count": 1}])
+        self.assertEqual(self.analytics(op="histogram", edges="200,1000"), [{"min": None, "max": 200, "count": 1},
+                                                                            {"min": 200, "max": 1000, "count": 1},
+                                                                            {"min": 1000, "max": None, "count": 1}])
+
+    def test_index_follows_saves_and_deletes(self):
+        transfer_index().ensure_loaded()
+        self.create_transfer(700, "Bank C", "Carol", datetime.date.today())
+        self.transfer.transfer_value = 150
+        self.transfer.save()
+        client.delete(reverse('get_delete_update_transfer', kwargs={'transfer_id': self.transfer.id}))
+        with self.assertNumQueries(0):
+            self.assertEqual(transfer_index().group_by("payers_bank"),
+                             [{"group": "Bank B", "total": 2000, "count": 1},
+                              {"group": "Bank C", "total": 700, "count": 1},
+                              {"group": "Bank A", "total": 300, "count": 1}])
+        Transfer.bulk_create_from_dicts([{"user_id": self.user.id, "transfer_value": 50, "payers_bank": "Bank D",
+                                          "creation_date": datetime.date.today().isoformat() + "T09:00:00"}])
+        self.assertEqual(transfer_index().group_by("payers_bank", limit=1, days=1),
+                         [{"group": "Bank C", "total": 700, "count": 1}])
+        self.assertIn({"group": "Bank D", "total": 50, "count": 1}, transfer_index().group_by("payers_bank"))
+
+    def test_readers_keep_the_current_arrays_during_a_reload(self):
+        index = TransferIndex()
+        index.ensure_loaded()
+        index.invalidate()
+        loading, loaded = threading.Event(), threading.Event()
+        append = TransferIndex._append
+
+        def slow_append(fresh, row):
+            loading.set()
+            loaded.wait(5)
+            append(fresh, row)
+
+        def reload():
+            index.ensure_loaded()
+            connection.close()
+
+        with mock.patch.object(TransferIndex, '_append', slow_append):
+            loader = threading.Thread(target=reload)
+            loader.start()
+            self.assertTrue(loading.wait(5))
+            started = time.monotonic()
+            self.assertEqual(index.group_by("payers_bank"), [{"group": "Bank B", "total": 2000, "count": 1},
+                                                             {"group": "Bank A", "total": 400, "count": 2}])
+            self.assertLess(time.monotonic() - started, 1)
+            loaded.set()
+            loader.join()
+        self.assertIsNotNone(index.loaded_at)
+
+    def test_index_ignores_rolled_back_writes(self):
+        transfer_index().ensure_loaded()
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.create_transfer(700, "Bank C", "Carol", datetime.date.today())
+                Transfer.objects.get(id=self.transfer.id).hard_delete()
+                raise ValueError("rolled back")
+        self.assertEqual(transfer_index().group_by("payers_bank"), [{"group": "Bank B", "total": 2000, "count": 1},
+                                                                    {"group": "Bank A", "total": 400, "count": 2}])
+
+    def test_rejects_bad_queries(self):
+        for params in ({"op": "group_by", "by": "payers_account"}, {"op": "median"}, {"op": "top", "k": "x"},
+                       {"op": "histogram", "days": "0"}):
+            response = client.get(reverse('get_transfer_analytics'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(NIX_ANALYTICS_INDEX={"ENABLED": False}):
+            response = client.get(reverse('get_transfer_analytics'), {"op": "histogram"})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class IdempotentCreateTest(TestCase):
+    def setUp(self):
+        self.user = User(name="User A", cnpj="123")
+        self.user.save()
+        self.transfer_data = {"user_id": self.user.id, "payers_bank": "001", "receivers_bank": "001",
+                              "transfer_value": 100, "creation_date": "2019-03-01T10:00:00"}
+
+    def post(self, url_name, data, key=None, **extra):
+        if key:
+            extra['HTTP_IDEMPOTENCY_KEY'] = key
+        response = client.post(reverse(url_name), data=json.dumps(data), content_type='application/json', **extra)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_retries_replay_the_original_response(self):
+        first = self.post('create_transfer', self.transfer_data, key="retry-1")
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        with self.assertNumQueries(1):
+            retry = self.post('create_transfer', self.transfer_data, key="retry-1")
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transfer.objects.count(), 1)
+        self.assertEqual(Transfer.transfer_total(), 100)
+        self.post('create_transfer', self.transfer_data, key="retry-2")
+        self.post('create_transfer', self.transfer_data)
+        self.assertEqual(Transfer.objects.count(), 3)
+
+    def test_keys_are_scoped_by_endpoint_and_client(self):
+        self.post('create_user', {"name": "User B", "cnpj": "456"}, key="same")
+        self.post('create_user', {"name": "User B", "cnpj": "456"}, key="same")
+        self.post('create_user', {"name": "User B", "cnpj": "456"}, key="same", HTTP_X_API_KEY="other-client")
+        self.post('create_transfer', self.transfer_data, key="same")
+        self.assertEqual(User.objects.filter(name="User B").count(), 2)
+        self.assertEqual(Transfer.objects.count(), 1)
+
+    def test_reusing_a_key_with_another_body_is_rejected(self):
+        self.post('create_transfer', self.transfer_data, key="retry-1")
+        response = self.post('create_transfer', dict(self.transfer_data, transfer_value=200), key="retry-1")
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Transfer.transfer_total(), 100)
+
+    def test_async_responses_are_replayed(self):
+        first = self.post('create_transfer', self.transfer_data, key="async-1", HTTP_PREFER='respond-async')
+        retry = self.post('create_transfer', self.transfer_data, key="async-1", HTTP_PREFER='respond-async')
+        self.assertEqual(retry.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Location'], first['Location'])
+        self.assertEqual(TransferIntake.objects.count(), 1)
+
+    def test_expired_keys_are_purged_in_batches(self):
+        for key in ("a", "b", "c"):
+            self.post('create_user', {"name": key, "cnpj": "1"}, key=key)
+        IdempotencyKey.objects.exclude(key="c").update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        self.post('create_user', {"name": "a", "cnpj": "1"}, key="a")
+        self.assertEqual(User.objects.filter(name="a").count(), 2)
+        out = StringIO()
+        call_command('purge_idempotency_keys', '--batch-size', '1', stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Purged 1 expired idempotency keys.")
+        self.assertEqual(sorted(IdempotencyKey.objects.values_list("key", flat=True)), ["a", "c"])
+
+
+class ASGIHandlerTest(TransactionTestCase):
+    # Pool threads open their own connections, so the data has to be committed for them to see it.
+    def setUp(self):
+        self.user = User(name="User A", cnpj="123")
+        self.user.save()
+        for transfer_value in (100, 200, 300):
+            Transfer(user_id=self.user, transfer_value=transfer_value, payers_bank="001", receivers_bank="001",
+                     creation_date=datetime.datetime(2019, 3, 1, 12)).save()
+        self.handler = ASGIHandler()
+        self.addCleanup(self.handler.executor.shutdown)
+
+    @staticmethod
+    def scope(path, method="GET", query_string=b"", headers=()):
+        return {"type": "http", "method": method, "path": path, "query_string": query_string,
+                "headers": [(b"host", b"testserver")] + list(headers), "client": ("127.0.0.1", 5000),
+                "server": ("testserver", 80), "http_version": "1.1", "scheme": "http", "root_path": ""}
+
+    def request(self, path, method="GET", query_string=b"", body=b"", headers=()):
+        messages = []
+        chunks = [{"type": "http.request", "body": body[:5], "more_body": True},
+                  {"type": "http.request", "body": body[5:]}]
+
+        async def receive():
+            return chunks.pop(0)
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(self.handler(self.scope(path, method, query_string, headers), receive, send))
+        return messages
+
+    def test_serves_read_endpoints(self):
+        start, body = self.request(reverse('get_transfer_total'))
+        self.assertEqual(start["status"], status.HTTP_200_OK)
+        self.assertIn((b"Content-Type", b"application/json"), start["headers"])
+        self.assertEqual(json.loads(json.loads(body["body"])), {"transfer_total": 600})
+        start, body = self.request(reverse('get_all_transfers'), query_string=b"limit=2")
+        self.assertEqual(len(json.loads(json.loads(body["body"]))["results"]), 2)
+
+    def test_passes_request_bodies_and_headers(self):
+        messages = self.request(reverse('create_user'), method="POST",
+                                body=json.dumps({"name": "User B", "cnpj": "456"}).encode(),
+                                headers=[(b"content-type", b"application/json")])
+        self.assertEqual(messages[0]["status"], status.HTTP_201_CREATED)
+        self.assertTrue(User.objects.filter(name="User B").exists())
+
+    def test_streams_responses_in_chunks(self):
+        messages = self.request(reverse('get_all_transfers'), query_string=b"stream=ndjson")
+        self.assertEqual(messages[0]["status"], status.HTTP_200_OK)
+        self.assertTrue(all(message["more_body"] for message in messages[1:-1]))
+        self.assertFalse(messages[-1].get("more_body", False))
+        rows = b"".join(message["body"] for message in messages[1:]).decode().splitlines()
+        self.assertEqual([json.loads(row)["transfer_value"] for row in rows], [100, 200, 300])
+
+    def test_each_stream_reads_on_a_thread_of_its_own(self):
+        messages, chunk_threads = [], []
+
+        async def send(message):
+            messages.append(message)
+
+        def chunks():
+            for transfer in Transfer.objects.order_by("id").iterator(chunk_size=1):
+                chunk_threads.append(threading.current_thread())
+                yield str(transfer.transfer_value).encode()
+
+        asyncio.run(self.handler.stream(StreamingHttpResponse(chunks()), send))
+        self.assertEqual(b"".join(message["body"] for message in messages), b"100200300")
+        self.assertEqual(len(set(chunk_threads)), 1)
+        self.assertTrue(chunk_threads[0].name.startswith("nix-asgi-stream"))
+
+    def test_slow_streaming_clients_do_not_hold_a_thread(self):
+        self.handler.executor.shutdown()
+        self.handler.executor = ThreadPoolExecutor(1)
+        self.addCleanup(self.handler.executor.shutdown)
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            messages.append(message)
+
+        async def serve():
+            streaming, client_ready = asyncio.Event(), asyncio.Event()
+
+            async def slow_send(message):
+                if message.get("more_body"):
+                    streaming.set()
+                    await client_ready.wait()
+
+            stream = asyncio.ensure_future(self.handler(
+                self.scope(reverse('get_all_transfers'), query_string=b"stream=ndjson"), receive, slow_send))
+            await streaming.wait()
+            await asyncio.wait_for(self.handler(self.scope(reverse('get_transfer_total')), receive, send), 5)
+            client_ready.set()
+            await stream
+
+        asyncio.run(serve())
+        self.assertEqual(json.loads(json.loads(messages[1]["body"])), {"transfer_total": 600})
+
+
+class UserTransferHistoryTest(TestCase):
+    def setUp(self):
+        self.users = [User(name="User {}".format(index), cnpj=str(index)) for index in range(3)]
+        for user in self.users:
+            user.save()
+        self.transfers = {user.id: [] for user in self.users}
+        for index in range(9):
+            user = self.users[index % 3]
+            transfer = Transfer(user_id=user, transfer_value=100 * (index + 1), payers_bank="001",
+                                receivers_bank="001", creation_date=datetime.datetime(2019, 3, 1, 12))
+            transfer.save()
+            self.transfers[user.id].append(transfer)
+        self.transfers[self.users[0].id].pop(1).delete()
+
+    def history(self, url_name, **kwargs):
+        params = kwargs.pop('params', {})
+        response = client.get(reverse(url_name, kwargs=kwargs), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.data)
+
+    def test_can_page_through_a_user_history(self):
+        user = self.users[1]
+        first_page = self.history('get_user_transfers', user_id=user.id, params={'limit': 2})
+        self.assertEqual((first_page['name'], first_page['transfer_total'], first_page['transfer_count']),
+                         (user.name, 200 + 500 + 800, 3))
+        self.assertEqual([transfer['transfer_value'] for transfer in first_page['transfers']], [200, 500])
+        second_page = self.history('get_user_transfers', user_id=user.id,
+                                   params={'limit': 2, 'cursor': first_page['next_cursor']})
+        self.assertEqual([transfer['transfer_value'] for transfer in second_page['transfers']], [800])
+        self.assertIsNone(second_page['next_cursor'])
+
+    def test_skips_deleted_transfers(self):
+        history = self.history('get_user_transfers', user_id=self.users[0].id)
+        self.assertEqual([transfer['transfer_value'] for transfer in history['transfers']], [100, 700])
+        self.assertEqual(history['transfer_total'], 800)
+
+    def test_query_count_does_not_grow_with_users(self):
+        for users in (self.users[:1], self.users):
+            ids = ",".join(str(user.id) for user in users)
+            with self.assertNumQueries(3):
+                history = self.history('get_users_transfers', params={'ids': ids, 'limit': 1})
+            self.assertEqual([user['id'] for user in history], [user.id for user in users])
+        self.assertEqual([[transfer['transfer_value'] for transfer in user['transfers']] for user in history],
+                         [[100], [200], [300]])
+        self.assertEqual([user['next_cursor'] is not None for user in history], [True, True, True])
+
+    def test_each_user_pages_from_its_own_cursor(self):
+        ids = ",".join(str(user.id) for user in self.users)
+        first_page = self.history('get_users_transfers', params={'ids': ids, 'limit': 1})
+        params = {'ids': ids, 'limit': 1, 'cursor_{}'.format(self.users[0].id): first_page[0]['next_cursor'],
+                  'cursor_{}'.format(self.users[2].id): first_page[2]['next_cursor']}
+        with self.assertNumQueries(3):
+            second_page = self.history('get_users_transfers', params=params)
+        self.assertEqual([[transfer['transfer_value'] for transfer in user['transfers']] for user in second_page],
+                         [[700], [200], [600]])
+        self.assertEqual([user['next_cursor'] is not None for user in second_page], [False, True, True])
+
+    def test_rejects_bad_requests(self):
+        response = client.get(reverse('get_user_transfers', kwargs={'user_id': 0}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        for params in ({'ids': 'a,b'}, {'ids': ''}, {'ids': ','.join(str(index) for index in range(101))},
+                       {'ids': '1', 'limit': 0}, {'ids': '1', 'cursor_1': 'x'}):
+            response = client.get(reverse('get_users_transfers'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BatchChangeTransfersTest(TestCase):
+    def setUp(self):
+        lookup_cache().clear()
+        self.user = User(name="User A", cnpj="123")
+        self.user.save()
+        self.transfers = []
+        for index in range(6):
+            transfer = Transfer(user_id=self.user, transfer_value=1000 * (index + 1),
+                                payers_name="Payer {}".format(index % 2), payers_bank="001", receivers_bank="001",
+                                creation_date=datetime.datetime(2019, 3, 1, 12))
+            transfer.save()
+            self.transfers.append(transfer)
+
+    def batch(self, action, data, **params):
+        url = reverse('batch_change_transfers', kwargs={'action': action})
+        if params:
+            url += '?' + '&'.join('{}={}'.format(key, value) for key, value in params.items())
+        return client.post(url, data=json.dumps(data), content_type='application/json')
+
+    def assert_aggregates_match(self):
+        out = StringIO()
+        call_command('rebuild_transfer_aggregates', '--reconcile', stdout=out)
+        self.assertIn("Adjusted 0 of", out.getvalue())
+
+    def test_can_delete_and_restore_in_chunks(self):
+        ids = [transfer.id for transfer in self.transfers[:3]] + [0]
+        response = self.batch('delete', {'ids': ids}, chunk_size=2)
+        self.assertEqual(json.loads(response.data), {'matched': 3, 'updated': 3, 'rejected': 0})
+        self.assertEqual(Transfer.transfer_total(), 4000 + 5000 + 6000)
+        self.assertEqual(json.loads(self.batch('delete', {'ids': ids}).data),
+                         {'matched': 0, 'updated': 0, 'rejected': 0})
+        response = self.batch('restore', {}, payers_name='Payer 0')
+        self.assertEqual(json.loads(response.data), {'matched': 2, 'updated': 2, 'rejected': 0})
+        self.assertEqual(Transfer.transfer_total(), 21000 - 2000)
+        self.assert_aggregates_match()
+
+    def test_updates_reclassify_and_move_totals(self):
+        response = self.batch('update', {'values': {'receivers_bank': '002', 'creation_date': '2019-03-02T00:00:00'}},
+                              payers_name='Payer 1')
+        self.assertEqual(json.loads(response.data), {'matched': 3, 'updated': 3, 'rejected': 0})
+        self.assertEqual(set(Transfer.objects.filter(payers_name='Payer 1')
+                             .values_list('transfer_type', 'creation_date')), {('DOC', datetime.date(2019, 3, 2))})
+        self.assertEqual(Transfer.transfer_total(), 21000)
+        self.assert_aggregates_match()
+
+    def test_enforces_value_limit_in_sql(self):
+        self.transfers[5].transfer_value = Transfer.MAX_TRANSFER_VALUE - 100
+        self.transfers[5].save()
+        with self.assertNumQueries(9):
+            response = self.batch('update', {'ids': [transfer.id for transfer in self.transfers[4:]],
+                                             'values': {'transfer_value_delta': 500}})
+        self.assertEqual(json.loads(response.data), {'matched': 2, 'updated': 1, 'rejected': 1})
+        self.assertEqual(list(Transfer.objects.filter(id__in=[self.transfers[4].id, self.transfers[5].id])
+                              .order_by('id').values_list('transfer_value', flat=True)),
+                         [5500, Transfer.MAX_TRANSFER_VALUE - 100])
+        self.assert_aggregates_match()
+
+    def test_rejects_bad_batches(self):
+        too_large = {'transfer_value': Transfer.MAX_TRANSFER_VALUE + 1}
+        for action, data, params in (('update', {'ids': [1], 'values': too_large}, {}),
+                                     ('update', {'ids': [1], 'values': {'is_deleted': False}}, {}),
+                                     ('update', {'ids': [1]}, {}),
+                                     ('delete', {}, {}),
+                                     ('delete', {'ids': ['x']}, {}),
+                                     ('delete', {'ids': [1]}, {'chunk_size': 0})):
+            response = self.batch(action, data, **params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.batch('purge', {'ids': [1]}).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(Transfer.transfer_total(), 21000)
+
+
+RATE_LIMITS = dict(settings.NIX_RATE_LIMITS, ENABLED=True, BUDGETS={"cheap": {"RATE": 0.01, "BURST": 3},
+                                                                     "expensive": {"RATE": 0.01, "BURST": 1}})
+
+
+@override_settings(NIX_RATE_LIMITS=RATE_LIMITS)
+class RateLimitTest(TestCase):
+    def setUp(self):
+        rate_limiter().clear()
+        self.addCleanup(rate_limiter().clear)
+
+    def test_limits_each_client_per_budget(self):
+        for _ in range(3):
+            self.assertEqual(client.get(reverse("get_transfer_total")).status_code, status.HTTP_200_OK)
+        response = client.get(reverse("get_transfer_total"))
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "100")
+        self.assertEqual(client.get(reverse("get_transfer_total"), HTTP_X_API_KEY="other").status_code,
+                         status.HTTP_200_OK)
+        self.assertEqual(client.get(reverse("get_all_transfers")).status_code, status.HTTP_200_OK)
+        self.assertEqual(client.get(reverse("get_all_transfers")).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(client.get(reverse("get_metrics")).status_code, status.HTTP_200_OK)
+
+    def test_buckets_refill_over_time(self):
+        for backend in (MemoryRateLimitBackend(max_keys=10), DjangoCacheRateLimitBackend()):
+            backend.clear()
+            self.assertEqual(backend.take("client", 10, 2), 0)
+            self.assertEqual(backend.take("client", 10, 2), 0)
+            self.assertAlmostEqual(backend.take("client", 10, 2), 0.1, places=2)
+            time.sleep(0.11)
+            self.assertEqual(backend.take("client", 10, 2), 0)
+            self.assertEqual(backend.take("other", 10, 2), 0)
+
+    def test_cache_backend_takes_are_atomic(self):
+        backend = DjangoCacheRateLimitBackend(lock_wait=5)
+        backend.clear()
+        with ThreadPoolExecutor(8) as executor:
+            waits = list(executor.map(lambda _: backend.take("client", 0.001, 50), range(200)))
+        self.assertEqual(waits.count(0), 50)
+
+    def test_memory_backend_evicts_least_recent_clients(self):
+        backend = MemoryRateLimitBackend(max_keys=2)
+        for key in ("a", "b", "a", "c"):
+            backend.take(key, 1, 1)
+        self.assertEqual(list(backend._buckets), ["a", "c"])
+
+
+@override_settings(NIX_BULKHEADS={"heavy": {"MAX_CONCURRENT": 1, "TIMEOUT": 0, "RETRY_AFTER": 2}})
+class BulkheadTest(TestCase):
+    def test_sheds_load_when_full(self):
+        compartment = get_bulkhead("heavy")
+        self.assertTrue(compartment.acquire())
+        response = client.get(reverse("get_all_transfers"))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "2")
+        self.assertEqual(compartment.rejected, 1)
+        compartment.release()
+        self.assertEqual(client.get(reverse("get_all_transfers")).status_code, status.HTTP_200_OK)
+        self.assertEqual(client.get(reverse("get_transfer_total")).status_code, status.HTTP_200_OK)
+
+    def test_counts_concurrent_rejections(self):
+        compartment = Bulkhead(1)
+        self.assertTrue(compartment.acquire())
+
+        def reject():
+            for _ in range(1000):
+                compartment.acquire()
+
+        threads = [threading.Thread(target=reject) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(compartment.rejected, 8000)
+
+    def test_streaming_responses_hold_their_slot_until_closed(self):
+        response = client.get(reverse("export_transfers"))
+        self.assertTrue(response.streaming)
+        self.assertEqual(client.get(reverse("get_all_users")).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        b"".join(response.streaming_content)
+        response.close()
+        self.assertEqual(client.get(reverse("get_all_users")).status_code, status.HTTP_200_OK)
+
+
+class ConditionalGetTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User(name="User A", cnpj="123")
+        self.user.save()
+        Transfer(user_id=self.user, payers_bank="001", receivers_bank="001", transfer_value=100,
+                 creation_date=datetime.datetime(2019, 3, 1, 10)).save()
+
+    def test_answers_not_modified_without_running_the_query(self):
+        for url in (reverse('get_all_transfers'), reverse('get_all_users'), reverse('get_transfer_total')):
+            response = client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn('Last-Modified', response)
+            with self.assertNumQueries(1):
+                not_modified = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(not_modified.content, b'')
+            self.assertEqual(not_modified['ETag'], response['ETag'])
+            not_modified = client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_writes_change_the_etag(self):
+        transfers_etag = client.get(reverse('get_all_transfers'))['ETag']
+        users_etag = client.get(reverse('get_all_users'))['ETag']
+        Transfer.batch_change('update', Transfer.objects.all(), {'transfer_value': 200})
+        response = client.get(reverse('get_all_transfers'), HTTP_IF_NONE_MATCH=transfers_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.data)[0]['transfer_value'], 200)
+        self.assertEqual(client.get(reverse('get_all_users'), HTTP_IF_NONE_MATCH=users_etag).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        transfers_etag = response['ETag']
+        self.user.delete()
+        self.assertEqual(client.get(reverse('get_all_users'), HTTP_IF_NONE_MATCH=users_etag).status_code,
+                         status.HTTP_200_OK)
+        self.assertEqual(client.get(reverse('get_all_transfers'), HTTP_IF_NONE_MATCH=transfers_etag).status_code,
+                         status.HTTP_200_OK)
+
+    def test_versions_move_once_per_committed_transaction(self):
+        version = TableVersion.objects.get(table=TableVersion.TRANSFERS).version
+        with transaction.atomic():
+            for transfer_value in (200, 300):
+                Transfer(user_id=self.user, transfer_value=transfer_value).save()
+            self.assertEqual(TableVersion.objects.get(table=TableVersion.TRANSFERS).version, version)
+        self.assertEqual(TableVersion.objects.get(table=TableVersion.TRANSFERS).version, version + 1)
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                Transfer(user_id=self.user, transfer_value=400).save()
+                raise ValueError("rolled back")
+        self.assertEqual(TableVersion.objects.get(table=TableVersion.TRANSFERS).version, version + 1)
+
+    def test_etag_depends_on_the_representation(self):
+        response = client.get(reverse('get_transfer_total'))
+        other = client.get(reverse('get_transfer_total'), HTTP_ACCEPT='application/json')
+        self.assertNotEqual(response['ETag'], other['ETag'])
+        self.assertEqual(client.get(reverse('get_transfer_total'), HTTP_ACCEPT='application/json',
+                                    HTTP_IF_NONE_MATCH=response['ETag']).status_code, status.HTTP_200_OK)
+
+    def test_etag_depends_on_the_query(self):
+        Transfer(user_id=self.user, payers_bank="001", receivers_bank="001", transfer_value=200,
+                 creation_date=datetime.datetime(2019, 3, 1, 11)).save()
+        first_page = client.get(reverse('get_all_transfers'), {'limit': 1})
+        cursor = json.loads(first_page.data)['next_cursor']
+        for params in ({'limit': 1, 'cursor': cursor}, {'limit': 1, 'raw': 1}):
+            response = client.get(reverse('get_all_transfers'), params, HTTP_IF_NONE_MATCH=first_page['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response['ETag'], first_page['ETag'])
+        self.assertEqual(client.get(reverse('get_all_transfers'), {'limit': 1},
+                                    HTTP_IF_NONE_MATCH=first_page['ETag']).status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class SearchTransfersTest(TestCase):
+    def setUp(self):
+        names = ["Joana", "JOAO SOUZA", "João da Silva", "Maria João", "Ana", "Ana  Lima"]
+        for name in names:
+            Transfer(payers_name=name, receivers_name=name.upper(), payers_bank="001", receivers_bank="001",
+                     transfer_value=100, creation_date=datetime.datetime(2019, 3, 1, 10)).save()
+        Transfer(payers_name="João Removido", payers_bank="001", receivers_bank="001", is_deleted=True,
+                 creation_date=datetime.datetime(2019, 3, 1, 10)).save()
+
+    def search(self, **params):
+        response = client.get(reverse('search_transfers'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.data)
+
+    def names(self, page, field='payers_name'):
+        return [transfer[field] for transfer in page['results']]
+
+    def test_matches_prefixes_ignoring_case_and_accents(self):
+        self.assertEqual(self.names(self.search(q='joão')), ["João da Silva", "JOAO SOUZA"])
+        self.assertEqual(self.names(self.search(q='JOA')), ["Joana", "João da Silva", "JOAO SOUZA"])
+        self.assertEqual(self.names(self.search(q='ana')), ["Ana", "Ana  Lima"])
+        self.assertEqual(self.names(self.search(q='ana lima')), ["Ana  Lima"])
+        self.assertEqual(self.names(self.search(q='silva')), [])
+        self.assertEqual(self.names(self.search(q='maria joao', field='receiver'), 'receivers_name'), ["MARIA JOÃO"])
+
+    def test_paginates_in_rank_order(self):
+        names, cursor = [], None
+        while True:
+            params = {'q': 'j', 'limit': 1, 'fields': 'id,payers_name'}
+            if cursor:
+                params['cursor'] = cursor
+            page = self.search(**params)
+            self.assertEqual(set(page['results'][0]), {'id', 'payers_name'})
+            names.extend(self.names(page))
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(names, ["Joana", "João da Silva", "JOAO SOUZA"])
+
+    def test_rejects_bad_searches(self):
+        for params in ({'q': ' '}, {'q': 'ana', 'field': 'bank'}, {'q': 'ana', 'cursor': 'not-a-cursor'},
+                       {'q': 'ana', 'fields': 'unknown'}, {'q': 'ana', 'cursor': _encode_cursor([1], 1)},
+                       {'q': 'ana', 'cursor': _encode_cursor(1, 1)}, {'q': 'ana', 'cursor': _encode_cursor("ana", True)}):
+            response = client.get(reverse('search_transfers'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_keeps_normalized_names_in_sync(self):
+        Transfer.batch_change('update', Transfer.objects.filter(payers_name="Joana"), {'payers_name': "Élise"})
+        Transfer.bulk_create_from_dicts([{"payers_name": "Émile", "payers_bank": "001", "receivers_bank": "001",
+                                          "creation_date": "2019-03-01T10:00:00"}])
+        transfer = Transfer.objects.get(payers_name="Ana")
+        transfer.payers_name = "Eva"
+        transfer.save()
+        self.assertEqual(self.names(self.search(q='e')), ["Élise", "Émile", "Eva"])
+        self.assertEqual(self.names(self.search(q='joa')), ["João da Silva", "JOAO SOUZA"])
+
+    def test_uses_the_search_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite query plan')
+        sql, params = Transfer.search_by_name('payer', 'joa').order_by('payers_name_search', 'id')[:10] \
+            .query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('transfer_payer_search_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
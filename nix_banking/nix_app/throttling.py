@@ -0,0 +1,196 @@
+import functools
+import math
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+from nix_app.routers import client_id
+
+DEFAULT_RATE_LIMITS = {"ENABLED": False, "BACKEND": "nix_app.throttling.MemoryRateLimitBackend", "OPTIONS": {},
+                       "BUDGETS": {}, "DEFAULT_BUDGET": None, "VIEWS": {}}
+_rate_limiter = None
+_bulkheads = {}
+_bulkheads_lock = threading.Lock()
+
+
+class BaseRateLimitBackend(object):
+    def take(self, key, rate, burst, cost=1):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    @staticmethod
+    def _refill(bucket, rate, burst, cost, now):
+        tokens, updated_at = bucket if bucket is not None else (burst, now)
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        if tokens >= cost:
+            return (tokens - cost, now), 0.0
+        return (tokens, now), (cost - tokens) / rate
+
+
+class MemoryRateLimitBackend(BaseRateLimitBackend):
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, rate, burst, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            self._buckets[key], wait = self._refill(self._buckets.get(key), rate, burst, cost, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class DjangoCacheRateLimitBackend(BaseRateLimitBackend):
+    def __init__(self, alias="default", key_prefix="nix_app:rate:", lock_timeout=1, lock_wait=0.05):
+        self.cache = caches[alias]
+        self.key_prefix = key_prefix
+        self.lock_timeout = lock_timeout
+        self.lock_wait = lock_wait
+
+    def take(self, key, rate, burst, cost=1):
+        bucket_key = self.key_prefix + key
+        locked = self._lock(bucket_key)
+        try:
+            bucket, wait = self._refill(self.cache.get(bucket_key), rate, burst, cost, time.time())
+            self.cache.set(bucket_key, bucket, int(math.ceil(burst / rate)) + 1)
+        finally:
+            if locked:
+                self.cache.delete(bucket_key + ":lock")
+        return wait
+
+    def _lock(self, bucket_key):
+        # cache.add only stores a missing key, so one process at a time updates a bucket. A crashed holder frees
+        # it after lock_timeout, and a take that cannot get it within lock_wait goes ahead unlocked.
+        deadline = time.monotonic() + self.lock_wait
+        while not self.cache.add(bucket_key + ":lock", True, self.lock_timeout):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def clear(self):
+        self.cache.clear()
+
+
+def rate_limits():
+    return dict(DEFAULT_RATE_LIMITS, **getattr(settings, "NIX_RATE_LIMITS", {}))
+
+
+def rate_limiter():
+    global _rate_limiter
+    if _rate_limiter is None:
+        config = rate_limits()
+        _rate_limiter = import_string(config["BACKEND"])(**config["OPTIONS"])
+    return _rate_limiter
+
+
+def too_busy(status_code, retry_after):
+    response = HttpResponse(status=status_code)
+    response["Retry-After"] = str(max(1, int(math.ceil(retry_after))))
+    return response
+
+
+class RateLimitMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        config = rate_limits()
+        if not config["ENABLED"]:
+            return None
+        budget_name = config["VIEWS"].get(request.resolver_match.url_name, config["DEFAULT_BUDGET"])
+        if budget_name is None:
+            return None
+        budget = config["BUDGETS"][budget_name]
+        wait = rate_limiter().take("{}:{}".format(budget_name, client_id(request)), budget["RATE"], budget["BURST"])
+        if wait:
+            return too_busy(429, wait)
+        return None
+
+
+class Bulkhead(object):
+    def __init__(self, max_concurrent, timeout=0, retry_after=1):
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.rejected = 0
+        self._rejected_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    def acquire(self):
+        if self._slots.acquire(timeout=self.timeout) if self.timeout else self._slots.acquire(blocking=False):
+            return True
+        with self._rejected_lock:
+            self.rejected += 1
+        return False
+
+    def release(self):
+        self._slots.release()
+
+
+class _SlotRelease(object):
+    def __init__(self, compartment, content):
+        self.compartment = compartment
+        self.content = iter(content)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.content)
+
+    def close(self):
+        if self.compartment is not None:
+            self.compartment.release()
+            self.compartment = None
+
+
+def get_bulkhead(name):
+    config = getattr(settings, "NIX_BULKHEADS", {}).get(name)
+    if config is None:
+        return None
+    options = (config["MAX_CONCURRENT"], config.get("TIMEOUT", 0), config.get("RETRY_AFTER", 1))
+    with _bulkheads_lock:
+        compartment = _bulkheads.get(name)
+        if compartment is None or (compartment.max_concurrent, compartment.timeout, compartment.retry_after) != options:
+            compartment = _bulkheads[name] = Bulkhead(*options)
+    return compartment
+
+
+def bulkhead(name):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            compartment = get_bulkhead(name)
+            if compartment is None:
+                return view(request, *args, **kwargs)
+            if not compartment.acquire():
+                return too_busy(503, compartment.retry_after)
+            try:
+                response = view(request, *args, **kwargs)
+            except BaseException:
+                compartment.release()
+                raise
+            if response.streaming:
+                # Assigned content that has close() is closed with the response, which frees the slot.
+                response.streaming_content = _SlotRelease(compartment, response.streaming_content)
+            else:
+                compartment.release()
+            return response
+        return wrapper
+    return decorator
@@ -5,9 +5,23 @@ urlpatterns = [
     path('api/v1/user/new', views.create_user, name='create_user'),
     path('api/v1/user/all', views.get_all_users, name='get_all_users'),
     path('api/v1/user/<int:user_id>/', views.get_delete_update_user, name='get_delete_update_user'),
+    path('api/v1/user/<int:user_id>/transfers', views.get_user_transfers, name='get_user_transfers'),
+    path('api/v1/user/transfers', views.get_users_transfers, name='get_users_transfers'),
     path('api/v1/transfer/new', views.create_transfer, name='create_transfer'),
+    path('api/v1/transfer/intake', views.get_transfer_intake_progress, name='get_transfer_intake_progress'),
+    path('api/v1/transfer/intake/<int:intake_id>/', views.get_transfer_intake, name='get_transfer_intake'),
+    path('api/v1/transfer/bulk', views.create_transfers_in_bulk, name='create_transfers_in_bulk'),
+    path('api/v1/transfer/batch/<str:action>', views.batch_change_transfers, name='batch_change_transfers'),
     path('api/v1/transfer/all', views.get_all_transfers, name='get_all_transfers'),
     path('api/v1/transfer/<int:transfer_id>/', views.get_delete_update_transfer, name='get_delete_update_transfer'),
+    path('api/v1/transfer/filter', views.query_transfers, name='query_transfers'),
+    path('api/v1/transfer/search', views.search_transfers, name='search_transfers'),
     path('api/v1/transfer/filter/<str:filter_type>/<str:filter>/', views.filter_transfers, name='filter_transfers'),
+    path('api/v1/transfer/export', views.export_transfers, name='export_transfers'),
     path('api/v1/transfer/total', views.get_transfer_total, name='get_transfer_total'),
+    path('api/v1/transfer/totals', views.get_transfer_totals, name='get_transfer_totals'),
+    path('api/v1/transfer/summary', views.get_transfer_summary, name='get_transfer_summary'),
+    path('api/v1/transfer/analytics', views.get_transfer_analytics, name='get_transfer_analytics'),
+    path('api/v1/cache/stats', views.get_lookup_cache_stats, name='get_lookup_cache_stats'),
+    path('metrics', views.get_metrics, name='get_metrics'),
 ]
@@ -1,11 +1,29 @@
-from nix_app.models import User, Transfer
-from rest_framework.decorators import api_view
+import heapq
+from nix_app.analytics import transfer_index
+from nix_app.cache import lookup_cache, user_key, transfer_key
+from nix_app.conditional import conditional
+from nix_app.exports import export_response
+from nix_app.idempotency import idempotent
+from nix_app.middleware import registry
+from nix_app.models import User, Transfer, TransferAggregate, TransferArchive, TransferIntake, TableVersion
+from nix_app.pagination import get_page_size, keyset_page, ranked_page, stream_rows
+from nix_app.parsers import NDJSONParser
+from nix_app.routers import read_replica
+from nix_app.serializers import json_response, transfer_row_serializer, transfer_rows, transfer_values
+from nix_app.throttling import bulkhead
+from rest_framework.decorators import api_view, parser_classes
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework import status
 from django.core.exceptions import ObjectDoesNotExist
-import json
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import reverse
 
+MAX_HISTORY_USERS = 100
 
+
+@idempotent("create_user")
 @api_view(["POST"])
 def create_user(request):
     if request.method == 'POST':
@@ -16,14 +34,14 @@ def create_user(request):
 @api_view(["PUT", "GET", "DELETE"])
 def get_delete_update_user(request, user_id):
     try:
+        if request.method == 'GET':
+            user_dict = lookup_cache().get_or_load(user_key(user_id), lambda: User.objects.get(id=user_id).as_dict())
+            return json_response(request, user_dict, status.HTTP_201_CREATED)
         user = User.objects.get(id=user_id)
     except ObjectDoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
-    if request.method == 'GET':
-        return Response(json.dumps(user.as_dict()), status=status.HTTP_201_CREATED)
-
-    elif request.method == 'PUT':
+    if request.method == 'PUT':
         user.name = request.data.get('name')
         user.cnpj = request.data.get('cnpj')
         user.save()
@@ -34,16 +52,58 @@ def get_delete_update_user(request, user_id):
         return Response(status=status.HTTP_200_OK)
 
 
+@read_replica
+@api_view(["GET"])
+def get_user_transfers(request, user_id):
+    if request.method == 'GET':
+        try:
+            history = User.transfer_history([user_id], {user_id: request.query_params.get('cursor')},
+                                            get_page_size(request.query_params))
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        if not history:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return json_response(request, history[0])
+
+
+@bulkhead("heavy")
+@read_replica
+@api_view(["GET"])
+def get_users_transfers(request):
+    if request.method == 'GET':
+        try:
+            user_ids = sorted({int(user_id) for user_id in request.query_params.get('ids', '').split(',')})
+            if len(user_ids) > MAX_HISTORY_USERS:
+                raise ValueError("At most {} users per request".format(MAX_HISTORY_USERS))
+            cursors = {user_id: request.query_params.get('cursor_{}'.format(user_id)) for user_id in user_ids}
+            history = User.transfer_history(user_ids, cursors, get_page_size(request.query_params))
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        return json_response(request, history)
+
+
+@read_replica
+@conditional(TableVersion.USERS)
+@bulkhead("heavy")
 @api_view(["GET"])
 def get_all_users(request):
     if request.method == 'GET':
+        paginated_response = _paginate_or_stream(request, User.objects.values())
+        if paginated_response is not None:
+            return paginated_response
         all_users = list(User.objects.values())
-        return Response(json.dumps(all_users), status=status.HTTP_200_OK)
+        return json_response(request, all_users)
 
 
+@idempotent("create_transfer")
 @api_view(["POST"])
 def create_transfer(request):
     if request.method == 'POST':
+        if _wants_async_intake(request):
+            intake = TransferIntake.enqueue(request.data)
+            response = json_response(request, {'tracking_id': intake.id}, status.HTTP_202_ACCEPTED)
+            response['Location'] = reverse('get_transfer_intake', kwargs={'intake_id': intake.id})
+            return response
         try:
             transfer = Transfer()
             transfer.get_data_from_dict(request.data)
@@ -53,17 +113,82 @@ def create_transfer(request):
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
+def _wants_async_intake(request):
+    return settings.NIX_ASYNC_TRANSFER_INTAKE or 'respond-async' in request.META.get('HTTP_PREFER', '')
+
+
+@api_view(["GET"])
+def get_transfer_intake(request, intake_id):
+    if request.method == 'GET':
+        try:
+            intake = TransferIntake.objects.get(id=intake_id)
+            return json_response(request, intake.as_dict())
+        except ObjectDoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+
+@api_view(["GET"])
+def get_transfer_intake_progress(request):
+    if request.method == 'GET':
+        return json_response(request, TransferIntake.progress())
+
+
+@bulkhead("heavy")
+@api_view(["POST"])
+@parser_classes([JSONParser, NDJSONParser])
+def create_transfers_in_bulk(request):
+    if request.method == 'POST':
+        if not isinstance(request.data, list):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        try:
+            batch_size = int(request.query_params.get('batch_size', Transfer.BULK_CREATE_BATCH_SIZE))
+            if batch_size < 1:
+                raise ValueError("Batch size must be positive, got {}".format(batch_size))
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        created, errors = Transfer.bulk_create_from_dicts(request.data, batch_size)
+        response_status = status.HTTP_207_MULTI_STATUS if errors else status.HTTP_201_CREATED
+        return json_response(request, {'created': created, 'errors': errors}, response_status)
+
+
+@bulkhead("heavy")
+@api_view(["POST"])
+def batch_change_transfers(request, action):
+    if request.method == 'POST':
+        if action not in Transfer.BATCH_ACTIONS:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        if not isinstance(request.data, dict):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        try:
+            transfers = Transfer.objects.filter(is_deleted=action == 'restore')
+            transfer_ids = request.data.get('ids')
+            if transfer_ids is not None:
+                transfer_ids = [int(transfer_id) for transfer_id in transfer_ids]
+            elif set(request.query_params) & (set(Transfer.FILTER_LOOKUPS) | {'date'}):
+                transfers = Transfer.filter_by_params(request.query_params, transfers)
+            else:
+                raise ValueError("Batch changes need ids or filters")
+            chunk_size = int(request.query_params.get('chunk_size', Transfer.BATCH_CHANGE_CHUNK_SIZE))
+            if chunk_size < 1:
+                raise ValueError("Chunk size must be positive, got {}".format(chunk_size))
+            counts = Transfer.batch_change(action, transfers, request.data.get('values'), transfer_ids, chunk_size)
+        except (TypeError, ValueError):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        return json_response(request, counts)
+
+
 @api_view(["PUT", "GET", "DELETE"])
 def get_delete_update_transfer(request, transfer_id):
     try:
+        if request.method == 'GET':
+            transfer_dict = lookup_cache().get_or_load(
+                transfer_key(transfer_id), lambda: Transfer.non_deleted_objects().get(id=transfer_id).as_dict())
+            return json_response(request, transfer_dict, status.HTTP_201_CREATED)
         transfer = Transfer.non_deleted_objects().get(id=transfer_id)
     except ObjectDoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
-    if request.method == 'GET':
-        return Response(json.dumps(transfer.as_dict()), status=status.HTTP_201_CREATED)
-
-    elif request.method == 'PUT':
+    if request.method == 'PUT':
         transfer.get_data_from_dict(request.data)
         transfer.save()
         return Response(status=status.HTTP_200_OK)
@@ -73,20 +198,46 @@ def get_delete_update_transfer(request, transfer_id):
         return Response(status=status.HTTP_200_OK)
 
 
+@read_replica
+@conditional(TableVersion.TRANSFERS)
+@bulkhead("heavy")
 @api_view(["GET"])
 def get_all_transfers(request):
     if request.method == 'GET':
-        all_transfers_as_dict = []
-        for transfer in Transfer.non_deleted_objects().all():
-            all_transfers_as_dict.append(transfer.as_dict())
-        return Response(json.dumps(all_transfers_as_dict), status=status.HTTP_200_OK)
+        paginated_response = _paginate_or_stream(request, transfer_values(Transfer.non_deleted_objects()),
+                                                 transfer_row_serializer())
+        if paginated_response is not None:
+            return paginated_response
+        return json_response(request, transfer_rows(Transfer.non_deleted_objects()))
+
+
+def _paginate_or_stream(request, queryset, serialize=None):
+    try:
+        if request.query_params.get('stream'):
+            return stream_rows(queryset, request.query_params['stream'], serialize)
+        if 'cursor' in request.query_params or 'limit' in request.query_params:
+            page = keyset_page(queryset, request.query_params.get('cursor'),
+                               get_page_size(request.query_params), serialize)
+            return json_response(request, page)
+    except ValueError:
+        return Response(status=status.HTTP_400_BAD_REQUEST)
+    return None
 
+
+@bulkhead("heavy")
+@read_replica
 @api_view(["GET"])
 def filter_transfers(request, filter_type, filter):
     if request.method == 'GET':
-        filtered_transfers_as_dict = []
         if filter_type == "date":
-            filtered_transfers = Transfer.non_deleted_objects().filter(creation_date__contains=filter)
+            try:
+                filtered_transfers = Transfer.non_deleted_objects().filter(**Transfer.creation_date_filter(filter))
+                if request.query_params.get('archived', '').lower() in ('1', 'true'):
+                    return json_response(request, list(heapq.merge(
+                        transfer_rows(filtered_transfers), transfer_rows(TransferArchive.filter_by_date(filter)),
+                        key=lambda row: row['id'])))
+            except ValueError:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
         elif filter_type == "payer":
             filtered_transfers = Transfer.non_deleted_objects().filter(payers_name=filter)
         elif filter_type == "receiver":
@@ -94,16 +245,121 @@ def filter_transfers(request, filter_type, filter):
         else:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        for transfer in filtered_transfers:
-            filtered_transfers_as_dict.append(transfer.as_dict())
+        return json_response(request, transfer_rows(filtered_transfers))
+
+
+@read_replica
+@api_view(["GET"])
+def search_transfers(request):
+    if request.method == 'GET':
+        try:
+            field = request.query_params.get('field', 'payer')
+            transfers = Transfer.search_by_name(field, request.query_params.get('q', ''))
+            fields = Transfer.projection_fields(request.query_params.get('fields'))
+            search_field = Transfer.SEARCH_FIELDS[field][1]
+            rows = transfers.values_list('id', *[name for name in fields if name != 'id'], search_field)
+            page = ranked_page(rows, search_field, request.query_params.get('cursor'),
+                               get_page_size(request.query_params), transfer_row_serializer(fields))
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        return json_response(request, page)
+
+
+@bulkhead("heavy")
+@read_replica
+@api_view(["GET"])
+def query_transfers(request):
+    if request.method == 'GET':
+        try:
+            fields = Transfer.projection_fields(request.query_params.get('fields'))
+            transfers = Transfer.filter_by_params(request.query_params)
+            paginated_response = _paginate_or_stream(request, transfer_values(transfers, fields),
+                                                     transfer_row_serializer(fields))
+            if paginated_response is not None:
+                return paginated_response
+            return json_response(request, transfer_rows(transfers, fields))
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+@bulkhead("heavy")
+@read_replica
+@api_view(["GET"])
+def export_transfers(request):
+    if request.method == 'GET':
+        try:
+            after_id = request.query_params.get('after')
+            return export_response(Transfer.filter_by_params(request.query_params),
+                                   request.query_params.get('export', 'csv'),
+                                   Transfer.projection_fields(request.query_params.get('fields')),
+                                   int(after_id) if after_id else None,
+                                   request.query_params.get('gzip', '').lower() in ('1', 'true'))
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(["GET"])
+def get_lookup_cache_stats(request):
+    if request.method == 'GET':
+        return json_response(request, lookup_cache().stats())
 
-        return Response(json.dumps(filtered_transfers_as_dict), status=status.HTTP_200_OK)
 
+@api_view(["GET"])
+def get_metrics(request):
+    if request.method == 'GET':
+        return HttpResponse(registry.as_prometheus_text(), content_type='text/plain; version=0.0.4')
+
+
+@read_replica
+@conditional(TableVersion.TRANSFERS)
 @api_view(["GET"])
 def get_transfer_total(request):
     if request.method == 'GET':
-        all_transfers = Transfer.non_deleted_objects().all()
-        transfer_total = 0
-        for transfer in all_transfers:
-            transfer_total += transfer.transfer_value
-        return Response(json.dumps({'transfer_total': transfer_total}), status=status.HTTP_200_OK)
\ No newline at end of file
+        return json_response(request, {'transfer_total': Transfer.transfer_total()})
+
+
+@read_replica
+@api_view(["GET"])
+def get_transfer_totals(request):
+    if request.method == 'GET':
+        try:
+            totals = TransferAggregate.totals(request.query_params.get('group_by'))
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        return json_response(request, totals)
+
+
+@bulkhead("heavy")
+@read_replica
+@api_view(["GET"])
+def get_transfer_summary(request):
+    if request.method == 'GET':
+        try:
+            summary = Transfer.summary(request.query_params.get('group_by'))
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        return json_response(request, summary)
+
+
+@api_view(["GET"])
+def get_transfer_analytics(request):
+    if request.method == 'GET':
+        index = transfer_index()
+        if index is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        params = request.query_params
+        try:
+            days = int(params['days']) if params.get('days') else None
+            operation = params.get('op', 'group_by')
+            if operation == 'group_by':
+                result = index.group_by(params.get('by'), days)
+            elif operation == 'top':
+                result = index.group_by(params.get('by'), days, int(params.get('k', 10)))
+            elif operation == 'histogram':
+                edges = [int(edge) for edge in params['edges'].split(',')] if params.get('edges') else None
+                result = index.histogram(days, edges)
+            else:
+                raise ValueError(operation)
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        return json_response(request, result)
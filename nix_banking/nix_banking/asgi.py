@@ -0,0 +1,18 @@
+"""
+ASGI config for nix_banking project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Run it with an ASGI server, e.g. "uvicorn nix_banking.asgi:application".
+"""
+
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nix_banking.settings')
+
+django.setup(set_prefix=False)
+
+from nix_app.asgi import ASGIHandler  # noqa: E402
+
+application = ASGIHandler()